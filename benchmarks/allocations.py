@@ -0,0 +1,137 @@
+"""
+Allocations per step of the interpreters
+
+Programs are run one step at a time through the same loop that run() and
+eval() use for each engine, or one compiled trace at a time where the trace
+engine has one, with tracemalloc. A step counts as allocating if the traced
+memory peaked above what was in use before it by more than a call of the loop
+that runs no step at all usually does, which is what it takes to set up and
+return a StepResult. The bytes per step are how far the peaks went beyond
+that.
+
+A step that allocates several blocks is counted once, and an allocation that
+is freed before the call returns is hidden by the return if it is smaller, so
+this is a lower bound. The bytes per step still grow with every block that is
+alive at the same time as the others.
+
+None of the engines allocates on the programs here (on Python 3.11). The run
+loops count steps by iterating over an itertools.repeat (see steps_left() of
+esoteric.interpreter) rather than adding 1 to an int, which made a new one of
+32 bytes on every step once the count was past the small ints that Python
+caches. The classic engine also made a StepResult of 48 bytes for every step,
+and now only makes one for steps with an action.
+
+    python -m benchmarks.allocations [steps]
+"""
+
+import sys
+import tracemalloc
+
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+from esoteric.interpreter import Actions
+from esoteric.streams import EOF
+
+# Calls that run no step, to measure what a call itself allocates
+CALIBRATION = 100
+
+# Counters that loop forever without I/O or a growing stack
+PROGRAMS = {
+    "befunge": (Befunge, "0>1+9%v\n ^    <"),
+    "fish": (Fish, "0>1+9%v\n ^    <"),
+}
+
+
+def measure(
+    interpreter, steps: int, warmup: int = 1000, every: int = 1
+) -> tuple[float, float]:
+    """Allocating steps and traced bytes, both per step
+
+    Measures at most steps steps, less if the program stops before that, and
+    only one in every steps of those, running the ones in between at once.
+    Input instructions get the end of input.
+    """
+    if interpreter.engine == "classic":
+        loop = interpreter._step_until
+    else:
+        loop = interpreter._execute
+    # Compiled traces are run whole, and only if they fit before the step to
+    # stop at
+    traces = interpreter.traces if interpreter.engine == "trace" else None
+
+    def length() -> int:
+        """Steps of what runs next, a compiled trace or a single step"""
+        if traces is None or interpreter.stringmode:
+            return 1
+        key = (interpreter.x, interpreter.y, interpreter.dx, interpreter.dy)
+        trace = traces.get(key)
+        return trace.length if trace else 1
+
+    def handle(action) -> bool:
+        """Whether the program goes on after action"""
+        if action in (Actions.STRING_INPUT, Actions.INT_INPUT):
+            interpreter.recv(EOF)
+        return action not in (Actions.HALT, Actions.ERROR, Actions.LIMIT)
+
+    def execute(until: int) -> bool:
+        return handle(loop(until)[1])
+
+    # Warm up caches, compiled traces and interned objects before measuring
+    running = True
+    for _ in range(warmup):
+        running = execute(interpreter.steps + length())
+        if not running:
+            break
+
+    get_traced_memory = tracemalloc.get_traced_memory
+    reset_peak = tracemalloc.reset_peak
+    tracemalloc.start()
+    overhead = None
+    for _ in range(CALIBRATION):
+        until = interpreter.steps
+        before = get_traced_memory()[0]
+        reset_peak()
+        loop(until)
+        peak = get_traced_memory()[1] - before
+        # Not the most, a dict or the heap may happen to grow during one call
+        overhead = peak if overhead is None else min(overhead, peak)
+
+    allocating = 0
+    allocated = 0
+    # Steps that were measured
+    sampled = 0
+    end = interpreter.steps + steps
+    while running and interpreter.steps < end:
+        if every > 1:
+            running = execute(min(interpreter.steps + every - 1, end))
+            if not running or interpreter.steps >= end:
+                break
+        first = interpreter.steps
+        until = first + length()
+        # Reading the traced memory allocates its result, before the reset
+        before = get_traced_memory()[0]
+        reset_peak()
+        result = loop(until)
+        peak = get_traced_memory()[1] - before
+        running = handle(result[1])
+        sampled += interpreter.steps - first
+        if peak > overhead:
+            allocating += 1
+            allocated += peak - overhead
+    tracemalloc.stop()
+
+    sampled = max(sampled, 1)
+    return allocating / sampled, allocated / sampled
+
+
+def main(steps: int = 100_000):
+    print(f"{'program':<10}{'engine':<10}{'allocs/step':>14}{'bytes/step':>14}")
+    for name, (language, code) in PROGRAMS.items():
+        for engine in language.engines:
+            interpreter = language.from_string(code, engine=engine)
+            allocs, size = measure(interpreter, steps)
+            print(f"{name:<10}{engine:<10}{allocs:>14.4f}{size:>14.2f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,73 @@
+"""
+Startup time of the command line
+
+Runs python -m esoteric on small programs in fresh processes and reports the
+best wall time of a few runs, along with the modules that only the GUI needs
+if any of them were imported by a headless run.
+
+    python -m benchmarks.startup [runs]
+"""
+
+from time import perf_counter
+import os
+import subprocess
+import sys
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(__file__)), "examples")
+
+# Name: arguments of python -m esoteric
+RUNS = {
+    "fish": [os.path.join(EXAMPLES, "hello_world.fish")],
+    "befunge": [os.path.join(EXAMPLES, "hello_world.befunge")],
+    "help": ["--help"],
+}
+# Reference point, the interpreter alone
+BARE = [sys.executable, "-c", "pass"]
+
+GUI_ONLY = ("curses", "esoteric.gui", "esoteric.breakpoints")
+
+# Prints the modules the GUI needs that were imported, once main() is done
+PROBE = """
+import atexit, sys
+
+def report():
+    print(*[name for name in {gui!r} if name in sys.modules], file=sys.stderr)
+
+atexit.register(report)
+sys.argv = ["esoteric", *{args!r}]
+from esoteric.__main__ import main
+main()
+"""
+
+
+def best(command: list[str], runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        start = perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def gui_modules(args: list[str]) -> list[str]:
+    probe = PROBE.format(gui=GUI_ONLY, args=args)
+    result = subprocess.run(
+        [sys.executable, "-c", probe],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    return result.stderr.split()
+
+
+def main(runs: int = 10):
+    print(f"{'':<12}{'seconds':>10}  GUI modules imported", file=sys.stderr)
+    print(f"{'python':<12}{best(BARE, runs):>10.3f}", file=sys.stderr)
+    for name, args in RUNS.items():
+        seconds = best([sys.executable, "-m", "esoteric", *args], runs)
+        imported = ", ".join(gui_modules(args)) or "none"
+        print(f"{name:<12}{seconds:>10.3f}  {imported}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
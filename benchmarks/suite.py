@@ -0,0 +1,294 @@
+"""
+Benchmark suite of the interpreters
+
+Runs eval() of the examples and of generated stress programs on every engine,
+and reports steps per second, allocating steps and allocated bytes per step
+(see benchmarks.allocations) and peak traced memory. Programs that do not halt
+by themselves are stopped after a number of steps. The time and peak memory
+it takes to load a large generated program, from a string and from a file,
+are reported as well.
+
+Results are saved as JSON, and compared with a baseline saved earlier, to
+catch regressions in the hot paths of the interpreters:
+
+    python -m benchmarks.suite --save baseline.json
+    python -m benchmarks.suite --baseline baseline.json
+
+The exit status is 1 if anything got slower or allocates more than the
+threshold allows.
+"""
+
+from time import perf_counter
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import tracemalloc
+
+from benchmarks.allocations import measure
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+from esoteric.interpreter import Limits
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(__file__)), "examples")
+
+# Steps after which programs are stopped
+STEPS = 200_000
+# Short programs are run again until this many seconds have passed
+MIN_TIME = 0.2
+# Allocations are measured on one in this many steps
+ALLOCATION_SAMPLE = 10
+
+
+def _rows(*rows: str) -> str:
+    return "\n".join(rows)
+
+
+# Name: (language, code, initial value, steps)
+STRESS = {
+    # Counts up with some arithmetic on every iteration
+    "arithmetic loop": (
+        Befunge,
+        _rows("0>1+:3*7%2/$v", " ^          <"),
+        None,
+        STEPS,
+    ),
+    "fish arithmetic loop": (
+        Fish,
+        _rows("0>1+:3*7%2-$v", " ^          <"),
+        None,
+        STEPS,
+    ),
+    # Increments a counter kept in the board and writes it all over row 3,
+    # which the @ that is never run makes as wide as the writes need
+    "g/p memory": (
+        Befunge,
+        _rows("11g1+:11p:55+5*%3p:3g$", "", "", "@".rjust(60)),
+        None,
+        STEPS,
+    ),
+    # The same, but also writing far outside the codebox
+    "fish g/p memory": (
+        Fish,
+        _rows("11g1+:11p:a5*%3p:3g~:a5*%f0*p".ljust(60), "", "", ""),
+        None,
+        STEPS,
+    ),
+    # Pushes a new stack with one value on every iteration, never popping
+    "stack of stacks": (Fish, "11[", None, STEPS),
+    # Moves a value into a new stack and back, as the stack grows
+    "stack of stacks churn": (Fish, "11[]", None, STEPS // 10),
+    # Pushes 10000 values, moves the top half to a new stack, and then keeps
+    # reversing, rotating, pushing and popping that one
+    "stack of stacks rearrange": (
+        Fish,
+        _rows(">:1+:aa*:*=?v", "   v[*2*:*5a<", "r{}>:$~}{r"),
+        0,
+        STEPS,
+    ),
+    "output flood": (Befunge, '"a",', None, STEPS),
+    "fish output flood": (Fish, "'a'o", None, STEPS),
+}
+
+
+# Rows and columns of the program that is loaded
+LOAD_SIZE = 512
+
+
+def workloads() -> dict:
+    """Examples and stress programs by name"""
+    jobs = {}
+    for name in sorted(os.listdir(EXAMPLES)):
+        language = Fish if name.endswith(".fish") else Befunge
+        with open(os.path.join(EXAMPLES, name)) as file:
+            code = file.read()
+        value = 10 if name.startswith("factorial") else None
+        jobs[name] = (language, code, value, STEPS)
+    jobs.update(STRESS)
+    return jobs
+
+
+def _load(language, code: str, value, engine: str, steps: int):
+    program = language.from_string(code, engine=engine, limits=Limits(steps=steps))
+    if value is not None:
+        program.stack = [value]
+    return program
+
+
+def _eval(program):
+    try:
+        program.eval("")
+    except Exception:
+        # Errors and limits are part of some workloads
+        pass
+
+
+def bench(language, code: str, value, engine: str, steps: int, repeat: int) -> dict:
+    best = 0.0
+    for _ in range(repeat):
+        total = 0
+        start = perf_counter()
+        while (elapsed := perf_counter() - start) < MIN_TIME:
+            program = _load(language, code, value, engine, steps)
+            _eval(program)
+            total += program.steps
+        best = max(best, total / elapsed)
+    ran = program.steps
+
+    program = _load(language, code, value, engine, steps)
+    tracemalloc.start()
+    _eval(program)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    program = _load(language, code, value, engine, steps)
+    allocs, size = measure(program, steps, warmup=0, every=ALLOCATION_SAMPLE)
+    return {
+        "steps": ran,
+        "steps_per_sec": best,
+        "allocs_per_step": allocs,
+        "bytes_per_step": size,
+        "peak_kib": peak / 1024,
+    }
+
+
+def bench_load(language, path: str, how: str, repeat: int) -> dict:
+    """Time and peak memory of loading the program at path"""
+
+    def load():
+        if how == "from_file":
+            return language.from_file(path)
+        with open(path) as file:
+            return language.from_string(file.read())
+
+    best = min(_timed(load) for _ in range(repeat))
+    tracemalloc.start()
+    program = load()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del program
+    return {"seconds": best, "peak_kib": peak / 1024}
+
+
+def _timed(function) -> float:
+    start = perf_counter()
+    function()
+    return perf_counter() - start
+
+
+def loads(repeat: int = 3) -> dict:
+    """Results of loading a large random program, printing them to stderr"""
+    rng = random.Random(0)
+    rows = [
+        "".join(rng.choices("0123456789+-*:$>v<^ ", k=LOAD_SIZE))
+        for _ in range(LOAD_SIZE)
+    ]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "large")
+        with open(path, "w") as file:
+            file.write("\n".join(rows))
+        print(f"\n{'':<36}{'seconds':>14}{'':>20}{'peak KiB':>12}", file=sys.stderr)
+        for language in (Befunge, Fish):
+            for how in ("from_string", "from_file"):
+                key = f"load {LOAD_SIZE}x{LOAD_SIZE}/{language.__name__}/{how}"
+                result = results[key] = bench_load(language, path, how, repeat)
+                print(
+                    f"{key:<36}{result['seconds']:>14.3f}{'':>20}"
+                    f"{result['peak_kib']:>12,.1f}",
+                    file=sys.stderr,
+                    flush=True,
+                )
+    return results
+
+
+HEADER = f"{'':<36}{'steps/sec':>14}{'allocs':>10}{'bytes':>10}{'peak KiB':>12}"
+
+
+def run(repeat: int = 3, only: str = None) -> dict:
+    """Results of the workloads, printing them to stderr as they come"""
+    results = {}
+    print(HEADER, file=sys.stderr)
+    for name, (language, code, value, steps) in workloads().items():
+        if only is not None and only not in name:
+            continue
+        for engine in language.engines:
+            key = f"{name}/{engine}"
+            results[key] = bench(language, code, value, engine, steps, repeat)
+            print(_format(key, results[key]), file=sys.stderr, flush=True)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+        "loads": loads(repeat) if only is None or "load" in only else {},
+    }
+
+
+def _format(key: str, result: dict, change: str = "") -> str:
+    return (
+        f"{key:<36}{result['steps_per_sec']:>14,.0f}"
+        f"{result['allocs_per_step']:>10.4f}{result['bytes_per_step']:>10.2f}"
+        f"{result['peak_kib']:>12,.1f}{change}"
+    )
+
+
+def _grew(result: dict, old: dict, key: str, threshold: float, slack: float) -> bool:
+    # Baselines from before bytes were compared do not have them
+    return key in old and result[key] > old[key] * (1 + threshold) + slack
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Keys of the results that regressed from the baseline"""
+    regressions = []
+    print(f"{HEADER}  change")
+    for key, result in current["results"].items():
+        old = baseline["results"].get(key)
+        if old is None:
+            print(_format(key, result, "  new"))
+            continue
+        speed = result["steps_per_sec"] / old["steps_per_sec"] - 1
+        # Allocating steps stop at 1 per step, more blocks show in the bytes
+        regressed = (
+            speed < -threshold
+            or _grew(result, old, "allocs_per_step", threshold, 0.01)
+            or _grew(result, old, "bytes_per_step", threshold, 1.0)
+        )
+        if regressed:
+            regressions.append(key)
+        print(_format(key, result, f"  {speed:+.1%}{'  !' if regressed else ''}"))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--save", metavar="PATH", help="Write the results here")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare with these")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown that counts as a regression (default 0.1)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Best of this many")
+    parser.add_argument("--only", help="Only workloads with this in their name")
+    args = parser.parse_args(argv)
+
+    current = run(args.repeat, args.only)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(current, file, indent=2)
+            file.write("\n")
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"Regressed: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
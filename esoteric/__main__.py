@@ -1,10 +1,18 @@
+import json
+import os
 import sys
 
 import click
 
-import esoteric.gui as gui
-from esoteric.befunge import Befunge
-from esoteric.fish import Fish
+from esoteric import languages
+from esoteric.interpreter import (
+    CHECK_INTERVAL,
+    ENGINES,
+    Interpreter,
+    LimitExceeded,
+    Limits,
+)
+from esoteric.streams import FLUSH_POLICIES
 
 
 @click.command()
@@ -30,16 +38,291 @@ from esoteric.fish import Fish
     "-l",
     "--language",
     default=None,
-    type=click.Choice(["befunge", "fish"]),
+    metavar="NAME",
     required=False,
-    help="Which esoteric language to interpret – include this when executing from stdin or a file without a proper extension.",
+    help="Which esoteric language to interpret, like befunge or fish – include this when executing from stdin or a file without a proper extension.",
+)
+@click.option(
+    "-e",
+    "--engine",
+    default="table",
+    type=click.Choice(ENGINES),
+    show_default=True,
+    help="Execution engine – classic steps through an if/elif chain, table dispatches decoded opcodes and trace also compiles hot loops (Befunge only).",
+)
+@click.option(
+    "-f",
+    "--flush",
+    default=None,
+    type=click.Choice(FLUSH_POLICIES),
+    help="When to write buffered output – in blocks, on every newline or on every output instruction.  [default: line if stdout is a terminal, else block]",
+)
+@click.option(
+    "-b",
+    "--batch",
+    "batch_source",
+    default=None,
+    metavar="SOURCE",
+    help="Run every program in a directory, glob or manifest headless on all cores and print one JSON result per line.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of worker processes for --batch.  [default: number of cores]",
+)
+@click.option(
+    "--serve",
+    "serve_path",
+    default=None,
+    metavar="SOCKET",
+    help="Run a daemon on this Unix socket with --jobs warm workers that keep parsed programs, instead of running a program.",
+)
+@click.option(
+    "--connect",
+    "connect_path",
+    default=None,
+    metavar="SOCKET",
+    help="Run the program headless on the daemon started with --serve on this socket.",
+)
+@click.option(
+    "--sweep",
+    "sweep_values",
+    default=None,
+    metavar="VALUES",
+    help="Run the program headless once for every initial value, like 0:1000 or 1,5,10:20:2, in lockstep (needs NumPy), and print one JSON result per line.",
+)
+@click.option(
+    "--max-steps",
+    default=None,
+    type=click.IntRange(min=0),
+    help="Stop after this many steps.",
+)
+@click.option(
+    "--timeout",
+    default=None,
+    type=click.FloatRange(min=0),
+    help="Stop after this many seconds.",
+)
+@click.option(
+    "--max-stack",
+    default=None,
+    type=click.IntRange(min=0),
+    help="Stop if there are more than this many values on the stack(s).",
+)
+@click.option(
+    "--max-cells",
+    default=None,
+    type=click.IntRange(min=0),
+    help="Stop if p fills more than this many cells beyond the codebox (Fish only).",
+)
+@click.option(
+    "--compact-stack",
+    is_flag=True,
+    help="Keep the stack(s) in an array of 64-bit integers, which takes far less memory for many values but is slower, until a larger number or a float is pushed.",
+)
+@click.option(
+    "--detect-loops",
+    is_flag=True,
+    help="Stop if the program provably runs forever, because its state comes back without any input or randomness in between.",
+)
+@click.option(
+    "--snapshot",
+    "snapshot_path",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Save the state of the program here if it is stopped by a limit, to continue it later with --resume.",
+)
+@click.option(
+    "--resume",
+    "resume_path",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Continue the program saved with --snapshot instead of starting one.",
+)
+@click.option(
+    "-p",
+    "--profile",
+    "profile_path",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Count executions per cell and instruction and write them to this file when done, as CSV if it ends in .csv and as JSON otherwise.",
+)
+@click.option(
+    "--cfg",
+    "cfg_path",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the static control-flow graph of the program to this file instead of running it, as DOT if it ends in .dot and as JSON otherwise.",
 )
-def main(filepath, use_gui, value, language):
+@click.option(
+    "--compile",
+    "compile_path",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Compile the Fish program to a Python module at this path instead of running it, or run it as usual if it uses p or . (see Compiling Fish in the README).",
+)
+@click.option(
+    "--break",
+    "break_cells",
+    multiple=True,
+    metavar="X,Y",
+    help="Pause the GUI before the cell at X,Y is run (may be repeated).",
+)
+@click.option(
+    "--break-on",
+    "break_opcodes",
+    multiple=True,
+    metavar="CHAR",
+    help="Pause the GUI before any cell with this instruction is run (may be repeated).",
+)
+@click.option(
+    "--watch",
+    "watches",
+    multiple=True,
+    metavar="CONDITION",
+    help='Pause the GUI once a condition like "depth > 100", "top == 0", "register != 5" or \'output contains "done"\' is true (may be repeated).',
+)
+@click.option(
+    "--rewind",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of steps that can be undone in the GUI.  [default: 1048576]",
+)
+def main(
+    filepath,
+    use_gui,
+    value,
+    language,
+    engine,
+    flush,
+    batch_source,
+    jobs,
+    serve_path,
+    connect_path,
+    sweep_values,
+    max_steps,
+    timeout,
+    max_stack,
+    max_cells,
+    compact_stack,
+    detect_loops,
+    snapshot_path,
+    resume_path,
+    profile_path,
+    cfg_path,
+    compile_path,
+    break_cells,
+    break_opcodes,
+    watches,
+    rewind,
+):
+    # Only what an invocation uses is imported, headless runs never import curses
+    if batch_source is not None:
+        run_batch(
+            batch_source,
+            jobs,
+            value=value,
+            language=language,
+            engine=engine,
+            max_steps=max_steps,
+            timeout=timeout,
+            max_stack=max_stack,
+            max_cells=max_cells,
+            detect_loops=detect_loops,
+            compact_stack=compact_stack,
+        )
+        return
+
+    if serve_path is not None:
+        from esoteric.daemon import serve
+
+        serve(serve_path, jobs)
+        return
+
+    if connect_path is not None:
+        if sweep_values is not None:
+            raise click.UsageError("--sweep runs programs here, not on a daemon")
+        local = use_gui or snapshot_path or resume_path or profile_path or cfg_path
+        if local or compile_path:
+            raise click.UsageError("--connect only runs programs headless")
+        run_remote(
+            connect_path,
+            filepath,
+            language,
+            value=value,
+            engine=engine,
+            flush=flush,
+            max_steps=max_steps,
+            timeout=timeout,
+            max_stack=max_stack,
+            max_cells=max_cells,
+            detect_loops=detect_loops,
+            compact_stack=compact_stack,
+        )
+        return
+
+    loops = CHECK_INTERVAL if detect_loops else None
+    limits = Limits(max_steps, timeout, max_stack, max_cells, loops)
+    if resume_path is not None:
+        program = resume(resume_path, engine, limits)
+    else:
+        program = load(filepath, value, language, engine, limits, compact_stack)
+
+    if sweep_values is not None:
+        local = use_gui or snapshot_path or resume_path or profile_path or cfg_path
+        if local or compile_path:
+            raise click.UsageError("--sweep only runs programs headless")
+        run_sweep(program, sweep_values)
+        return
+
+    if compile_path is not None:
+        if use_gui or resume_path or profile_path or cfg_path:
+            raise click.UsageError(
+                "--compile does not go with --use-gui, --resume, --profile or --cfg"
+            )
+        if compile_program(program, compile_path):
+            return
+
+    if cfg_path is not None:
+        from esoteric.cfg import ControlFlowGraph
+
+        graph = ControlFlowGraph(program)
+        graph.save(cfg_path)
+        for reason in graph.unsound():
+            print(f"Not in the graph: {reason}", file=sys.stderr)
+        return
+
+    if profile_path is not None:
+        program.start_profile()
+
+    try:
+        if use_gui:
+            import esoteric.gui as gui
+
+            gui.main(
+                program, breakpoints(break_cells, break_opcodes, watches), rewind
+            )
+        else:
+            program.run(flush=flush)
+    except LimitExceeded as err:
+        print(f"\nStopped: {err}", file=sys.stderr)
+        if snapshot_path is not None:
+            with open(snapshot_path, "wb") as file:
+                file.write(program.snapshot())
+        exit(2)
+    finally:
+        if profile_path is not None:
+            program.profile.save(profile_path)
+
+
+def read(filepath, language):
     code = ""
     if filepath is not None:
         with open(filepath) as file:
             if language is None:
-                language = filepath.split(".")[-1]
+                language = languages.of_path(filepath)
             code = file.read()
     else:
         code = sys.stdin.read()
@@ -47,19 +330,146 @@ def main(filepath, use_gui, value, language):
     if code == "":
         print("No code in stdin or file", file=sys.stderr)
         exit(1)
+    return code, language
+
 
-    if language == "fish":
-        program = Fish.from_string(code)
+def load(filepath, value, language, engine, limits, compact=False):
+    if filepath is None:
+        code, language = read(filepath, language)
     else:
-        program = Befunge.from_string(code)
+        language = language or languages.of_path(filepath)
+        if os.path.getsize(filepath) == 0:
+            print("No code in stdin or file", file=sys.stderr)
+            exit(1)
+    try:
+        interpreter = languages.get(language or languages.DEFAULT)
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="--language")
+    try:
+        if filepath is None:
+            program = interpreter.from_string(
+                code, engine=engine, limits=limits, compact=compact
+            )
+        else:
+            # Mapped instead of read, which matters for large programs
+            program = interpreter.from_file(
+                filepath, engine=engine, limits=limits, compact=compact
+            )
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="--engine")
 
     if value is not None and program.__getattribute__("stack") is not None:
-        program.stack = [value]
+        # Onto the stack the program has, which may be compact
+        program.stack.append(value)
+    return program
 
-    if use_gui:
-        gui.main(program)
-    else:
-        program.run()
+
+def resume(path, engine, limits):
+    with open(path, "rb") as file:
+        data = file.read()
+    try:
+        return Interpreter.restore(data, engine=engine, limits=limits)
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="--resume")
+
+
+def breakpoints(cells, opcodes, watches):
+    try:
+        positions = []
+        for cell in cells:
+            x, y = cell.split(",")
+            positions.append((int(x), int(y)))
+    except ValueError:
+        raise click.BadParameter(f"{cell} is not X,Y", param_hint="--break")
+    from esoteric.breakpoints import Breakpoints
+
+    try:
+        return Breakpoints(positions, opcodes, watches)
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="--watch")
+
+
+def run_remote(path, filepath, language, **request):
+    from esoteric.daemon import connect
+
+    code, language = read(filepath, language)
+    if request["flush"] is None and sys.stdout.isatty():
+        request["flush"] = "line"
+    try:
+        result = connect(path, {"code": code, "language": language, **request})
+    except OSError as err:
+        print(f"No daemon at {path}: {err}", file=sys.stderr)
+        exit(1)
+    if result["exit"] == 2:
+        print(f"\nStopped: {result['error']}", file=sys.stderr)
+    elif result["exit"] != 0:
+        print(result["error"], file=sys.stderr)
+    if result["exit"] != 0:
+        exit(result["exit"])
+
+
+def parse_values(spec):
+    """Values of a list like 1,5,10:20:2 of values and ranges"""
+    values = []
+    try:
+        for part in spec.split(","):
+            bounds = [int(bound) for bound in part.split(":")]
+            if len(bounds) == 1:
+                values.extend(bounds)
+            elif len(bounds) <= 3:
+                values.extend(range(*bounds))
+            else:
+                raise ValueError
+    except ValueError:
+        message = f"{part} is not a value or range"
+        raise click.BadParameter(message, param_hint="--sweep")
+    return values
+
+
+def run_sweep(program, spec):
+    values = parse_values(spec)
+    try:
+        from esoteric.sweep import sweep
+    except ImportError as err:
+        print(f"--sweep: {err}", file=sys.stderr)
+        exit(1)
+    failed = False
+    for result in sweep(program, values):
+        print(json.dumps(result))
+        failed = failed or result["exit"] != 0
+    if failed:
+        exit(1)
+
+
+def compile_program(program, path):
+    """Write the program compiled to path, False if it cannot be compiled"""
+    import esoteric.aot as aot
+
+    reasons = aot.check(program)
+    if reasons:
+        for reason in reasons:
+            print(f"Not compiled: {reason}", file=sys.stderr)
+        print("Running it with the interpreter instead", file=sys.stderr)
+        return False
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "w") as file:
+        file.write(aot.translate(program, name))
+    return True
+
+
+def run_batch(source, processes, **defaults):
+    import esoteric.batch as batch
+
+    jobs = batch.collect(source, **defaults)
+    if not jobs:
+        print(f"No programs found in {source}", file=sys.stderr)
+        exit(1)
+    failed = False
+    for result in batch.run(jobs, processes):
+        print(json.dumps(result), flush=True)
+        failed = failed or result["exit"] != 0
+    if failed:
+        exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+"""
+asyncio driver of the interpreters
+
+run() runs a program in slices of a bounded number of steps and yields to the
+event loop between them, so that thousands of programs can share one loop
+fairly. Input is awaited from a reader like asyncio.StreamReader, and output
+is written at the end of every slice (and before waiting for input) to a
+writer like asyncio.StreamWriter or to a function, which may be async.
+
+Cancelling the task stops the program at the end of a slice, or while it
+waits for input, and it can be run again from there later. The input is kept
+on the interpreter, so that running it again with the same source (or with
+the AsyncInput itself) continues with what was already read from it.
+"""
+
+import asyncio
+import re
+
+from esoteric.interpreter import Actions
+from esoteric.streams import BLOCK_SIZE, Input
+
+# Steps between yields to the event loop
+SLICE = 1 << 12
+
+# A whole number, which is known to have ended once anything else follows it
+NUMBER = re.compile(r"[0-9]+[^0-9]")
+
+
+class AsyncInput(Input):
+    """Input awaited from a reader with an async read(n), or from a string"""
+
+    def __init__(self, source=None):
+        # What the input is read from, to tell whether a run resumes with it
+        self.source = source
+        if source is None or isinstance(source, (str, bytes, bytearray)):
+            super().__init__(source or "")
+            self.reader = None
+        else:
+            super().__init__("")
+            self.reader = source
+
+    def _fill(self) -> bool:
+        # Only what fill() has read is used, reads must not block the loop
+        return False
+
+    async def fill(self) -> bool:
+        """Read more input into the buffer, False at the end of it"""
+        if self.reader is None:
+            return False
+        chunk = await self.reader.read(BLOCK_SIZE)
+        if not chunk:
+            self.reader = None
+            return False
+        self._append(chunk)
+        return True
+
+    async def read_char_async(self) -> int:
+        while self.at >= len(self.buffer) and await self.fill():
+            pass
+        return self.read_char()
+
+    async def read_int_async(self) -> int:
+        while not NUMBER.search(self.buffer, self.at) and await self.fill():
+            pass
+        return self.read_int()
+
+
+class AsyncOutput:
+    """Output collected during a slice and written at the end of it"""
+
+    def __init__(self, target=None):
+        self.target = target
+        self.parts = []
+        # Everything, if there is no target
+        self.text = []
+
+    def write(self, text: str):
+        self.parts.append(text)
+
+    async def flush(self):
+        if not self.parts:
+            return
+        text = "".join(self.parts)
+        self.parts.clear()
+        target = self.target
+        if target is None:
+            self.text.append(text)
+        elif hasattr(target, "drain"):
+            # A stream writer, which takes bytes
+            target.write(text.encode())
+            await target.drain()
+        else:
+            result = (target if callable(target) else target.write)(text)
+            if asyncio.iscoroutine(result):
+                await result
+
+    def getvalue(self) -> str:
+        return "".join(self.text)
+
+
+async def run(interpreter, source=None, target=None, steps: int = SLICE):
+    """Run until halted, reading input from source and writing output to target
+
+    Yields to the event loop every steps steps. Without a source, input is at
+    its end, and without a target, output is discarded.
+    """
+    output = AsyncOutput(target or _discard)
+    await _drive(interpreter, _input(interpreter, source), output, steps)
+
+
+async def eval(interpreter, source=None, steps: int = SLICE) -> str:
+    """Run until halted and return the output"""
+    output = AsyncOutput()
+    await _drive(interpreter, _input(interpreter, source), output, steps)
+    return output.getvalue()
+
+
+def _discard(text: str):
+    pass
+
+
+def _input(interpreter, source) -> AsyncInput:
+    """Input from source, which is the one kept if it was read from before"""
+    if isinstance(source, AsyncInput):
+        kept = source
+    else:
+        kept = interpreter.async_input
+        if kept is None or kept.source is not source:
+            kept = AsyncInput(source)
+    interpreter.async_input = kept
+    return kept
+
+
+async def _drive(interpreter, source: AsyncInput, output: AsyncOutput, steps: int):
+    execute = (
+        interpreter._step_until
+        if interpreter.engine == "classic"
+        else interpreter._execute
+    )
+    try:
+        if interpreter.awaiting is not None:
+            # Cancelled while waiting for this input
+            await _receive(interpreter, interpreter.awaiting, source)
+        end = interpreter.steps + steps
+        while not interpreter.halted:
+            if interpreter.steps >= end:
+                await output.flush()
+                # Let the other tasks run
+                await asyncio.sleep(0)
+                end = interpreter.steps + steps
+            if interpreter.steps >= interpreter.checkpoint:
+                interpreter.check()
+            _, action, value = execute(min(interpreter.checkpoint, end))
+            if action in (Actions.STRING_INPUT, Actions.INT_INPUT):
+                await output.flush()
+                await _receive(interpreter, action, source)
+            elif action == Actions.OUTPUT:
+                output.write(value)
+            elif action == Actions.HALT:
+                interpreter.halted = True
+            elif action == Actions.LIMIT:
+                raise value
+            elif action == Actions.ERROR:
+                raise Exception(value)
+    finally:
+        await output.flush()
+
+
+async def _receive(interpreter, action: Actions, source: AsyncInput):
+    interpreter.awaiting = action
+    if action == Actions.STRING_INPUT:
+        value = await source.read_char_async()
+    else:
+        value = await source.read_int_async()
+    interpreter.awaiting = None
+    interpreter.recv(value)
@@ -0,0 +1,305 @@
+"""
+Ahead-of-time compiler from Fish to Python
+
+A Fish program that never runs p or . always takes the paths of its control-
+flow graph (see esoteric.cfg), through a codebox that never changes. Every
+basic block of the graph becomes straight-line Python code, with the values
+it pushes and pops kept in local variables where possible, and the blocks
+jump to each other by number in a loop. The module that translate() returns
+needs nothing but the standard library:
+
+    python program.py [VALUE ...]
+
+reads stdin and writes stdout with the values on the stack, and its run() and
+eval() do the same from code. Errors are raised where the interpreter raises
+them, although the message may differ when a stack is popped while empty.
+There are no limits, a compiled program runs until it halts.
+"""
+
+from itertools import count
+from math import isfinite
+
+from esoteric.cfg import ControlFlowGraph, FISH, _position
+from esoteric.fish import Fish
+
+BINARY_OPS = {
+    "+": "{b} + {a}",
+    "-": "{b} - {a}",
+    "*": "{b} * {a}",
+    "%": "{b} % {a}",
+    "=": "int({b} == {a})",
+    ")": "int({b} > {a})",
+    "(": "int({b} < {a})",
+}
+
+HEADER = '''"""
+{name}, compiled from Fish by esoteric
+
+Run it with python {name}.py [VALUE ...] to read stdin and write stdout, with
+the values on the stack, or import it and call run() or eval().
+"""
+
+import random
+import sys
+
+# Cells of the codebox that are not empty, for g
+GRID = {grid!r}
+
+
+def run(read, write, stack=()):
+    """Run the program with input from read() and output to write(text)
+
+    read() returns the code point of the next character, or -1 at the end.
+    """
+    s = list(stack)
+    reg = None
+    frames = []
+    block = 0
+    while True:
+'''
+
+FOOTER = '''
+
+def eval(source="", stack=()) -> str:
+    """Output of the program for the input source"""
+    chars = iter(source)
+    output = []
+
+    def read():
+        c = next(chars, None)
+        return -1 if c is None else ord(c)
+
+    run(read, output.append, stack)
+    return "".join(output)
+
+
+def _read():
+    c = sys.stdin.read(1)
+    return ord(c) if c else -1
+
+
+def main():
+    stack = [int(value) for value in sys.argv[1:]]
+    try:
+        run(_read, sys.stdout.write, stack)
+    except Exception as err:
+        sys.stdout.flush()
+        print(f"something smells fishy...\\n{err}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+'''
+
+
+def check(program) -> list[str]:
+    """Why the program cannot be compiled, nothing if it can"""
+    return _graph(program)[1]
+
+
+def translate(program, name: str = "program") -> str:
+    """Source of a Python module that runs the program
+
+    Raises ValueError with the reasons if the program cannot be compiled.
+    """
+    cfg, reasons = _graph(program)
+    if reasons:
+        raise ValueError("; ".join(reasons))
+    index = {block.states[0]: block.index for block in cfg.blocks}
+    bodies = [_block(program, cfg, block, index) for block in cfg.blocks]
+    grid = {}
+    if cfg.reads:
+        grid = {cell: value for cell, value in program.grid.items() if value}
+    lines = _dispatch(bodies, 0, len(bodies))
+    body = "\n".join(" " * 8 + line for line in lines)
+    return HEADER.format(name=name, grid=grid) + body + "\n" + FOOTER
+
+
+def _graph(program) -> tuple:
+    if not isinstance(program, Fish):
+        return None, ["only Fish programs are compiled"]
+    if program.steps:
+        return None, ["the program has already run"]
+    cfg = ControlFlowGraph(program)
+    reasons = [
+        f"p at ({x}, {y}) writes to the codebox"
+        for x, y in sorted(cfg.writes, key=_position)
+    ]
+    reasons += [
+        f". at ({x}, {y}) teleports to a computed cell"
+        for x, y in sorted(cfg.teleports, key=_position)
+    ]
+    return cfg, reasons
+
+
+def _char(value):
+    try:
+        return chr(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _dispatch(bodies: list, lo: int, hi: int) -> list[str]:
+    """Code that runs the body of the block numbered block, between lo and hi"""
+    if hi - lo == 1:
+        return bodies[lo]
+    mid = (lo + hi) // 2
+    return [
+        f"if block < {mid}:",
+        *("    " + line for line in _dispatch(bodies, lo, mid)),
+        "else:",
+        *("    " + line for line in _dispatch(bodies, mid, hi)),
+    ]
+
+
+def _block(program, cfg, block, index: dict) -> list[str]:
+    """Code of a block, which ends by setting the next block or returning"""
+    lines = []
+    # Values pushed by the block that are not on s yet, as numbers or names
+    stack = []
+    names = count()
+    grid = program.grid
+
+    def emit(text: str):
+        lines.extend(text.split("\n"))
+
+    def pop():
+        if stack:
+            return stack.pop()
+        name = f"v{next(names)}"
+        emit(f"{name} = s.pop()")
+        return name
+
+    def compute(expr: str):
+        # Assign every computed value right away to keep the order of evaluation
+        name = f"v{next(names)}"
+        emit(f"{name} = {expr}")
+        stack.append(name)
+
+    def flush():
+        if len(stack) == 1:
+            emit(f"s.append({_source(stack[0])})")
+        elif stack:
+            emit(f"s.extend(({', '.join(map(_source, stack))}))")
+        stack.clear()
+
+    def fold(expr: str, *values) -> bool:
+        """Push the value of expr if its operands are known, True if it was"""
+        if any(isinstance(value, str) for value in values):
+            return False
+        try:
+            value = eval(expr)
+        except ArithmeticError:
+            # Fails when it is run, like it does in the interpreter
+            return False
+        if type(value) is float and not isfinite(value):
+            return False
+        stack.append(value)
+        return True
+
+    for x, y, _, _, stringmode in block.states:
+        value = grid.get(x, y)
+        c = _char(value)
+        if c is None:
+            # Not an instruction, which fails like it does in the interpreter
+            emit(f"chr({value!r})")
+        elif stringmode:
+            if c not in FISH["quotes"]:
+                stack.append(value)
+        elif c in FISH["digits"]:
+            stack.append(int(c, 16))
+        elif c == ";":
+            emit("return")
+        elif c in BINARY_OPS:
+            a, b = pop(), pop()
+            expr = BINARY_OPS[c].format(a=_source(a), b=_source(b))
+            if not fold(expr, a, b):
+                compute(expr)
+        elif c == ",":
+            a, b = pop(), pop()
+            if isinstance(a, str) or a == 0:
+                emit(f'if {_source(a)} == 0:\n    raise Exception("Division by zero")')
+            expr = f"{_source(b)} / {_source(a)}"
+            if not fold(expr, a, b):
+                compute(expr)
+        elif c == "n":
+            emit(f"write(str({_source(pop())}))")
+        elif c == "o":
+            emit(f"write(chr({_source(pop())}))")
+        elif c == "i":
+            compute("read()")
+        elif c == "g":
+            row, column = pop(), pop()
+            if isinstance(row, str) or isinstance(column, str):
+                compute(f"GRID.get(({_source(column)}, {_source(row)}), 0)")
+            else:
+                stack.append(grid.get(column, row))
+        elif c == ":":
+            if stack:
+                stack.append(stack[-1])
+            else:
+                compute("s[-1]")
+        elif c == "$":
+            a, b = pop(), pop()
+            stack.extend([a, b])
+        elif c == "@":
+            # The top three values come back in reverse
+            a, b, d = pop(), pop(), pop()
+            stack.extend([a, b, d])
+        elif c == "~":
+            if stack:
+                stack.pop()
+            else:
+                emit("s.pop()")
+        elif c == "l":
+            compute(f"len(s) + {len(stack)}" if stack else "len(s)")
+        elif c == "&":
+            flush()
+            emit(
+                "if reg is None:\n    reg = s.pop()\n"
+                "else:\n    s.append(reg)\n    reg = None"
+            )
+        elif c == "r":
+            flush()
+            emit("s.reverse()")
+        elif c == "{":
+            flush()
+            emit("s.append(s.pop(0))")
+        elif c == "}":
+            flush()
+            emit("s.insert(0, s.pop())")
+        elif c == "[":
+            n = pop()
+            flush()
+            # Split like the slices s[:-n] and s[-n:] would
+            emit(f"at = slice(None, -({_source(n)})).indices(len(s))[1]")
+            emit("frames.append((s[:at], reg))\ns = s[at:]\nreg = None")
+        elif c == "]":
+            flush()
+            emit(
+                "if frames:\n    below, reg = frames.pop()\n    below.extend(s)\n"
+                "    s = below\nelse:\n    s = []\n    reg = None"
+            )
+
+    successors = [index[state] for state, _ in cfg.successors[block.states[-1]]]
+    if len(successors) == 1:
+        flush()
+        emit(f"block = {successors[0]}")
+    elif len(successors) == 2:
+        # ? skips the next cell (the first way out) if it pops a 0
+        skip, step = successors
+        if stack:
+            condition = f"{_source(stack.pop())} == 0"
+        else:
+            condition = "s and s.pop() == 0"
+        flush()
+        emit(f"block = {skip} if {condition} else {step}")
+    elif successors:
+        flush()
+        emit(f"block = random.choice(({', '.join(map(str, successors))}))")
+    return lines
+
+
+def _source(value) -> str:
+    return value if isinstance(value, str) else repr(value)
@@ -0,0 +1,149 @@
+"""
+Batch runner for many programs at once
+
+Programs are run headless on a pool of worker processes, which are reused
+for every program so that the interpreters are only imported once per worker.
+A batch is given as a directory, a glob or a manifest file with one program
+per line, either as a path or as a JSON object like
+
+    {"path": "examples/factorial.fish", "stdin": "", "value": 5}
+
+where "language", "engine", the limits "max_steps", "timeout", "max_stack"
+and "max_cells", "detect_loops" and "compact_stack" may also be given. Relative paths in a
+manifest are relative to the manifest itself.
+
+Results come in the order the programs finish, and carry the index of their
+job in the batch, so that a program listed more than once can be told apart.
+"""
+
+from glob import glob
+from multiprocessing import Pool
+import json
+import os
+import time
+
+from esoteric import languages
+from esoteric.interpreter import CHECK_INTERVAL, LimitExceeded, Limits
+from esoteric.streams import Input, Output
+
+
+def collect(source: str, **defaults) -> list[dict]:
+    """Jobs for a directory, glob or manifest, with defaults for missing fields"""
+    if os.path.isdir(source):
+        paths = sorted(
+            os.path.join(source, name)
+            for name in os.listdir(source)
+            if name.split(".")[-1] in languages.names()
+        )
+        jobs = [{"path": path} for path in paths]
+    elif os.path.isfile(source):
+        jobs = []
+        base = os.path.dirname(source)
+        with open(source) as file:
+            for line in file:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                job = json.loads(line) if line.startswith("{") else {"path": line}
+                job["path"] = os.path.join(base, job["path"])
+                jobs.append(job)
+    else:
+        jobs = [{"path": path} for path in sorted(glob(source, recursive=True))]
+    return [{**defaults, **job, "index": i} for i, job in enumerate(jobs)]
+
+
+def load(
+    code: str,
+    language: str = None,
+    engine: str = "table",
+    value: int = None,
+    limits: Limits = None,
+    compact: bool = False,
+):
+    interpreter = languages.get(language or languages.DEFAULT)
+    program = interpreter.from_string(
+        code, engine=engine, limits=limits, compact=compact
+    )
+    if value is not None:
+        # Onto the stack the program has, which may be compact
+        program.stack.append(value)
+    return program
+
+
+def limits_of(job: dict) -> Limits:
+    return Limits(
+        job.get("max_steps"),
+        job.get("timeout"),
+        job.get("max_stack"),
+        job.get("max_cells"),
+        CHECK_INTERVAL if job.get("detect_loops") else None,
+    )
+
+
+def outcome(run) -> dict:
+    """Exit code, and error and limit if any, of calling run"""
+    error = None
+    limit = None
+    try:
+        run()
+    except LimitExceeded as err:
+        error = str(err)
+        limit = err.limit
+    except Exception as err:
+        # Errors from the interpreter carry a description and the error itself
+        if err.args and isinstance(err.args[0], tuple):
+            error = err.args[0][0]
+        else:
+            error = str(err)
+    result = {"exit": 0 if error is None else 1 if limit is None else 2}
+    if error is not None:
+        result["error"] = error
+    if limit is not None:
+        result["limit"] = limit
+    return result
+
+
+def run_job(job: dict) -> dict:
+    """Run a single program and describe how it went"""
+    path = job["path"]
+    output = Output()
+    program = None
+    start = time.perf_counter()
+
+    def run():
+        nonlocal program
+        with open(path) as file:
+            code = file.read()
+        language = job.get("language") or languages.of_path(path)
+        program = load(
+            code,
+            language,
+            job.get("engine") or "table",
+            job.get("value"),
+            limits_of(job),
+            bool(job.get("compact_stack")),
+        )
+        program._drive(output, Input(job.get("stdin") or ""))
+
+    status = outcome(run)
+    return {
+        "index": job.get("index"),
+        "program": path,
+        "exit": status.pop("exit"),
+        "output": output.getvalue(),
+        "steps": program.steps if program is not None else 0,
+        "time": time.perf_counter() - start,
+        **status,
+    }
+
+
+def _warm():
+    # Import the interpreters once per worker instead of once per program
+    for language in languages.names():
+        languages.get(language)
+
+
+def run(jobs: list[dict], processes: int = None):
+    """Run jobs on a pool of processes, yielding results as they are done"""
+    with Pool(processes or os.cpu_count(), initializer=_warm) as pool:
+        yield from pool.imap_unordered(run_job, jobs)
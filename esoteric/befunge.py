@@ -4,9 +4,22 @@ Implementation of Befunge-93
 See https://esolangs.org/wiki/Befunge#Instructions in particular
 """
 
-from esoteric.gui import Colors
-from esoteric.interpreter import Actions, coord, Interpreter
-from itertools import chain
+from array import array
+
+from esoteric.board import Board, Rows
+from esoteric.colors import Colors
+from esoteric.interpreter import (
+    Actions,
+    cell_hash,
+    coord,
+    HASH_MASK,
+    Interpreter,
+    NONE,
+    steps_left,
+)
+from esoteric.trace import compile_trace, EXITS, HOT, MAX_LENGTH
+from itertools import chain, repeat
+from operator import length_hint
 import random
 
 DELTA_CHANGERS = {
@@ -37,6 +50,12 @@ NUMBERS = list(str(i) for i in range(10))
 
 DIRECTIONS = list(DELTA_CHANGERS.values())
 
+QUOTE = ord('"')
+# Code points that the board can hold
+MAX_CHAR = 0x10FFFF
+# Steps of the trace engine while it is not interpreting a chunk of them
+NO_TICKS = repeat(None, 0)
+
 COLORS = {
     **{c: Colors.RED for c in "@"},
     **{c: Colors.GREEN for c in '"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefhijklmnoqrstuvwxyz'},
@@ -47,80 +66,221 @@ COLORS = {
 }
 
 
+# Handlers for the table engine, indexed by opcode (the ordinal of the cell).
+# A handler returns None or an (action, value) pair.
+
+
+def _nop(vm):
+    pass
+
+
+def _halt(vm):
+    return (Actions.HALT, None)
+
+
+def _stringmode(vm):
+    vm.stringmode = True
+
+
+def _output_int(vm):
+    return (Actions.OUTPUT, str(vm.stack.pop()))
+
+
+def _output_char(vm):
+    return (Actions.OUTPUT, chr(vm.stack.pop()))
+
+
+def _int_input(vm):
+    return (Actions.INT_INPUT, None)
+
+
+def _string_input(vm):
+    return (Actions.STRING_INPUT, None)
+
+
+def _get(vm):
+    y, x = vm.stack.pop(), vm.stack.pop()
+    vm.stack.append(vm.get(x, y))
+
+
+def _put(vm):
+    y, x, v = vm.stack.pop(), vm.stack.pop(), vm.stack.pop()
+    vm.put(x, y, v)
+    # The engines hold on to the code, which may have been replaced by a copy
+    return (Actions.NONE, None)
+
+
+def _random_direction(vm):
+    vm.entropy += 1
+    vm.delta = random.choice(DIRECTIONS)
+
+
+def _horizontal_if(vm):
+    vm.dx = -1 if not len(vm.stack) or vm.stack.pop() else 1
+    vm.dy = 0
+
+
+def _vertical_if(vm):
+    vm.dx = 0
+    vm.dy = -1 if not len(vm.stack) or vm.stack.pop() else 1
+
+
+def _divide(vm):
+    a, b = vm.stack.pop(), vm.stack.pop()
+    if a == 0:
+        return (Actions.INT_INPUT, None)
+    vm.stack.append(b // a)
+
+
+def _trampoline(vm):
+    vm.x += vm.dx
+    vm.y += vm.dy
+
+
+def _direction(d: coord):
+    def handler(vm):
+        vm.dx = d.x
+        vm.dy = d.y
+
+    return handler
+
+
+def _binary(op):
+    def handler(vm):
+        vm.stack.append(op(vm.stack.pop(), vm.stack.pop()))
+
+    return handler
+
+
+def _modifier(op):
+    def handler(vm):
+        op(vm.stack)
+
+    return handler
+
+
+def _number(n: int):
+    def handler(vm):
+        vm.stack.append(n)
+
+    return handler
+
+
+HANDLERS = [_nop] * 256
+for c, handler in {
+    "@": _halt,
+    '"': _stringmode,
+    ".": _output_int,
+    ",": _output_char,
+    "&": _int_input,
+    "~": _string_input,
+    "g": _get,
+    "p": _put,
+    "?": _random_direction,
+    "_": _horizontal_if,
+    "|": _vertical_if,
+    "/": _divide,
+    "#": _trampoline,
+    **{c: _direction(d) for c, d in DELTA_CHANGERS.items()},
+    **{c: _binary(op) for c, op in BINARY_OPS.items()},
+    **{c: _modifier(op) for c, op in STACK_MODIFIERS.items()},
+    **{c: _number(int(c)) for c in NUMBERS},
+}.items():
+    HANDLERS[ord(c)] = handler
+
+
 class Befunge(Interpreter):
-    delta = coord(1, 0)
-    stack = []
     stringmode = False
+    engines = Interpreter.engines + ("trace",)
 
-    def color_of(self, position: coord) -> int:
-        try:
-            return COLORS[self.board[position.y][position.x]]
-        except KeyError:
-            return 8
+    def __init__(self, board: list[list[str]], **kwargs):
+        super().__init__(board, **kwargs)
+        if isinstance(board, Board):
+            self._set_code(bytearray().join(board.sources()))
+        else:
+            self._set_code([ord(c) for line in board for c in line])
+        # Where every row starts in the code
+        self.offsets = [y * self.width for y in range(self.height)]
 
-    def step(self):
-        try:
-            res = self._step()
-            if res[1] == Actions.HALT:
-                self.halted = True
-        except Exception as err:
-            return (
-                self.pos,
-                Actions.ERROR,
-                (f"{err}", err),
-            )
-        return res
+    def _set_code(self, code):
+        """Take the code points of the board, row by row
+
+        The code is a bytearray while every cell fits in a byte, and an array
+        of 32 bits once p writes one that does not. board is only a view of
+        it as rows of strings, for display.
+        """
+        if isinstance(code, list):
+            code = bytearray(code) if max(code, default=0) < 256 else array("I", code)
+        self.code = code
+        self.board = Rows(code, self.width, self.height)
+
+    def _bind(self):
+        super()._bind()
+        if self.engine == "trace":
+            # Compiled traces by their starting position and delta,
+            # and the keys of the traces covering each cell
+            self.traces = {}
+            self.heat = {}
+            self.covered = {}
+            self._execute = self._trace
+
+    @property
+    def cell(self) -> str:
+        return chr(self.code[self.y * self.width + self.x])
+
+    def char_at(self, x: int, y: int) -> str:
+        # Without making a string of the whole row, like board[y][x] would
+        return chr(self.code[y * self.width + x])
+
+    def color_of(self, position: coord) -> int:
+        return COLORS.get(chr(self.get(position.x, position.y)), 8)
 
     def _step(self):
-        action = Actions.NONE
+        action = NONE
         value = None
+        cell = self.cell
         if self.stringmode:
-            if self.cell == '"':
+            if cell == '"':
                 self.stringmode = False
             else:
                 # Stringmode overrides everything
-                self.stack.append(ord(self.cell))
-        elif self.cell == "@":
-            return (self.pos, Actions.HALT, None)
-        elif self.cell == '"':
+                self.stack.append(ord(cell))
+        elif cell == "@":
+            return (Actions.HALT, None)
+        elif cell == '"':
             self.stringmode = True
-        elif self.cell == ".":
+        elif cell == ".":
             action = Actions.OUTPUT
             value = str(self.stack.pop())
-        elif self.cell == ",":
+        elif cell == ",":
             action = Actions.OUTPUT
             value = chr(self.stack.pop())
-        elif self.cell == "&":
+        elif cell == "&":
             action = Actions.INT_INPUT
-        elif self.cell == "~":
+        elif cell == "~":
             action = Actions.STRING_INPUT
-        elif self.cell == "g":
+        elif cell == "g":
             y, x = self.stack.pop(), self.stack.pop()
-            try:
-                self.stack.append(ord(self.board[y][x]))
-            except KeyError:
-                self.stack.append(0)
-        elif self.cell == "p":
+            self.stack.append(self.get(x, y))
+        elif cell == "p":
             y, x, v = self.stack.pop(), self.stack.pop(), self.stack.pop()
-            try:
-                self.board[y][x] = chr(v)
-            except KeyError:
-                raise Exception(f"No such position ({x}, {y})")
-        elif self.cell in DELTA_CHANGERS:
-            self.delta = DELTA_CHANGERS[self.cell]
-        elif self.cell == "?":
+            self.put(x, y, v)
+        elif cell in DELTA_CHANGERS:
+            self.delta = DELTA_CHANGERS[cell]
+        elif cell == "?":
+            self.entropy += 1
             self.delta = random.choice(DIRECTIONS)
-        elif self.cell == "_":
+        elif cell == "_":
             # Left if true, right if false
             v = not len(self.stack) or self.stack.pop()
-            self.delta = coord(-1, 0) if v else coord(1, 0)
-        elif self.cell == "|":
+            self.dx, self.dy = (-1, 0) if v else (1, 0)
+        elif cell == "|":
             # Up if true, down if false
             v = not len(self.stack) or self.stack.pop()
-            self.delta = coord(0, -1) if v else coord(0, 1)
-        elif self.cell in BINARY_OPS:
-            self.stack.append(BINARY_OPS[self.cell](self.stack.pop(), self.stack.pop()))
-        elif self.cell == "/":
+            self.dx, self.dy = (0, -1) if v else (0, 1)
+        elif cell in BINARY_OPS:
+            self.stack.append(BINARY_OPS[cell](self.stack.pop(), self.stack.pop()))
+        elif cell == "/":
             a, b = self.stack.pop(), self.stack.pop()
             if a == 0:
                 # If division by 0, ask user what the answer is
@@ -128,20 +288,222 @@ class Befunge(Interpreter):
                 action = Actions.INT_INPUT
             else:
                 self.stack.append(b // a)
-        elif self.cell in STACK_MODIFIERS:
-            STACK_MODIFIERS[self.cell](self.stack)
-        elif self.cell in NUMBERS:
-            self.stack.append(int(self.cell))
+        elif cell in STACK_MODIFIERS:
+            STACK_MODIFIERS[cell](self.stack)
+        elif cell in NUMBERS:
+            self.stack.append(int(cell))
 
         # Update position, wrap around source code
-        if self.cell == "#" and not self.stringmode:
-            self.pos = (self.pos + self.delta + self.delta) % self.maxpos
+        if cell == "#" and not self.stringmode:
+            self.x = (self.x + 2 * self.dx) % self.width
+            self.y = (self.y + 2 * self.dy) % self.height
+        else:
+            self.x = (self.x + self.dx) % self.width
+            self.y = (self.y + self.dy) % self.height
+        if action is NONE:
+            return None
+        return (action, value)
+
+    def _fetch(self) -> int:
+        return self.code[self.y * self.width + self.x]
+
+    def get(self, x: int, y: int) -> int:
+        """Value of the cell at (x, y), 0 outside of the board"""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.code[self.offsets[y] + x]
+        return 0
+
+    def _dispatch(self):
+        width = self.width
+        op = self.code[self.y * width + self.x]
+        res = None
+        if self.stringmode:
+            if op == QUOTE:
+                self.stringmode = False
+            else:
+                self.stack.append(op)
         else:
-            self.pos = (self.pos + self.delta) % self.maxpos
-        return (self.pos, action, value)
+            res = (HANDLERS[op] if op < 256 else _nop)(self)
+            if res is not None and res[0] == Actions.HALT:
+                return res
+        self.x = (self.x + self.dx) % width
+        self.y = (self.y + self.dy) % self.height
+        return res
+
+    def _execute(self, until):
+        code = self.code
+        handlers = HANDLERS
+        width, height = self.width, self.height
+        left = steps_left(self.steps, until)
+        ticks = repeat(None, left)
+        try:
+            for _ in ticks:
+                op = code[self.y * width + self.x]
+                if self.stringmode:
+                    if op == QUOTE:
+                        self.stringmode = False
+                    else:
+                        self.stack.append(op)
+                else:
+                    res = (handlers[op] if op < 256 else _nop)(self)
+                    if res is not None:
+                        if res[0] == Actions.HALT:
+                            return (self.pos, Actions.HALT, None)
+                        self.x = (self.x + self.dx) % width
+                        self.y = (self.y + self.dy) % height
+                        return (self.pos, *res)
+                self.x = (self.x + self.dx) % width
+                self.y = (self.y + self.dy) % height
+            return (self.pos, NONE, None)
+        except Exception as err:
+            return self._stop(err)
+        finally:
+            self.steps += left - length_hint(ticks)
+
+    def _trace(self, until):
+        code = self.code
+        handlers = HANDLERS
+        width, height = self.width, self.height
+        traces, heat = self.traces, self.heat
+        # Steps that no trace or interpreted step has taken yet
+        total = left = steps_left(self.steps, until)
+        ticks = NO_TICKS
+        try:
+            while left:
+                if not self.stringmode:
+                    key = (self.x, self.y, self.dx, self.dy)
+                    trace = traces.get(key)
+                    if trace is None:
+                        heat[key] = hits = heat.get(key, 0) + 1
+                        if hits >= HOT:
+                            trace = traces[key] = self._compile(key)
+                    if (
+                        trace
+                        and trace.length <= left
+                        and len(self.stack) >= trace.depth
+                        and trace.run(self, self.stack)
+                    ):
+                        left -= trace.length
+                        if not trace.closed:
+                            continue
+                # Interpret up to and including the next exit
+                chunk = MAX_LENGTH if left > MAX_LENGTH else left
+                left -= chunk
+                ticks = repeat(None, chunk)
+                for _ in ticks:
+                    op = code[self.y * width + self.x]
+                    if self.stringmode:
+                        if op == QUOTE:
+                            self.stringmode = False
+                        else:
+                            self.stack.append(op)
+                    else:
+                        res = (handlers[op] if op < 256 else _nop)(self)
+                        if res is not None:
+                            if res[0] == Actions.HALT:
+                                return (self.pos, Actions.HALT, None)
+                            self.x = (self.x + self.dx) % width
+                            self.y = (self.y + self.dy) % height
+                            return (self.pos, *res)
+                        if op in EXITS:
+                            self.x = (self.x + self.dx) % width
+                            self.y = (self.y + self.dy) % height
+                            break
+                    self.x = (self.x + self.dx) % width
+                    self.y = (self.y + self.dy) % height
+                # Give back the steps of the chunk that were not taken
+                left += length_hint(ticks)
+                ticks = NO_TICKS
+            return (self.pos, NONE, None)
+        except Exception as err:
+            return self._stop(err)
+        finally:
+            self.steps += total - left - length_hint(ticks)
+
+    def _compile(self, key):
+        trace = compile_trace(self.code, self.width, self.height, *key)
+        if trace is None:
+            # Nothing to compile, but remember that until the head cell changes
+            x, y = key[0], key[1]
+            self.covered.setdefault(y * self.width + x, set()).add(key)
+            return False
+        for i in trace.cells:
+            self.covered.setdefault(i, set()).add(key)
+        return trace
+
+    def put(self, x: int, y: int, v: int):
+        """Write v to the cell at (x, y), which must be on the board"""
+        if not 0 <= v <= MAX_CHAR:
+            raise ValueError(f"{v} is not a character to put on the board")
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError(f"No such position ({x}, {y})")
+        if self.shared:
+            # Copy on write, the board is shared with a fork
+            self._set_code(self.code[:])
+            self.shared = False
+        if v > 255 and isinstance(self.code, bytearray):
+            self._set_code(array("I", list(self.code)))
+        i = self.offsets[y] + x
+        if self.board_hash is not None:
+            self.board_hash = (
+                self.board_hash + cell_hash(x, y, v) - cell_hash(x, y, self.code[i])
+            ) & HASH_MASK
+        self.code[i] = v
+        if self.changed is not None:
+            self.changed.add((x, y))
+        if self.engine == "trace":
+            # Invalidate compiled traces running through the cell
+            for key in self.covered.pop(i, ()):
+                self.traces.pop(key, None)
 
     def recv(self, value):
-        self.stack.append(value)
+        self.entropy += 1
+        self.stack.append(ord(value) if isinstance(value, str) else value)
 
     def internal_state(self):
         return ["Stack:"] + [str(i) for i in reversed(self.stack)]
+
+    def fingerprint(self):
+        if self.board_hash is None:
+            width = self.width
+            hashes = (
+                cell_hash(i % width, i // width, v) for i, v in enumerate(self.code)
+            )
+            self.board_hash = sum(hashes) & HASH_MASK
+        return hash(
+            (
+                self.board_hash,
+                self.x,
+                self.y,
+                self.dx,
+                self.dy,
+                self.stringmode,
+                tuple(self.stack),
+            )
+        )
+
+    def machine_state(self):
+        return (
+            self.x,
+            self.y,
+            self.dx,
+            self.dy,
+            self.stringmode,
+            list(self.stack),
+            list(self.code),
+        )
+
+    def _state(self):
+        return {
+            "board": list(self.board),
+            "stringmode": self.stringmode,
+        }
+
+    def _set_state(self, state):
+        self._set_code([ord(c) for line in state["board"] for c in line])
+        self.stringmode = state["stringmode"]
+        if self.engine == "trace":
+            # Compiled for the board that was replaced
+            self.traces.clear()
+            self.heat.clear()
+            self.covered.clear()
@@ -0,0 +1,133 @@
+"""
+Boards loaded straight from a file
+
+read() maps the file into memory instead of reading it into a string, and
+for a file of ASCII characters only returns a Board: the rows of the program
+as ranges of the mapped file, which are turned into lists of characters
+(padded to the width of the board) when they are first used. The decoded
+code of the interpreters is built from the padded bytes of the rows instead,
+so the rows of a large program that are never read by g or shown in the GUI
+never become lists at all.
+
+Rows shows a flat board of code points, like that of Befunge, as strings.
+"""
+
+from array import array
+import mmap
+import operator
+import re
+
+# What str.splitlines() splits on, within ASCII
+LINE_BREAK = re.compile(rb"\r\n|[\n\r\v\f\x1c-\x1e]")
+NON_ASCII = re.compile(rb"[^\x00-\x7f]")
+
+
+class Board:
+    """Rows of a board in a buffer, each a list of characters once it is used"""
+
+    def __init__(self, buffer, starts: array, ends: array):
+        self.buffer = buffer
+        # Where every row starts and ends in the buffer
+        self.starts = starts
+        self.ends = ends
+        self.width = max(map(operator.sub, ends, starts), default=0)
+        # Rows that are in use, None for the others
+        self.rows = [None] * len(starts)
+
+    @classmethod
+    def of(cls, buffer):
+        """Board of the lines of an ASCII buffer"""
+        starts = array("q")
+        ends = array("q")
+        start = 0
+        for match in LINE_BREAK.finditer(buffer):
+            starts.append(start)
+            ends.append(match.start())
+            start = match.end()
+        if start < len(buffer):
+            starts.append(start)
+            ends.append(len(buffer))
+        return cls(buffer, starts, ends)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, y: int) -> list[str]:
+        row = self.rows[y]
+        if row is None:
+            row = self.rows[y] = list(self.source(y).decode("ascii"))
+        return row
+
+    def __setitem__(self, y: int, row: list[str]):
+        self.rows[y] = row
+
+    def __iter__(self):
+        for y in range(len(self.rows)):
+            yield self[y]
+
+    def extend(self, rows):
+        self.rows.extend(rows)
+
+    def source(self, y: int) -> bytes:
+        """Row y as it was loaded, padded with spaces"""
+        if y < 0:
+            y += len(self.starts)
+        return self.buffer[self.starts[y] : self.ends[y]].ljust(self.width)
+
+    def sources(self):
+        """Every row as it was loaded, padded with spaces"""
+        for y in range(len(self.starts)):
+            yield self.source(y)
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.buffer, board.starts, board.ends = self.buffer, self.starts, self.ends
+        board.width = self.width
+        board.rows = [None if row is None else list(row) for row in self.rows]
+        return board
+
+
+class Rows:
+    """Rows of a flat board of code points as strings, to display them"""
+
+    def __init__(self, code, width: int, height: int):
+        self.code = code
+        self.width = width
+        self.height = height
+
+    def __len__(self) -> int:
+        return self.height
+
+    def __getitem__(self, y: int) -> str:
+        if y < 0:
+            y += self.height
+        if not 0 <= y < self.height:
+            raise IndexError("row index out of range")
+        start = y * self.width
+        return "".join(map(chr, self.code[start : start + self.width]))
+
+    def __iter__(self):
+        for y in range(self.height):
+            yield self[y]
+
+
+def copy(board):
+    """Copy of a board that is a Board or a list of rows"""
+    if isinstance(board, Board):
+        return board.copy()
+    return [list(row) for row in board]
+
+
+def read(path: str):
+    """Board of the file at path, a Board unless it has other than ASCII in it"""
+    with open(path, "rb") as file:
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped
+            return []
+    if NON_ASCII.search(buffer) is None:
+        return Board.of(buffer)
+    text = buffer[:].decode()
+    buffer.close()
+    return [list(line) for line in text.splitlines()]
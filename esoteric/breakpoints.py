@@ -0,0 +1,128 @@
+"""
+Breakpoints and watch conditions, as used by the GUI
+
+Breakpoints stop before a cell is run, either at a position or at any cell
+with a given instruction. Watch conditions stop after a step that makes them
+true, and are written like
+
+    depth > 100
+    top == 0
+    register != 5
+    output contains "done"
+
+with the subjects depth (values on all stacks), top (of the stack), register
+(Fish), steps and output (everything written so far), compared to a number
+or a string. Conditions are parsed once into functions when they are added.
+"""
+
+from ast import literal_eval
+import operator
+import re
+from typing import Optional
+
+from esoteric.interpreter import Actions
+
+WATCH = re.compile(r"\s*(\w+)\s*(==|!=|<=|>=|<|>|contains)\s*(.+?)\s*")
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "<": operator.lt,
+    ">": operator.gt,
+    "contains": operator.contains,
+}
+
+
+def _top(vm, output):
+    return vm.stack[-1] if len(vm.stack) else None
+
+
+SUBJECTS = {
+    "depth": lambda vm, output: vm.depth(),
+    "top": _top,
+    "register": lambda vm, output: getattr(vm, "register", None),
+    "steps": lambda vm, output: vm.steps,
+    "output": lambda vm, output: output,
+}
+
+
+def compile_watch(text: str):
+    """Function of an interpreter and its output so far that is true when text is
+
+    Raises ValueError if text is not a condition.
+    """
+    match = WATCH.fullmatch(text)
+    if match is None or match[1] not in SUBJECTS:
+        raise ValueError(f"Not a watch condition: {text!r}")
+    subject, name, literal = match.groups()
+    try:
+        value = literal_eval(literal)
+    except (ValueError, SyntaxError):
+        raise ValueError(f"Not a number or string: {literal}")
+    get = SUBJECTS[subject]
+    compare = OPERATORS[name]
+
+    def condition(vm, output) -> bool:
+        current = get(vm, output)
+        if current is None:
+            # Nothing on the stack or in the register
+            return False
+        try:
+            return bool(compare(current, value))
+        except TypeError:
+            return False
+
+    return condition
+
+
+class Breakpoints:
+    def __init__(self, cells=(), opcodes=(), watches=()):
+        # Positions as (x, y), and instructions as characters
+        self.cells = set(cells)
+        self.opcodes = set(opcodes)
+        # Text and function of every watch condition
+        self.watches = []
+        # Output so far, only kept if a condition looks at it
+        self.output = None
+        for text in watches:
+            self.watch(text)
+
+    def __bool__(self) -> bool:
+        return bool(self.cells or self.opcodes or self.watches)
+
+    def toggle(self, x, y) -> bool:
+        """Add or remove the breakpoint at (x, y), True if it is added"""
+        if (x, y) in self.cells:
+            self.cells.remove((x, y))
+            return False
+        self.cells.add((x, y))
+        return True
+
+    def watch(self, text: str):
+        self.watches.append((text.strip(), compile_watch(text)))
+        if self.output is None and WATCH.fullmatch(text)[1] == "output":
+            self.output = ""
+
+    def before(self, vm) -> Optional[str]:
+        """Why to stop before the next step of vm, if there is a breakpoint"""
+        if self.cells and (vm.x, vm.y) in self.cells:
+            return f"breakpoint at ({vm.x}, {vm.y})"
+        if self.opcodes:
+            try:
+                cell = vm.cell
+            except (IndexError, TypeError, ValueError):
+                return None
+            if cell in self.opcodes:
+                return f"breakpoint on {cell}"
+        return None
+
+    def after(self, vm, action, value) -> Optional[str]:
+        """Why to stop after a step of vm with this result, if a condition is true"""
+        if action == Actions.OUTPUT and self.output is not None:
+            self.output += value
+        for text, condition in self.watches:
+            if condition(vm, self.output):
+                return text
+        return None
@@ -0,0 +1,345 @@
+"""
+Static control-flow graph of a 2D program
+
+Walks the board (or the codebox of Fish) from (0, 0) moving right, following
+every direction the instruction pointer could take, as if the board never
+changed. The states of the walk are positions with a delta and whether string
+mode is on. Runs of states with a single way in and out are merged into
+basic blocks, and the edges between blocks come from branches, random
+directions and states where paths join.
+
+Anything the walk does not know about is reported: p may rewrite cells that
+are executed, and . in Fish teleports to computed positions, in which case the
+graph is not the whole story. g only reads, so it does not affect the graph.
+"""
+
+from collections import deque
+import json
+
+DIRECTIONS = {
+    ">": (1, 0),
+    "v": (0, 1),
+    "<": (-1, 0),
+    "^": (0, -1),
+}
+RANDOM = [(d, 1, "random") for d in DIRECTIONS.values()]
+
+BEFUNGE = {
+    "halt": "@",
+    "quotes": '"',
+    "digits": "0123456789",
+    # Instructions that only move, leaving the stack as it is
+    "moves": "><^v #",
+}
+FISH = {
+    "halt": ";",
+    "quotes": "'\"",
+    "digits": "0123456789abcdef",
+    "moves": "><^v |_/\\#x!",
+}
+
+MIRRORS = {
+    "|": lambda dx, dy: (-dx, dy),
+    "_": lambda dx, dy: (dx, -dy),
+    "/": lambda dx, dy: (-dy, -dx),
+    "\\": lambda dx, dy: (dy, dx),
+}
+
+
+def _befunge_moves(c: str, dx: int, dy: int) -> list:
+    """Deltas, distances and edge labels of the ways out of an instruction"""
+    if c in DIRECTIONS:
+        return [(DIRECTIONS[c], 1, "")]
+    if c == "?":
+        return RANDOM
+    if c == "_":
+        return [((-1, 0), 1, "true"), ((1, 0), 1, "false")]
+    if c == "|":
+        return [((0, -1), 1, "true"), ((0, 1), 1, "false")]
+    if c == "#":
+        return [((dx, dy), 2, "")]
+    return [((dx, dy), 1, "")]
+
+
+def _fish_moves(c: str, dx: int, dy: int) -> list:
+    if c in DIRECTIONS:
+        return [(DIRECTIONS[c], 1, "")]
+    if c in MIRRORS:
+        return [(MIRRORS[c](dx, dy), 1, "")]
+    if c in "x#":
+        return RANDOM
+    if c == "!":
+        return [((dx, dy), 2, "")]
+    if c == "?":
+        return [((dx, dy), 2, "zero"), ((dx, dy), 1, "nonzero")]
+    return [((dx, dy), 1, "")]
+
+
+class Block:
+    """States (x, y, dx, dy, stringmode) that always run one after the other"""
+
+    def __init__(self, index: int, states: list, code: str):
+        self.index = index
+        self.states = states
+        # Characters of the cells, in the order they are run
+        self.code = code
+
+    @property
+    def start(self) -> tuple:
+        return self.states[0][:2]
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.index,
+            "states": [list(state) for state in self.states],
+            "code": self.code,
+        }
+
+
+class ControlFlowGraph:
+    def __init__(self, program):
+        from esoteric.fish import Fish
+
+        self.fish = isinstance(program, Fish)
+        if self.fish:
+            grid = program.grid
+            self.left, self.top = program.minx, program.miny
+            self.right, self.bottom = program.maxx, program.maxy
+            self._get = grid.get
+        else:
+            width = program.width
+            code = program.code
+            self.left = self.top = 0
+            self.right, self.bottom = width, program.height
+            self._get = lambda x, y: code[y * width + x]
+        language = FISH if self.fish else BEFUNGE
+        self._halt = language["halt"]
+        self._quotes = language["quotes"]
+        self._digits = language["digits"]
+        self._only_moves = language["moves"]
+        self._moves = _fish_moves if self.fish else _befunge_moves
+
+        # Ways out of every reachable state, as (state, label) pairs
+        self.successors = {}
+        self.blocks = []
+        # (block, block, label) for every edge between blocks
+        self.edges = []
+        # Cells of p with the cells they write to, None if any way to it leaves
+        # a computed target
+        self.writes = {}
+        # Target of p in every state it is run in, None if it is computed
+        self._targets = {}
+        # Cells of g and of . (Fish)
+        self.reads = set()
+        self.teleports = set()
+        self._walk()
+        self.reachable = {state[:2] for state in self.successors}
+        self._build_blocks()
+        for (x, y, *_), target in self._targets.items():
+            targets = self.writes.setdefault((x, y), set())
+            if target is None or targets is None:
+                self.writes[x, y] = None
+            else:
+                targets.add(target)
+
+    def _char(self, x, y):
+        value = self._get(x, y)
+        try:
+            return chr(value)
+        except (TypeError, ValueError, OverflowError):
+            # Not an instruction, the program stops with an error there
+            return None
+
+    def _move(self, x: int, y: int, dx: int, dy: int, distance: int) -> tuple:
+        # Wrap around like the interpreters do
+        left, top = self.left, self.top
+        x = (x + distance * dx + left) % (self.right - left) - left
+        y = (y + distance * dy + top) % (self.bottom - top) - top
+        return x, y
+
+    def _next(self, state: tuple) -> list:
+        x, y, dx, dy, stringmode = state
+        c = self._char(x, y)
+        if c is None:
+            return []
+        if stringmode or c in self._quotes:
+            # Quotes turn string mode on and off, anything else is pushed
+            stringmode = stringmode != (c in self._quotes)
+            return [(self._move(x, y, dx, dy, 1) + (dx, dy, stringmode), "")]
+        if c == self._halt:
+            return []
+        if c == "p":
+            # Unless _find_writes finds constants before it on every path
+            self._targets[state] = None
+        elif c == "g":
+            self.reads.add((x, y))
+        elif c == "." and self.fish:
+            self.teleports.add((x, y))
+            return []
+        return [
+            (self._move(x, y, *delta, distance) + (*delta, False), label)
+            for delta, distance, label in self._moves(c, dx, dy)
+        ]
+
+    def _walk(self):
+        entry = (0, 0, 1, 0, False)
+        queue = deque([entry])
+        self.successors[entry] = None
+        while queue:
+            state = queue.popleft()
+            self.successors[state] = successors = self._next(state)
+            for successor, _ in successors:
+                if successor not in self.successors:
+                    self.successors[successor] = None
+                    queue.append(successor)
+
+    def _build_blocks(self):
+        predecessors = dict.fromkeys(self.successors, 0)
+        for successors in self.successors.values():
+            for successor, _ in successors:
+                predecessors[successor] += 1
+        entry = (0, 0, 1, 0, False)
+        leaders = {entry}
+        for state, successors in self.successors.items():
+            if predecessors[state] != 1:
+                leaders.add(state)
+            if len(successors) != 1:
+                leaders.update(successor for successor, _ in successors)
+        # Entry first, the rest in the order of the walk
+        order = [entry] + [s for s in self.successors if s in leaders and s != entry]
+        index = {leader: i for i, leader in enumerate(order)}
+        for leader in order:
+            states = [leader]
+            while True:
+                successors = self.successors[states[-1]]
+                if len(successors) != 1 or successors[0][0] in leaders:
+                    break
+                states.append(successors[0][0])
+            code = "".join(self._char(x, y) or "�" for x, y, *_ in states)
+            self.blocks.append(Block(index[leader], states, code))
+            for successor, label in self.successors[states[-1]]:
+                self.edges.append((index[leader], index[successor], label))
+            self._find_writes(states)
+
+    def _find_writes(self, states: list):
+        """Target of every p in the block that follows two constants
+
+        Only the leader of a block has more than one way in, so constants
+        within the block come before the p on every path to it.
+        """
+        values = []
+        for state in states:
+            x, y, _, _, stringmode = state
+            c = self._char(x, y)
+            if stringmode and c not in self._quotes:
+                values.append(ord(c))
+            elif not stringmode and c in self._digits:
+                values.append(int(c, 16))
+            elif not stringmode and c == "p" and len(values) >= 2:
+                self._targets[state] = (values[-2], values[-1])
+                values = []
+            elif stringmode or c not in self._only_moves:
+                values = []
+
+    def cells(self) -> set:
+        """Cells of the board (or codebox), as (x, y)"""
+        return {
+            (x, y)
+            for y in range(self.top, self.bottom)
+            for x in range(self.left, self.right)
+        }
+
+    def unreachable(self) -> set:
+        """Cells with an instruction that is never run"""
+        blank = ("", " ", "\0")
+        return {
+            cell
+            for cell in self.cells() - self.reachable
+            if self._char(*cell) not in blank
+        }
+
+    def never_written(self):
+        """Cells that p never writes to, or None if p writes to unknown cells"""
+        if None in self.writes.values():
+            return None
+        return self.cells().difference(*self.writes.values())
+
+    def unsound(self) -> list[str]:
+        """Why the program may take paths that are not in the graph"""
+        reasons = []
+        for (x, y), targets in sorted(self.writes.items(), key=_position):
+            if targets is None:
+                reasons.append(f"p at ({x}, {y}) writes to a computed cell")
+                continue
+            for target in sorted(targets & self.reachable, key=_position):
+                reasons.append(
+                    f"p at ({x}, {y}) rewrites ({target[0]}, {target[1]}), "
+                    "which is run"
+                )
+        for x, y in sorted(self.teleports, key=_position):
+            reasons.append(f". at ({x}, {y}) teleports to a computed cell")
+        return reasons
+
+    def to_dict(self) -> dict:
+        never_written = self.never_written()
+        return {
+            "entry": 0,
+            "blocks": [block.to_dict() for block in self.blocks],
+            "edges": [
+                {"from": source, "to": target, "label": label}
+                for source, target, label in self.edges
+            ],
+            "unreachable": _runs(self.unreachable()),
+            "never_written": None if never_written is None else _runs(never_written),
+            "writes": [
+                {
+                    "cell": list(cell),
+                    "targets": None
+                    if targets is None
+                    else [list(target) for target in sorted(targets, key=_position)],
+                }
+                for cell, targets in sorted(self.writes.items(), key=_position)
+            ],
+            "reads": sorted(map(list, self.reads), key=_position),
+            "unsound": self.unsound(),
+        }
+
+    def write_json(self, file):
+        json.dump(self.to_dict(), file, indent=2)
+        file.write("\n")
+
+    def write_dot(self, file):
+        file.write("digraph cfg {\n    node [shape=box, fontname=monospace];\n")
+        for block in self.blocks:
+            x, y = block.start
+            label = json.dumps(f"({x}, {y}) {block.code}", ensure_ascii=False)
+            file.write(f"    b{block.index} [label={label}];\n")
+        for source, target, label in self.edges:
+            attributes = f" [label={json.dumps(label)}]" if label else ""
+            file.write(f"    b{source} -> b{target}{attributes};\n")
+        file.write("}\n")
+
+    def save(self, path: str):
+        """Write to path, as DOT if it ends in .dot and as JSON otherwise"""
+        with open(path, "w") as file:
+            if path.endswith(".dot"):
+                self.write_dot(file)
+            else:
+                self.write_json(file)
+
+
+def _position(item):
+    # Sort by row, then column
+    cell = item[0] if isinstance(item[0], tuple) else item
+    return (cell[1], cell[0])
+
+
+def _runs(cells: set) -> list[list[int]]:
+    """Cells as [y, first x, last x] for every run of cells in a row"""
+    runs = []
+    for x, y in sorted(cells, key=_position):
+        if runs and runs[-1][0] == y and runs[-1][2] == x - 1:
+            runs[-1][2] = x
+        else:
+            runs.append([y, x, x])
+    return runs
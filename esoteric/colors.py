@@ -0,0 +1,29 @@
+"""
+Colors of the cells, shared by the interpreters and the GUI
+
+Kept apart from esoteric.gui so that running headless never imports curses.
+"""
+
+from enum import IntEnum, auto
+
+
+class Colors(IntEnum):
+    BLACK = auto()
+    RED = auto()
+    GREEN = auto()
+    YELLOW = auto()
+    BLUE = auto()
+    MAGENTA = auto()
+    CYAN = auto()
+    WHITE = auto()
+
+
+# Colors of the heatmap, from cells that were never executed to the hottest
+HEAT = (
+    Colors.WHITE,
+    Colors.BLUE,
+    Colors.CYAN,
+    Colors.GREEN,
+    Colors.YELLOW,
+    Colors.RED,
+)
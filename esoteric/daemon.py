@@ -0,0 +1,194 @@
+"""
+Daemon that runs programs for clients on a Unix socket
+
+serve() keeps a pool of worker processes that have imported the interpreters
+once, and each of them keeps the programs it has parsed by the hash of their
+source, so that running a program again only forks the parsed one instead of
+parsing and normalizing its board again.
+
+A client sends one request as a line of JSON like
+
+    {"code": "&2*.@", "language": "befunge", "stdin": "21", "max_steps": 1000}
+
+with the same fields as a job of esoteric.batch, except that the code is
+given instead of a path, and "flush" may be given as well. Without "stdin",
+everything sent after the request is the input of the program. The daemon
+answers with lines of JSON, {"output": text} while the program runs and
+finally one with "exit", "steps", "cached" and, if it failed, "error" and
+"limit" like the results of a batch.
+"""
+
+from collections import OrderedDict
+from dataclasses import astuple
+from hashlib import sha256
+from multiprocessing import Process
+from multiprocessing.connection import wait
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+import threading
+
+from esoteric import batch
+from esoteric.streams import BLOCK_SIZE, Input, Output
+
+# Parsed programs kept per worker
+CACHE_SIZE = 256
+# Connections waiting for a worker
+BACKLOG = 128
+
+
+class Cache:
+    """Parsed programs by the hash of their source, least recently used first"""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.programs = OrderedDict()
+
+    def get(
+        self, code: str, language: str, engine: str, limits, compact: bool = False
+    ) -> tuple:
+        """Fresh copy of the program, and whether it was already parsed"""
+        # Limits are part of the key, as the grid of Fish is set up for them
+        key = (
+            sha256(code.encode()).digest(),
+            language,
+            engine,
+            astuple(limits),
+            compact,
+        )
+        program = self.programs.get(key)
+        cached = program is not None
+        if cached:
+            self.programs.move_to_end(key)
+        else:
+            program = batch.load(code, language, engine, None, limits, compact)
+            self.programs[key] = program
+            if len(self.programs) > self.size:
+                self.programs.popitem(last=False)
+        return program.fork(), cached
+
+
+def handle(conn: socket.socket, cache: Cache):
+    """Run the program a client asks for, and send it the output and result"""
+    reader = conn.makefile("rb")
+
+    def send(message: dict):
+        conn.sendall((json.dumps(message) + "\n").encode())
+
+    program = None
+    cached = False
+    output = None
+
+    def run():
+        nonlocal program, cached, output
+        request = json.loads(reader.readline())
+        output = Output(
+            lambda text: send({"output": text}), request.get("flush") or "block"
+        )
+        program, cached = cache.get(
+            request.get("code") or "",
+            request.get("language"),
+            request.get("engine") or "table",
+            batch.limits_of(request),
+            bool(request.get("compact_stack")),
+        )
+        if request.get("value") is not None:
+            program.stack.append(request["value"])
+        source = Input(request["stdin"] if "stdin" in request else reader)
+        try:
+            program._drive(output, source)
+        finally:
+            output.flush()
+
+    status = batch.outcome(run)
+    status["steps"] = program.steps if program is not None else 0
+    status["cached"] = cached
+    send(status)
+
+
+def _work(sock: socket.socket, cache_size: int):
+    # Interrupting the daemon stops the workers, they need not handle it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    batch._warm()
+    cache = Cache(cache_size)
+    while True:
+        conn, _ = sock.accept()
+        with conn:
+            try:
+                handle(conn, cache)
+            except OSError:
+                # The client went away
+                pass
+
+
+def serve(path: str, processes: int = None, cache_size: int = CACHE_SIZE):
+    """Listen on a Unix socket at path until interrupted or terminated
+
+    Workers that die are replaced. A socket left at path by a daemon that is
+    gone is replaced, but any other file is not.
+    """
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise FileExistsError(f"{path} exists and is not a socket")
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(BACKLOG)
+
+    def start() -> Process:
+        worker = Process(target=_work, args=(sock, cache_size), daemon=True)
+        worker.start()
+        return worker
+
+    # Stop like on an interrupt, so that the workers are stopped as well
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    workers = [start() for _ in range(processes or os.cpu_count())]
+    try:
+        while True:
+            wait([worker.sentinel for worker in workers])
+            workers = [worker if worker.is_alive() else start() for worker in workers]
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        sock.close()
+        os.unlink(path)
+
+
+def connect(path: str, request: dict, stdin=None, stdout=None) -> dict:
+    """Run a program on the daemon at path and return its result
+
+    Output is written to stdout as it comes. Unless the request has "stdin",
+    the input is read from stdin (a binary file) while the program runs.
+    """
+    stdout = stdout or sys.stdout
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((json.dumps(request) + "\n").encode())
+        if "stdin" not in request:
+            source = stdin or sys.stdin.buffer
+            pump = threading.Thread(target=_send_input, args=(sock, source))
+            pump.daemon = True
+            pump.start()
+        for line in sock.makefile("rb"):
+            message = json.loads(line)
+            if "output" not in message:
+                return message
+            stdout.write(message["output"])
+            stdout.flush()
+    raise ConnectionError(f"The daemon at {path} closed the connection")
+
+
+def _send_input(sock: socket.socket, source):
+    read = getattr(source, "read1", source.read)
+    try:
+        while chunk := read(BLOCK_SIZE):
+            sock.sendall(chunk)
+        sock.shutdown(socket.SHUT_WR)
+    except (OSError, ValueError):
+        # The program is done, and the connection closed
+        pass
@@ -4,13 +4,25 @@ Implementation of Fish
 See https://esolangs.org/wiki/Fish#Instructions
 """
 
-from collections import defaultdict
 from sys import stderr
-from itertools import chain
+from itertools import chain, repeat
+from operator import length_hint
 import random
 
-from esoteric.gui import Colors
-from esoteric.interpreter import Actions, coord, Interpreter
+from esoteric.board import Board, copy
+from esoteric.colors import Colors
+from esoteric.grid import Grid
+from esoteric.interpreter import (
+    Actions,
+    cell_hash,
+    coord,
+    HASH_MASK,
+    Interpreter,
+    LimitExceeded,
+    NONE,
+    steps_left,
+)
+from esoteric.stacks import Stacks
 
 right = coord(1, 0)
 down = coord(0, 1)
@@ -53,10 +65,10 @@ and so on.
 """
 
 MIRRORS = {
-    "|": lambda d: coord(-d.x, d.y) if d.x != 0 else d,
-    "_": lambda d: coord(d.x, -d.y) if d.y != 0 else d,
-    "/": lambda d: coord(-d.y, -d.x),
-    "\\": lambda d: coord(d.y, d.x),
+    "|": lambda dx, dy: (-dx, dy),
+    "_": lambda dx, dy: (dx, -dy),
+    "/": lambda dx, dy: (-dy, -dx),
+    "\\": lambda dx, dy: (dy, dx),
 }
 
 BINARY_OPS = {
@@ -83,6 +95,23 @@ NUMBERS = list(str(i) for i in range(10)) + list("abcdef")
 
 DIRECTIONS = list(DELTA_CHANGERS.values())
 
+QUOTES = (ord("'"), ord('"'))
+# Opcodes for cell values without an instruction of their own
+OTHER = 256
+INVALID = 257
+
+
+def decode(value) -> int:
+    """Opcode of a grid value, as used by the table engine"""
+    if type(value) is int and 0 <= value < 256:
+        return value
+    try:
+        chr(value)
+        return OTHER
+    except (TypeError, ValueError):
+        return INVALID
+
+
 COLORS = {
     **{c: Colors.RED for c in "@"},
     **{
@@ -95,55 +124,254 @@ COLORS = {
 }
 
 
+# Handlers for the table engine, indexed by opcode.
+# A handler returns None or an (action, value) pair.
+
+
+def _nop(vm):
+    pass
+
+
+def _invalid(vm):
+    # Reproduce the error of the classic engine
+    chr(vm.grid.get(vm.x, vm.y))
+
+
+def _stringmode(vm):
+    vm.stringmode = True
+
+
+def _halt(vm):
+    return (Actions.HALT, None)
+
+
+def _output_int(vm):
+    return (Actions.OUTPUT, str(vm.stack.pop()))
+
+
+def _output_char(vm):
+    return (Actions.OUTPUT, chr(vm.stack.pop()))
+
+
+def _input(vm):
+    return (Actions.STRING_INPUT, None)
+
+
+def _get(vm):
+    y, x = vm.stack.pop(), vm.stack.pop()
+    vm.stack.append(vm.grid.get(x, y))
+
+
+def _put(vm):
+    y, x, v = vm.stack.pop(), vm.stack.pop(), vm.stack.pop()
+    vm.put(x, y, v)
+
+
+def _vertical_mirror(vm):
+    vm.dx = -vm.dx
+
+
+def _horizontal_mirror(vm):
+    vm.dy = -vm.dy
+
+
+def _slash_mirror(vm):
+    vm.dx, vm.dy = -vm.dy, -vm.dx
+
+
+def _backslash_mirror(vm):
+    vm.dx, vm.dy = vm.dy, vm.dx
+
+
+def _random_direction(vm):
+    vm.entropy += 1
+    vm.delta = random.choice(DIRECTIONS)
+
+
+def _teleport(vm):
+    y, x = vm.stack.pop(), vm.stack.pop()
+    # Compensate for the move that follows every instruction,
+    # coordinates are kept as they are (even if they are floats)
+    vm.x = x - vm.dx
+    vm.y = y - vm.dy
+
+
+def _trampoline(vm):
+    vm.x += vm.dx
+    vm.y += vm.dy
+
+
+def _conditional_trampoline(vm):
+    if len(vm.stack) and vm.stack.pop() == 0:
+        _trampoline(vm)
+
+
+def _divide(vm):
+    a, b = vm.stack.pop(), vm.stack.pop()
+    if a == 0:
+        raise Exception("Division by zero")
+    vm.stack.append(b / a)
+
+
+def _reverse(vm):
+    vm.stack = vm.stacks.reverse(vm.stack)
+
+
+def _shift_left(vm):
+    vm.stack = vm.stacks.shift_left(vm.stack)
+
+
+def _shift_right(vm):
+    vm.stack = vm.stacks.shift_right(vm.stack)
+
+
+def _push_stack(vm):
+    n = vm.stack.pop()
+    vm.stack = vm.stacks.push_stack(vm.stack, n, vm.register)
+    vm.register = None
+
+
+def _pop_stack(vm):
+    vm.stack, vm.register = vm.stacks.pop_stack(vm.stack)
+
+
+def _register(vm):
+    if vm.register is None:
+        vm.register = vm.stack.pop()
+    else:
+        vm.stack.append(vm.register)
+        vm.register = None
+
+
+def _direction(d: coord):
+    def handler(vm):
+        vm.dx = d.x
+        vm.dy = d.y
+
+    return handler
+
+
+def _binary(op):
+    def handler(vm):
+        vm.stack.append(op(vm.stack.pop(), vm.stack.pop()))
+
+    return handler
+
+
+def _modifier(op):
+    def handler(vm):
+        op(vm.stack)
+
+    return handler
+
+
+def _number(n: int):
+    def handler(vm):
+        vm.stack.append(n)
+
+    return handler
+
+
+HANDLERS = [_nop] * 256 + [_nop, _invalid]
+for c, handler in {
+    "'": _stringmode,
+    '"': _stringmode,
+    ";": _halt,
+    "n": _output_int,
+    "o": _output_char,
+    "i": _input,
+    "g": _get,
+    "p": _put,
+    "|": _vertical_mirror,
+    "_": _horizontal_mirror,
+    "/": _slash_mirror,
+    "\\": _backslash_mirror,
+    "x": _random_direction,
+    "#": _random_direction,
+    ".": _teleport,
+    "!": _trampoline,
+    "?": _conditional_trampoline,
+    ",": _divide,
+    "r": _reverse,
+    "{": _shift_left,
+    "}": _shift_right,
+    "[": _push_stack,
+    "]": _pop_stack,
+    "&": _register,
+    **{c: _direction(d) for c, d in DELTA_CHANGERS.items()},
+    **{c: _binary(op) for c, op in BINARY_OPS.items()},
+    **{c: _modifier(op) for c, op in STACK_MODIFIERS.items()},
+    **{c: _number(int(c, 16)) for c in NUMBERS},
+}.items():
+    HANDLERS[ord(c)] = handler
+
+
 class Fish(Interpreter):
-    delta = coord(1, 0)
-    stack = []
-    stackstack = []
     register = None
     stringmode = False
 
-    def __init__(self, board: list[list[str]], value=None):
-        super().__init__(board)
+    def __init__(self, board: list[list[str]], value=None, **kwargs):
+        super().__init__(board, **kwargs)
+        # All stacks, self.stack is the current one
+        self.stacks = Stacks(compact=self.compact)
+        self.stack = self.stacks.current
         # Initialize infinite board w/numeric values
-        self.grid = defaultdict(int)
-        for y, row in enumerate(board):
-            for x, cell in enumerate(row):
-                # Only assign cells with something non-default in them
-                if cell != " ":
-                    self.grid[coord(x, y)] = ord(cell)
-        self.minpos = coord(0, 0)
+        if isinstance(self.board, Board):
+            rows = [row.replace(b" ", b"\0") for row in self.board.sources()]
+            self.grid = Grid.from_rows(rows, self.width)
+        else:
+            self.grid = Grid.from_board(self.board)
+        if self.limits.cells is not None:
+            self.grid.max_dense = min(self.grid.max_dense, self.limits.cells)
+        # Extents of the grid
+        self.minx = self.miny = 0
+        self.maxx, self.maxy = self.width, self.height
         if value is not None:
-            self.stack = [value]
+            self.stack.append(value)
+        # Decoded copy of the original codebox for the table engine,
+        # cells outside of it are decoded from the grid when reached
+        if isinstance(self.board, Board):
+            # Bytes decode to themselves
+            self.code = []
+            for row in rows:
+                self.code.extend(row)
+        else:
+            self.code = [
+                decode(self.grid.get(x, y)) if cell != " " else 0
+                for y, row in enumerate(self.board)
+                for x, cell in enumerate(row)
+            ]
+
+    @property
+    def minpos(self) -> coord:
+        return coord(self.minx, self.miny)
+
+    @property
+    def maxpos(self) -> coord:
+        return coord(self.maxx, self.maxy)
 
     # Need to override this property to account for the infinite grid
     @property
     def cell(self):
-        return chr(self.grid[self.pos])
+        return chr(self.grid.get(self.x, self.y))
 
     def color_of(self, position: coord) -> int:
         try:
             # TODO properly color strings (which is kinda impossible)
-            return COLORS[chr(self.grid[position])]
+            return COLORS[chr(self.grid.get(position.x, position.y))]
         except KeyError:
             return 8
 
-    def step(self):
-        try:
-            res = self._step()
-            if res[1] == Actions.HALT:
-                self.halted = True
-        except Exception as err:
-            return (
-                self.pos,
-                Actions.ERROR,
-                (f"something smells fishy...\n{err}", err),
-            )
-        return res
+    def depth(self):
+        return self.stacks.depth(self.stack)
+
+    def describe_error(self, err):
+        return (f"something smells fishy...\n{err}", err)
 
     # TODO "something smells fishy..." on error
     # TODO unrelated but maybe some "do you want to quit" on program halt
     def _step(self):
-        action = Actions.NONE
+        action = NONE
         value = None
 
         trampoline = False
@@ -164,7 +392,7 @@ class Fish(Interpreter):
 
         # Execution
         elif self.cell == ";":
-            return (self.pos, Actions.HALT, None)
+            return (Actions.HALT, None)
 
         # Input/output
         elif self.cell == "n":
@@ -174,46 +402,28 @@ class Fish(Interpreter):
             action = Actions.OUTPUT
             value = chr(self.stack.pop())
         elif self.cell == "i":
-            action = Actions.INT_INPUT  # TODO push -1 if no input available
+            action = Actions.STRING_INPUT
 
         # Push cell value to stack
         elif self.cell == "g":
             y, x = self.stack.pop(), self.stack.pop()
-            self.stack.append(self.grid[coord(x, y)])
+            self.stack.append(self.grid.get(x, y))
         # Update cell value, complicated since this is on an infinite grid
         elif self.cell == "p":
             y, x, v = self.stack.pop(), self.stack.pop(), self.stack.pop()
-            self.grid[coord(x, y)] = v
-            # Update displayed board as well, if this change is within limits
-            # and the value does not correspond to some control character
-            if 0 <= x < self.limit.x and 0 <= y < self.limit.y and chr(v).isprintable():
-                # Extend board if necessary
-                # (remember that coordinates are zero-indexed)
-                if x >= self.maxpos.x or y >= self.maxpos.y:
-                    ext = (
-                        coord(max(x + 1, self.maxpos.x), max(y + 1, self.maxpos.y))
-                        - self.maxpos
-                    )
-                    for line in self.board:
-                        line.extend([" "] * ext.x)
-                    for _ in range(ext.y):
-                        self.board.extend([[" "] * (self.maxpos.x + ext.x)])
-                # Update board cell
-                self.board[y][x] = chr(v)
-            # Update extents of grid
-            self.minpos = coord(min(self.minpos.x, x), min(self.minpos.y, y))
-            self.maxpos = coord(max(self.maxpos.x, x), max(self.maxpos.y, y))
+            self.put(x, y, v)
 
         # Movement
         elif self.cell in DELTA_CHANGERS:
             self.delta = DELTA_CHANGERS[self.cell]
         elif self.cell in MIRRORS:
-            self.delta = MIRRORS[self.cell](self.delta)
+            self.dx, self.dy = MIRRORS[self.cell](self.dx, self.dy)
         elif self.cell in "x#":
+            self.entropy += 1
             self.delta = random.choice(DIRECTIONS)
         elif self.cell == ".":  # Teleport
             y, x = self.stack.pop(), self.stack.pop()
-            self.pos = coord(x, y)
+            self.x, self.y = x, y
             teleported = True
         elif self.cell == "!":  # Skip
             trampoline = True
@@ -235,27 +445,20 @@ class Fish(Interpreter):
         elif self.cell in STACK_MODIFIERS:
             STACK_MODIFIERS[self.cell](self.stack)
         elif self.cell == "r":
-            self.stack = list(reversed(self.stack))
+            self.stack = self.stacks.reverse(self.stack)
         elif self.cell == "{":
-            self.stack = self.stack[1:] + [self.stack[0]]  # Shift left
+            self.stack = self.stacks.shift_left(self.stack)
         elif self.cell == "}":
-            self.stack = [self.stack[-1]] + self.stack[:-1]  # Shift right
+            self.stack = self.stacks.shift_right(self.stack)
         elif self.cell == "[":
             # Push new stack
             n = self.stack.pop()
-            self.stackstack.append((self.stack[:-n], self.register))
-            self.stack = self.stack[-n:]
+            self.stack = self.stacks.push_stack(self.stack, n, self.register)
             self.register = None
         elif self.cell == "]":
-            if len(self.stackstack) > 0:
-                # Pop stack and move values to old stack
-                newstack, newreg = self.stackstack.pop()
-                self.stack = newstack + self.stack
-                self.register = newreg
-            else:
-                # Empty stack & reg if no other stack
-                self.stack = []
-                self.register = None
+            # Pop stack and move values to old stack,
+            # or empty stack & reg if no other stack
+            self.stack, self.register = self.stacks.pop_stack(self.stack)
         elif self.cell == "&":
             if self.register is None:
                 self.register = self.stack.pop()
@@ -265,19 +468,203 @@ class Fish(Interpreter):
 
         # Update position
         if trampoline and not self.stringmode:
-            self.pos = self.pos + self.delta + self.delta
+            self.x += 2 * self.dx
+            self.y += 2 * self.dy
         elif not teleported:
-            self.pos = self.pos + self.delta
+            self.x += self.dx
+            self.y += self.dy
 
         # Wrap around source code (account for possible negative coordinates)
-        self.pos = (self.pos + self.minpos) % (self.maxpos - self.minpos) - self.minpos
+        minx, miny = self.minx, self.miny
+        self.x = (self.x + minx) % (self.maxx - minx) - minx
+        self.y = (self.y + miny) % (self.maxy - miny) - miny
+
+        if action is NONE:
+            return None
+        return (action, value)
+
+    def _fetch(self) -> int:
+        x, y = self.x, self.y
+        width, height = self.width, self.height
+        if type(x) is int and type(y) is int and 0 <= x < width and 0 <= y < height:
+            return self.code[y * width + x]
+        # The grid also takes care of positions that are floats
+        return decode(self.grid.get(x, y))
+
+    def _move(self):
+        minx, miny = self.minx, self.miny
+        self.x = (self.x + self.dx + minx) % (self.maxx - minx) - minx
+        self.y = (self.y + self.dy + miny) % (self.maxy - miny) - miny
+
+    def _dispatch(self):
+        op = self._fetch()
+        res = None
+        if self.stringmode:
+            if op in QUOTES:
+                self.stringmode = False
+            else:
+                self.stack.append(op if op < OTHER else ord(self.cell))
+        else:
+            res = HANDLERS[op](self)
+            if res is not None and res[0] == Actions.HALT:
+                return res
+        self._move()
+        return res
 
-        return (self.pos, action, value)
+    def _execute(self, until):
+        handlers = HANDLERS
+        fetch = self._fetch
+        move = self._move
+        left = steps_left(self.steps, until)
+        ticks = repeat(None, left)
+        try:
+            for _ in ticks:
+                op = fetch()
+                if self.stringmode:
+                    if op in QUOTES:
+                        self.stringmode = False
+                    else:
+                        self.stack.append(op if op < OTHER else ord(self.cell))
+                else:
+                    res = handlers[op](self)
+                    if res is not None:
+                        if res[0] == Actions.HALT:
+                            return (self.pos, Actions.HALT, None)
+                        move()
+                        return (self.pos, *res)
+                move()
+            return (self.pos, NONE, None)
+        except Exception as err:
+            return self._stop(err)
+        finally:
+            self.steps += left - length_hint(ticks)
+
+    def get(self, x: int, y: int):
+        return self.grid.get(x, y)
+
+    def put(self, x: int, y: int, v):
+        if self.shared:
+            # Copy on write, the grid is shared with a fork
+            self.grid = self.grid.copy()
+            self.board = copy(self.board)
+            self.code = list(self.code)
+            self.shared = False
+        if self.board_hash is not None:
+            old = self.grid.get(x, y)
+            self.board_hash = (
+                self.board_hash + cell_hash(x, y, v) - cell_hash(x, y, old)
+            ) & HASH_MASK
+        self.grid.set(x, y, v)
+        if self.limits.cells is not None and self.grid.added > self.limits.cells:
+            raise LimitExceeded("cells", self.limits.cells)
+        # Keep the decoded codebox in sync
+        width, height = self.width, self.height
+        if 0 <= x < width and 0 <= y < height and x == int(x) and y == int(y):
+            self.code[int(y) * width + int(x)] = decode(v)
+        # Update displayed board as well, if this change is within limits
+        # and the value does not correspond to some control character
+        if 0 <= x < self.limit.x and 0 <= y < self.limit.y and chr(v).isprintable():
+            # Extend board if necessary
+            # (remember that coordinates are zero-indexed)
+            if x >= self.maxx or y >= self.maxy:
+                ext_x = max(x + 1, self.maxx) - self.maxx
+                ext_y = max(y + 1, self.maxy) - self.maxy
+                for line in self.board:
+                    line.extend([" "] * ext_x)
+                for _ in range(ext_y):
+                    self.board.extend([[" "] * (self.maxx + ext_x)])
+            # Update board cell
+            self.board[y][x] = chr(v)
+            if self.changed is not None:
+                self.changed.add((x, y))
+        # Update extents of grid
+        self.minx, self.miny = min(self.minx, x), min(self.miny, y)
+        self.maxx, self.maxy = max(self.maxx, x), max(self.maxy, y)
 
     def recv(self, value):
-        self.stack.append(value)
+        self.entropy += 1
+        self.stack.append(ord(value) if isinstance(value, str) else value)
 
     def internal_state(self):
         return ["Register:", str(self.register), "Stack:"] + [
             str(i) for i in reversed(self.stack)
         ]
+
+    def fork(self):
+        clone = super().fork()
+        self.stack = self.stacks.adopt(self.stack)
+        clone.stacks = self.stacks.copy()
+        clone.stack = clone.stacks.current
+        return clone
+
+    def fingerprint(self):
+        if self.board_hash is None:
+            self.board_hash = (
+                sum(cell_hash(x, y, v) for (x, y), v in self.grid.items()) & HASH_MASK
+            )
+        self.stack = self.stacks.adopt(self.stack)
+        values, base, flipped, frames = self.stacks.dump()
+        return hash(
+            (
+                self.board_hash,
+                self.x,
+                self.y,
+                self.dx,
+                self.dy,
+                self.minx,
+                self.miny,
+                self.maxx,
+                self.maxy,
+                self.stringmode,
+                self.register,
+                tuple(values),
+                base,
+                flipped,
+                tuple(frames),
+            )
+        )
+
+    def machine_state(self):
+        self.stack = self.stacks.adopt(self.stack)
+        values, base, flipped, frames = self.stacks.dump()
+        return (
+            self.x,
+            self.y,
+            self.dx,
+            self.dy,
+            (self.minx, self.miny, self.maxx, self.maxy),
+            self.stringmode,
+            self.register,
+            values,
+            base,
+            flipped,
+            list(frames),
+            dict(self.grid.items()),
+        )
+
+    def _state(self):
+        self.stack = self.stacks.adopt(self.stack)
+        return {
+            "stack": self.stacks.dump(),
+            "board": ["".join(row) for row in self.board],
+            "grid": self.grid.dump(),
+            "extents": (self.minx, self.miny, self.maxx, self.maxy),
+            "register": self.register,
+            "stringmode": self.stringmode,
+        }
+
+    def _set_state(self, state):
+        self.board = [list(row) for row in state["board"]]
+        self.grid = Grid.load(state["grid"])
+        if self.limits.cells is not None:
+            self.grid.max_dense = min(self.grid.max_dense, self.limits.cells)
+        self.minx, self.miny, self.maxx, self.maxy = state["extents"]
+        self.register = state["register"]
+        self.stacks = Stacks.load(state["stack"], self.compact)
+        self.stack = self.stacks.current
+        self.stringmode = state["stringmode"]
+        self.code = [
+            decode(self.grid.get(x, y))
+            for y in range(self.height)
+            for x in range(self.width)
+        ]
@@ -0,0 +1,261 @@
+"""
+Infinite grid of numbers, as used by the Fish codebox
+
+The original codebox and any area that grows contiguously from it are kept in
+a flat array of machine integers. Writes far away from that area, and values
+that do not fit in a machine integer, go to a sparse map instead.
+"""
+
+from array import array
+
+# Marks a dense cell whose value lives in the sparse map
+BOXED = -(2**63)
+MIN = BOXED + 1
+MAX = 2**63 - 1
+
+# Writes at most this far outside the dense area (or half its size, if that
+# is more) grow the dense area instead of going to the sparse map
+SLACK = 16
+# Largest dense area, in cells
+MAX_DENSE = 1 << 24
+# Dense areas up to this size may grow regardless of how full they are
+MIN_DENSE = 1 << 12
+# Beyond that, at least one in this many cells of the grown area must be in use
+DENSITY = 8
+
+
+def _integral(n):
+    # Floats may be used as coordinates, 2.0 is the same cell as 2
+    if type(n) is float and n.is_integer():
+        return int(n)
+    return n
+
+
+class Grid:
+    __slots__ = (
+        "left",
+        "top",
+        "width",
+        "height",
+        "cells",
+        "sparse",
+        "max_dense",
+        "used",
+        "added",
+        "codebox",
+        "codebox_width",
+    )
+
+    def __init__(self, width: int, height: int):
+        self.left = 0
+        self.top = 0
+        self.width = width
+        self.height = height
+        self.cells = array("q", bytes(8 * width * height))
+        self.sparse = {}
+        # Largest dense area, in cells
+        self.max_dense = MAX_DENSE
+        # Number of non-zero dense cells
+        self.used = 0
+        # Number of cells that set() made non-zero, less those of them it made
+        # 0 again, so that the cells of the board a grid is made from do not
+        # count
+        self.added = 0
+        # Non-zero for the cells of that board that set() did not yet clear,
+        # row by row from (0, 0)
+        self.codebox = bytearray()
+        self.codebox_width = 0
+
+    @classmethod
+    def from_board(cls, board: list[list[str]]):
+        """Grid with the non-space cells of a (normalized) board"""
+        width = len(board[0]) if board else 0
+        grid = cls(width, len(board))
+        cells = grid.cells
+        codebox = grid.codebox = bytearray(len(cells))
+        grid.codebox_width = width
+        for y, row in enumerate(board):
+            for x, cell in enumerate(row):
+                # Only assign cells with something non-default in them
+                if cell != " ":
+                    cells[y * width + x] = ord(cell)
+                    codebox[y * width + x] = 1
+                    grid.used += 1
+        return grid
+
+    @classmethod
+    def from_rows(cls, rows: list[bytes], width: int):
+        """Grid with the cells of rows of bytes of the same width, 0 if empty"""
+        grid = cls(0, 0)
+        grid.width, grid.height = width, len(rows)
+        for row in rows:
+            grid.cells.extend(row)
+            grid.used += width - row.count(0)
+        grid.codebox = bytearray(b"".join(rows))
+        grid.codebox_width = width
+        return grid
+
+    def copy(self):
+        grid = Grid.__new__(Grid)
+        for name in self.__slots__:
+            setattr(grid, name, getattr(self, name))
+        grid.cells = array("q", self.cells)
+        grid.sparse = dict(self.sparse)
+        grid.codebox = bytearray(self.codebox)
+        return grid
+
+    def dump(self) -> tuple:
+        """State of the grid, with only what marshal supports"""
+        return (
+            self.left,
+            self.top,
+            self.width,
+            self.height,
+            self.cells.tobytes(),
+            self.sparse,
+            self.used,
+            self.added,
+            bytes(self.codebox),
+            self.codebox_width,
+        )
+
+    @classmethod
+    def load(cls, state: tuple):
+        """Counterpart of dump"""
+        left, top, width, height, cells, sparse, used, *rest = state
+        grid = cls(0, 0)
+        grid.left, grid.top, grid.width, grid.height = left, top, width, height
+        grid.cells = array("q", cells)
+        grid.sparse = sparse
+        grid.used = used
+        # Snapshots from before added was kept count it from there on, and
+        # those from before the codebox was kept count every cell set() clears
+        if rest:
+            grid.added = rest[0]
+        if len(rest) > 1:
+            grid.codebox = bytearray(rest[1])
+            grid.codebox_width = rest[2]
+        return grid
+
+    def _index(self, x, y):
+        """Index of a cell in the dense area, or None if it is outside"""
+        x -= self.left
+        y -= self.top
+        if type(x) is int and type(y) is int:
+            if 0 <= x < self.width and 0 <= y < self.height:
+                return y * self.width + x
+        return None
+
+    def get(self, x, y):
+        x, y = _integral(x), _integral(y)
+        i = self._index(x, y)
+        if i is None:
+            return self.sparse.get((x, y), 0)
+        value = self.cells[i]
+        if value == BOXED:
+            return self.sparse[(x, y)]
+        return value
+
+    def set(self, x, y, value):
+        x, y = _integral(x), _integral(y)
+        i = self._index(x, y)
+        if i is None and self._grow(x, y):
+            i = self._index(x, y)
+        if i is None:
+            old = self.sparse.get((x, y), 0)
+            if value != 0:
+                self.sparse[(x, y)] = value
+            elif old != 0:
+                # Empty cells far away take up no memory
+                del self.sparse[(x, y)]
+            self._count(x, y, old, value)
+            return
+        old = self.cells[i]
+        self._count(x, y, self.sparse[(x, y)] if old == BOXED else old, value)
+        if type(value) is int and MIN <= value <= MAX:
+            if old == BOXED:
+                del self.sparse[(x, y)]
+            self.cells[i] = value
+        else:
+            self.cells[i] = BOXED
+            self.sparse[(x, y)] = value
+        self.used += (self.cells[i] != 0) - (old != 0)
+
+    def _count(self, x, y, old, value):
+        """Count a cell in added if set() fills it, and out if set() clears it
+        after filling it, rather than the board the grid is made from"""
+        if old == 0:
+            self.added += value != 0
+        elif value == 0:
+            width = self.codebox_width
+            if type(x) is int and type(y) is int and 0 <= x < width and y >= 0:
+                i = y * width + x
+                if i < len(self.codebox) and self.codebox[i]:
+                    # Filled again later, it counts like any other cell
+                    self.codebox[i] = 0
+                    return
+            self.added -= 1
+
+    def items(self):
+        """Positions and values of the cells that are not 0"""
+        width = self.width
+        for i, value in enumerate(self.cells):
+            if value and value != BOXED:
+                yield (self.left + i % width, self.top + i // width), value
+        for position, value in self.sparse.items():
+            if value:
+                yield position, value
+
+    def __getitem__(self, position):
+        return self.get(position.x, position.y)
+
+    def __setitem__(self, position, value):
+        self.set(position.x, position.y, value)
+
+    def __len__(self) -> int:
+        """Number of cells that take up memory"""
+        return len(self.cells) + len(self.sparse)
+
+    def _grow(self, x, y) -> bool:
+        """Extend the dense area to (x, y) if it is close enough"""
+        if type(x) is not int or type(y) is not int:
+            return False
+        right, bottom = self.left + self.width, self.top + self.height
+        slack_x = max(SLACK, self.width // 2)
+        slack_y = max(SLACK, self.height // 2)
+        if not (
+            self.left - slack_x <= x < right + slack_x
+            and self.top - slack_y <= y < bottom + slack_y
+        ):
+            return False
+        # Leave room for further growth in the same direction
+        left = x - slack_x if x < self.left else self.left
+        top = y - slack_y if y < self.top else self.top
+        right = x + slack_x if x >= right else right
+        bottom = y + slack_y if y >= bottom else bottom
+        width, height = right - left, bottom - top
+        area = width * height
+        if area > self.max_dense:
+            return False
+        # Scattered writes (like a diagonal) would leave the area mostly empty
+        if area > MIN_DENSE and (self.used + len(self.sparse) + 1) * DENSITY < area:
+            return False
+
+        cells = array("q", bytes(8 * width * height))
+        offset = (self.top - top) * width + self.left - left
+        for row in range(self.height):
+            start = row * self.width
+            at = offset + row * width
+            cells[at : at + self.width] = self.cells[start : start + self.width]
+        self.left, self.top, self.width, self.height = left, top, width, height
+        self.cells = cells
+
+        # Move values that are now within the dense area
+        for (sx, sy), value in list(self.sparse.items()):
+            i = self._index(sx, sy)
+            if i is not None and cells[i] != BOXED:
+                del self.sparse[(sx, sy)]
+                # Still the same cell, set() counts it again
+                self.added -= value != 0
+                self.set(sx, sy, value)
+        return True
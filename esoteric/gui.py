@@ -1,22 +1,28 @@
 import curses
-from enum import IntEnum, auto
+from esoteric.breakpoints import Breakpoints
+from esoteric.colors import HEAT
 from esoteric.interpreter import Actions, coord
-from itertools import islice
+from itertools import count, islice
+from time import perf_counter
 
-
-class Colors(IntEnum):
-    BLACK = auto()
-    RED = auto()
-    GREEN = auto()
-    YELLOW = auto()
-    BLUE = auto()
-    MAGENTA = auto()
-    CYAN = auto()
-    WHITE = auto()
+FPS = 30
+# Steps per frame, doubled and halved with + and -
+DEFAULT_SPEED = 1
+MAX_SPEED = 1 << 16
+# How many steps to run between checks of the clock at full speed
+CHECK_INTERVAL = 256
+# How many steps to run between checks for keys when running to a breakpoint
+POLL_INTERVAL = 1 << 16
 
 
 class Gui:
-    def __init__(self, screen, interpreter):
+    def __init__(
+        self,
+        screen,
+        interpreter,
+        breakpoints: Breakpoints = None,
+        rewind: int = None,
+    ):
         curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_BLACK)
         curses.init_pair(2, curses.COLOR_RED, curses.COLOR_BLACK)
         curses.init_pair(3, curses.COLOR_GREEN, curses.COLOR_BLACK)
@@ -30,7 +36,30 @@ class Gui:
         screen.clear()
         self.screen = screen
         self.interpreter = interpreter
-        self.result = ""
+        # Only cells changed since the last frame are redrawn
+        interpreter.changed = set()
+        # Where the next output goes in the result pane
+        self.result_line = 0
+        self.result_col = 0
+        self.after_cr = False
+        # Steps per frame, None for as many as fit in a frame
+        self.speed = DEFAULT_SPEED
+        self.paused = False
+        # Steps to run in the next frame even if paused
+        self.pending = 0
+        # The LimitExceeded that stopped the program, if any
+        self.stopped = None
+        # Heat levels of the cells while the heatmap is shown, else None
+        self.heat = None
+        self.breakpoints = breakpoints or Breakpoints()
+        # Whether to run without rendering until a breakpoint or watch fires
+        self.to_break = False
+        # Why the program was last paused by a breakpoint or watch
+        self.hit = None
+        # Steps when that happened, a breakpoint does not fire twice in a row
+        self.hit_at = None
+        # Steps can be undone with u and U, up to rewind of them
+        self.journal = interpreter.start_journal(rewind)
 
         # Layout:
         # code | stack
@@ -41,20 +70,40 @@ class Gui:
         colsplit = cols // 2 + cols % 2
         linesplit = lines // 2 + lines % 2
         interpreter.limit = coord(colsplit - 2, lines - 2)
+        self.colsplit = colsplit
         self.codepane = curses.newwin(lines, colsplit)
         self.stackpane = curses.newwin(linesplit, cols // 2, 0, colsplit)
         self.resultpane = curses.newwin(lines // 2, cols // 2, linesplit, colsplit)
 
+    def display_cell(self, x: int, y: int):
+        if self.heat is None:
+            color = self.interpreter.color_of(coord(x, y))
+        else:
+            color = HEAT[self.heat.get((x, y), 0)]
+        attributes = curses.color_pair(color)
+        if (x, y) in self.breakpoints.cells:
+            attributes |= curses.A_REVERSE
+        self.codepane.addch(y + 1, x + 1, self.interpreter.char_at(x, y), attributes)
+
     def display_code(self):
         self.codepane.border()
         for i, line in enumerate(self.interpreter.board):
-            for j, c in enumerate(line):
-                self.codepane.addch(
-                    i + 1,
-                    j + 1,
-                    c,
-                    curses.color_pair(self.interpreter.color_of(coord(j, i))),
-                )
+            for j in range(len(line)):
+                self.display_cell(j, i)
+
+    def display_changes(self):
+        if self.heat is not None:
+            # Any executed cell may have changed color
+            self.heat = self.interpreter.profile.heat(len(HEAT))
+            self.interpreter.changed.clear()
+            self.display_code()
+            return
+        changed = self.interpreter.changed
+        limit = self.interpreter.limit
+        while changed:
+            x, y = changed.pop()
+            if 0 <= x < limit.x and 0 <= y < limit.y:
+                self.display_cell(x, y)
 
     def display_stack(self):
         # Clear old stack, to avoid issues when it empties
@@ -71,17 +120,147 @@ class Gui:
     def display_result(self):
         self.resultpane.border()
         self.resultpane.addstr(1, 1, "Result:", curses.A_BOLD)
-        for i, line in enumerate(self.result.splitlines()):
-            self.resultpane.addstr(i + 2, 1, "".join(line))
 
-    def render(self):
-        for pos, action, output in self.interpreter:
-            key = self.codepane.getch()
-            if key == ord("q"):
-                break
+    def display_output(self, output: str):
+        # Only the new output is drawn, after what is already there
+        lines, cols = self.resultpane.getmaxyx()
+        for c in output:
+            if c == "\n" and self.after_cr:
+                # \r\n is a single line break
+                self.after_cr = False
+                continue
+            self.after_cr = c == "\r"
+            if c in "\r\n":
+                self.result_line += 1
+                self.result_col = 0
+                continue
+            if self.result_line + 2 < lines - 1 and self.result_col + 1 < cols - 1:
+                self.resultpane.addstr(self.result_line + 2, self.result_col + 1, c)
+            self.result_col += 1
+
+    def display_speed(self):
+        if self.to_break:
+            label = "to breakpoint"
+        elif self.paused:
+            label = "paused" if self.hit is None else f"paused, {self.hit}"
+        elif self.speed is None:
+            label = "full speed"
+        else:
+            label = f"{self.speed} step{'s' if self.speed > 1 else ''}/frame"
+        # Restore the border under longer labels
+        width = self.colsplit - 4
+        self.codepane.hline(self.lines - 1, 2, curses.ACS_HLINE, width)
+        self.codepane.addstr(self.lines - 1, 2, f" {label} "[:width])
+
+    def display_frame(self):
+        self.display_stack()
+        self.display_result()
+        self.display_changes()
+        self.display_speed()
+
+        pos = self.interpreter.pos
+        if (
+            0 <= pos.x < self.interpreter.limit.x
+            and 0 <= pos.y < self.interpreter.limit.y
+        ):
+            self.codepane.move(pos.y + 1, pos.x + 1)
+        else:
+            self.resultpane.addstr(1, 1, "Cursor is out of bounds", curses.A_BOLD)
+
+        self.stackpane.refresh()
+        self.resultpane.refresh()
+        self.codepane.refresh()
+
+    def handle_key(self, key: int) -> bool:
+        """React to a key, False if the GUI should quit"""
+        if key == ord("q"):
+            return False
+        if key == ord(" "):
+            self.paused = not self.paused
+            self.hit = None
+        elif key in (ord("s"), ord("n")):
+            # Single step
+            self.paused = True
+            self.pending = 1
+        elif key in (ord("+"), ord("=")):
+            if self.speed is not None and self.speed < MAX_SPEED:
+                self.speed *= 2
+            self.paused = False
+        elif key == ord("-"):
+            if self.speed is None:
+                self.speed = MAX_SPEED
+            elif self.speed > 1:
+                self.speed //= 2
+            self.paused = False
+        elif key == ord("f"):
+            self.speed = None
+            self.paused = False
+        elif key == ord("h"):
+            if self.heat is None:
+                # Profiling starts the first time the heatmap is shown
+                self.heat = self.interpreter.start_profile().heat(len(HEAT))
+            else:
+                self.heat = None
+            self.display_code()
+        elif key == ord("b"):
+            # Breakpoint on the cell of the instruction pointer
+            pos = self.interpreter.pos
+            self.breakpoints.toggle(pos.x, pos.y)
+            limit = self.interpreter.limit
+            if 0 <= pos.x < limit.x and 0 <= pos.y < limit.y:
+                self.display_cell(pos.x, pos.y)
+        elif key == ord("c"):
+            self.to_break = True
+            self.paused = False
+            self.hit = None
+        elif key in (ord("u"), ord("U")):
+            # Back a single step, or as many as a frame runs
+            steps = 1 if key == ord("u") else self.speed or MAX_SPEED
+            self.journal.back(steps)
+            self.paused = True
+            self.hit = None
+        return True
+
+    def pause(self, reason: str):
+        """Pause because a breakpoint or watch fired"""
+        self.paused = True
+        self.to_break = False
+        self.hit = reason
+
+    def advance(self, deadline: float):
+        """Run the steps of a frame, stopping at the deadline if at full speed"""
+        if self.pending:
+            steps = self.pending
+            self.pending = 0
+        elif self.paused:
+            return
+        else:
+            steps = self.speed
+        self.run(steps, deadline)
+
+    def run(self, steps: int, deadline: float):
+        """Run a number of steps, or if that is None until the deadline
 
+        Stops early if a breakpoint or watch fires, or the program halts.
+        """
+        interpreter = self.interpreter
+        breakpoints = self.breakpoints
+        for i in count():
+            if steps is not None and i >= steps:
+                break
+            if steps is None and i % CHECK_INTERVAL == 0 and perf_counter() > deadline:
+                break
+            if breakpoints and interpreter.steps != self.hit_at:
+                reason = breakpoints.before(interpreter)
+                if reason is not None:
+                    self.pause(reason)
+                    self.hit_at = interpreter.steps
+                    break
+            _, action, output = interpreter.step()
             if action == Actions.OUTPUT:
-                self.result += output
+                self.display_output(output)
+            elif action == Actions.LIMIT:
+                self.stopped = output
             elif action == Actions.ERROR:
                 self.resultpane.addstr(1, 1, "An error occurred:", curses.A_BOLD)
                 message, error = output
@@ -91,38 +270,61 @@ class Gui:
                 curses.halfdelay(100)
                 self.codepane.getch()
                 raise error
+            if interpreter.halted:
+                break
+            if breakpoints:
+                reason = breakpoints.after(interpreter, action, output)
+                if reason is not None:
+                    self.pause(reason)
+                    break
 
-            self.display_stack()
-            self.display_result()
-            self.display_code()
+    def run_to_break(self):
+        """Run without rendering until a breakpoint or watch fires, or a key is hit"""
+        self.codepane.timeout(0)
+        while self.to_break and not self.interpreter.halted:
+            self.run(POLL_INTERVAL, None)
+            key = self.codepane.getch()
+            if key != -1:
+                # Stop here and leave the key to the main loop
+                curses.ungetch(key)
+                self.to_break = False
+                self.paused = True
 
-            if (
-                0 <= pos.x < self.interpreter.limit.x
-                and 0 <= pos.y < self.interpreter.limit.y
-            ):
-                self.codepane.move(pos.y + 1, pos.x + 1)
+    def render(self):
+        self.display_code()
+        # Leave halfdelay mode, frames are timed with the timeout of getch
+        curses.cbreak()
+        frame = 1 / FPS
+        while not self.interpreter.halted:
+            start = perf_counter()
+            if self.to_break:
+                self.run_to_break()
             else:
-                self.resultpane.addstr(1, 1, "Cursor is out of bounds", curses.A_BOLD)
-
-            self.stackpane.refresh()
-            self.resultpane.refresh()
-            self.codepane.refresh()
+                self.advance(start + frame)
+            self.display_frame()
+            # Wait for the rest of the frame, or for a key
+            remaining = start + frame - perf_counter()
+            self.codepane.timeout(max(int(remaining * 1000), 0))
+            key = self.codepane.getch()
+            if key != -1 and not self.handle_key(key):
+                break
         else:  # On execution end
+            status = "Finished" if self.stopped is None else f"Stopped, {self.stopped}"
             self.resultpane.addstr(
-                1, 1, "Finished. Press any key or wait 10 seconds.", curses.A_BOLD
+                1, 1, f"{status}. Press any key or wait 10 seconds.", curses.A_BOLD
             )
             self.resultpane.refresh()
             curses.halfdelay(100)
             self.codepane.getch()
 
 
-def run(interpreter):
+def run(interpreter, breakpoints: Breakpoints = None, rewind: int = None):
     def _run(screen):
-        gui = Gui(screen, interpreter)
+        gui = Gui(screen, interpreter, breakpoints, rewind)
         gui.render()
 
     return _run
 
 
-def main(interpreter):
-    curses.wrapper(run(interpreter))
+def main(interpreter, breakpoints: Breakpoints = None, rewind: int = None):
+    curses.wrapper(run(interpreter, breakpoints, rewind))
@@ -1,8 +1,18 @@
-from dataclasses import dataclass
+from dataclasses import astuple, dataclass
 from abc import ABC, abstractmethod
 from enum import Enum, auto
-from sys import stdin
-from typing import Union
+from itertools import repeat
+from math import inf
+from operator import length_hint
+from time import monotonic
+from typing import Optional, Union
+import copy
+import sys
+
+from esoteric import languages
+from esoteric.board import Board, read
+from esoteric.stacks import CompactStack
+from esoteric.streams import Input, Output
 
 
 @dataclass(frozen=True, order=True)
@@ -27,36 +37,513 @@ class Actions(Enum):
     OUTPUT = auto()
     HALT = auto()
     ERROR = auto()
+    # A limit was exceeded, the value is the LimitExceeded
+    LIMIT = auto()
+
+
+# Actions.NONE for the run loops, as a global that takes a tenth of the time
+# to look up that Actions.NONE does (19 against 188 ns on Python 3.11)
+NONE = Actions.NONE
+
+# Most steps a run loop takes in one call, when there is no step to stop at
+MAX_STEPS = sys.maxsize
+
+
+def steps_left(steps: int, until) -> int:
+    """Steps from steps until until, for a run loop to count down
 
+    The run loops iterate over repeat(None, steps_left(...)) and add what the
+    length_hint() of that left over to the steps at the end, rather than add 1
+    on every step, which makes a new int once it is past the small ints that
+    Python caches.
+    """
+    return max(0, min(until, MAX_STEPS) - steps)
 
 StepResult = Union[tuple[coord, int, int], tuple[coord, int, tuple[str, Exception]]]
 
 
+@dataclass
+class Limits:
+    """Resources a program may use, None for no limit"""
+
+    steps: Optional[int] = None
+    # Wall-clock seconds from the first step
+    time: Optional[float] = None
+    # Values on the stack (all stacks for Fish)
+    stack: Optional[int] = None
+    # Cells that p fills beyond those of the codebox it started with (Fish only)
+    cells: Optional[int] = None
+    # Steps between fingerprints of the state, to stop programs that provably
+    # loop forever (see LoopDetector)
+    loops: Optional[int] = None
+
+
+class LimitExceeded(Exception):
+    def __init__(self, limit: str, value):
+        super().__init__(f"{limit} limit of {value} exceeded")
+        # Name of the field of Limits
+        self.limit = limit
+        self.value = value
+
+
+class NonTerminating(LimitExceeded):
+    """The state came back without input or randomness in between"""
+
+    def __init__(self, first: int, steps: int):
+        super().__init__("loops", steps - first)
+        self.args = (
+            f"provably non-terminating, the state after step {first} "
+            f"came back after step {steps}",
+        )
+
+
+# Limits other than the number of steps are checked every this many steps
+CHECK_INTERVAL = 1 << 14
+
+# Boards are hashed as the sum of the hashes of their cells modulo this + 1,
+# so that writing a cell only updates the sum
+HASH_MASK = (1 << 64) - 1
+
+
+def cell_hash(x, y, value) -> int:
+    """Term of a cell in the hash of a board, 0 for empty cells of the grid"""
+    return hash((x, y, value)) if value else 0
+
+
+class LoopDetector:
+    """Brent's cycle detection on states sampled every so many steps
+
+    Sampled at a fixed interval, the states of a deterministic program form a
+    sequence where each follows from the one before, which repeats forever
+    once any state repeats. Only one earlier state is kept, which moves ahead
+    after 1, 2, 4, ... samples, so a cycle is found within a few times its
+    length and memory does not grow. Fingerprints are compared first, and the
+    full states only if those match, so hash collisions do no harm.
+    """
+
+    def __init__(self):
+        self.fingerprint = None
+        self.state = None
+        # Step of the kept state
+        self.first = 0
+        self.power = 1
+        self.length = 0
+        # Inputs and random choices when the state was kept
+        self.entropy = None
+
+    def _keep(self, interpreter, fingerprint):
+        self.fingerprint = fingerprint
+        self.state = interpreter.machine_state()
+        self.first = interpreter.steps
+        self.length = 0
+        self.entropy = interpreter.entropy
+
+    def sample(self, interpreter):
+        """Raise NonTerminating if the state of interpreter was seen before"""
+        fingerprint = interpreter.fingerprint()
+        if self.entropy != interpreter.entropy:
+            # What happens next may depend on the input or randomness
+            self.power = 1
+            self._keep(interpreter, fingerprint)
+            return
+        self.length += 1
+        if (
+            fingerprint == self.fingerprint
+            and interpreter.machine_state() == self.state
+        ):
+            raise NonTerminating(self.first, interpreter.steps)
+        if self.length == self.power:
+            self.power *= 2
+            self._keep(interpreter, fingerprint)
+
+
+# Start of a snapshot, the number is the version of the format
+SNAPSHOT_MAGIC = b"ESO\x01"
+
+# Execution engines:
+# classic - every step runs through the if/elif chain in _step
+# table - cells are decoded to opcodes once and dispatched through a handler table
+# trace - like table, but straight-line runs of cells are compiled (Befunge only)
+ENGINES = ("classic", "table", "trace")
+
+
 class Interpreter(ABC):
-    pos = coord(0, 0)
+    # Position and delta are kept as plain integers, see the pos/delta properties.
+    # coord is only used at the edges, in StepResult and for the GUI.
+    x = 0
+    y = 0
+    dx = 1
+    dy = 0
     halted = False
+    # Number of instructions executed
+    steps = 0
+    # Cells of the board changed since this was last emptied,
+    # only kept track of if this is set to a set (done by the GUI)
+    changed = None
+    engine = "classic"
+    engines = ("classic", "table")
+    # Number of steps after which limits are checked next
+    checkpoint = 0
+    deadline = None
+    # Set by start_profile() and start_journal()
+    profile = None
+    journal = None
+    # Whether the board is shared with a fork, and has to be copied before writing
+    shared = False
+    # Number of inputs and random choices, a state that comes back with any of
+    # these in between may still lead somewhere else
+    entropy = 0
+    # Hash of the board, only kept up to date once fingerprint() is called
+    board_hash = None
+    # Set by check() if loops are to be detected
+    loop_detector = None
+    # Input the async driver was waiting for when it was cancelled, and the
+    # AsyncInput it read from, with anything read ahead (see aio)
+    awaiting = None
+    async_input = None
 
-    def __init__(self, board: list[list[str]]):
-        # Normalize shape
-        width = max(len(line) for line in board)
-        for line in board:
-            line.extend([" "] * (width - len(line)))
+    def __init__(
+        self,
+        board: list[list[str]],
+        engine: str = None,
+        limits: Limits = None,
+        compact: bool = False,
+    ):
+        if isinstance(board, Board):
+            # Rows are padded once they are used
+            width = board.width
+        else:
+            # Normalize shape
+            width = max(len(line) for line in board)
+            for line in board:
+                line.extend([" "] * (width - len(line)))
         self.board = board
-        self.maxpos = coord(width, len(board))
+        self.width = width
+        self.height = len(board)
         # Extents which a changing grid that should be displayed must not exceed (set by GUI)
-        self.limit = self.maxpos
+        self.limit = coord(self.width, self.height)
+        # Cached coords of the cells on the board by index, so that stepping does
+        # not allocate, only for the cells that were visited
+        self.positions = {}
+        # Whether stacks are CompactStacks instead of lists (or deques)
+        self.compact = compact
+        self.stack = self._new_stack()
+        self.limits = limits or Limits()
+        if engine is not None:
+            if engine not in self.engines:
+                raise ValueError(f"{type(self).__name__} has no {engine} engine")
+            self.engine = engine
+        self._bind()
+
+    def _new_stack(self, values=()):
+        return CompactStack(values) if self.compact else list(values)
+
+    def _bind(self):
+        """Set up the engine, for a new interpreter or a fork"""
+        if self.engine != "classic":
+            self._step = self._dispatch
+
+    @classmethod
+    def from_string(cls, board: str, **kwargs):
+        return cls([list(line) for line in board.splitlines()], **kwargs)
 
     @classmethod
-    def from_string(cls, board: str):
-        return cls([list(line) for line in board.splitlines()])
+    def from_file(cls, path: str, **kwargs):
+        """Like from_string() of the file, but mapping it instead of reading it
+
+        See esoteric.board.
+        """
+        return cls(read(path), **kwargs)
+
+    @property
+    def maxpos(self) -> coord:
+        return coord(self.width, self.height)
+
+    @property
+    def pos(self) -> coord:
+        x, y = self.x, self.y
+        # Fish may teleport to positions that are floats, which are not cached
+        if (
+            type(x) is int
+            and type(y) is int
+            and 0 <= x < self.width
+            and 0 <= y < self.height
+        ):
+            i = y * self.width + x
+            position = self.positions.get(i)
+            if position is None:
+                position = self.positions[i] = coord(x, y)
+            return position
+        return coord(x, y)
+
+    @pos.setter
+    def pos(self, value: coord):
+        self.x, self.y = value.x, value.y
+
+    @property
+    def delta(self) -> coord:
+        return coord(self.dx, self.dy)
+
+    @delta.setter
+    def delta(self, value: coord):
+        self.dx, self.dy = value.x, value.y
 
     @property
     def cell(self):
-        return self.board[self.pos.y][self.pos.x]
+        return self.board[self.y][self.x]
+
+    def char_at(self, x: int, y: int) -> str:
+        """Character shown for the cell at (x, y) of the board"""
+        return self.board[y][x]
 
-    @abstractmethod
     def step(self) -> StepResult:
-        pass
+        if self.steps >= self.checkpoint:
+            try:
+                self.check()
+            except LimitExceeded as err:
+                return self._stop(err)
+        self.steps += 1
+        try:
+            res = self._step()
+        except Exception as err:
+            return self._stop(err)
+        if res is None:
+            return (self.pos, NONE, None)
+        if res[0] == Actions.HALT:
+            self.halted = True
+        return (self.pos, *res)
+
+    @abstractmethod
+    def _step(self) -> Optional[tuple]:
+        """Run the instruction under the pointer, and move on unless it halts
+
+        Returns None, or the action and its value, like the handlers of the
+        table engine do. step() makes a StepResult of that.
+        """
+
+    @abstractmethod
+    def _dispatch(self) -> Optional[tuple]:
+        """Table engine counterpart of _step"""
+
+    @abstractmethod
+    def _execute(self, until) -> StepResult:
+        """Run the table engine until the next step with an action other than Actions.NONE
+
+        Stops with Actions.NONE once the number of steps reaches until.
+        """
+
+    def _step_until(self, until) -> StepResult:
+        """Classic engine counterpart of _execute"""
+        step = self._step
+        while True:
+            # step() checks the limits, and journals need the steps as they
+            # are after every step
+            while self.steps < until and (
+                self.journal is not None or self.steps >= self.checkpoint
+            ):
+                res = self.step()
+                if res[1] != NONE:
+                    return res
+            left = steps_left(self.steps, min(until, self.checkpoint))
+            ticks = repeat(None, left)
+            try:
+                for _ in ticks:
+                    res = step()
+                    if res is not None:
+                        if res[0] == Actions.HALT:
+                            self.halted = True
+                        return (self.pos, *res)
+            except Exception as err:
+                return self._stop(err)
+            finally:
+                self.steps += left - length_hint(ticks)
+            if self.steps >= until:
+                return (self.pos, NONE, None)
+
+    def start_profile(self) -> "Profile":
+        """Count executions per cell and opcode from now on
+
+        Every step then runs through _step, so the trace engine no longer
+        runs compiled traces. Without this, nothing is counted.
+        """
+        if self.profile is None:
+            from esoteric.profile import Profile
+
+            self.profile = Profile()
+            self._step = self.profile.wrap(self, self._step)
+            self._execute = self._step_until
+        return self.profile
+
+    def start_journal(self, capacity: int = None, interval: int = None) -> "Journal":
+        """Record every step from now on, so that steps can be undone
+
+        See esoteric.journal for the arguments. Like profiling, this runs every
+        step through _step.
+        """
+        if self.journal is None:
+            from esoteric.journal import Journal
+
+            self.journal = Journal(self, capacity, interval)
+            self._step = self.journal.wrap(self._step)
+            self._execute = self._step_until
+        return self.journal
+
+    def fork(self):
+        """Copy to run separately, which shares the board until either one writes
+
+        Any profile and compiled traces are not part of the copy.
+        """
+        clone = copy.copy(self)
+        # Drop the engine bound to self, and anything bound to it
+        for name in ("_step", "_execute"):
+            clone.__dict__.pop(name, None)
+        clone.profile = None
+        clone.journal = None
+        clone.changed = None
+        clone.loop_detector = None
+        clone.async_input = None
+        clone.stack = self._new_stack(self.stack)
+        clone._bind()
+        self.shared = clone.shared = True
+        return clone
+
+    def snapshot(self) -> bytes:
+        """Compact binary snapshot of the state, see restore()"""
+        import marshal
+        import zlib
+
+        state = {
+            "language": type(self).__name__,
+            "engine": self.engine,
+            "limits": astuple(self.limits),
+            "width": self.width,
+            "height": self.height,
+            "position": (self.x, self.y, self.dx, self.dy),
+            "halted": self.halted,
+            "steps": self.steps,
+            "stack": list(self.stack),
+            "compact": self.compact,
+            **self._state(),
+        }
+        return SNAPSHOT_MAGIC + zlib.compress(marshal.dumps(state))
+
+    @classmethod
+    def restore(cls, data: bytes, engine: str = None, limits: Limits = None):
+        """Interpreter in the state of a snapshot, to continue where it left off
+
+        The engine and limits are those of the snapshot, unless given. Limits
+        that are None in the given ones keep the value of the snapshot.
+        Interpreter.restore() restores snapshots of any registered language.
+        """
+        state = cls._decode(data)
+        saved = Limits(*state["limits"])
+        if limits is not None:
+            saved = Limits(
+                *(
+                    old if new is None else new
+                    for new, old in zip(astuple(limits), astuple(saved))
+                )
+            )
+        language = state["language"]
+        if cls is Interpreter:
+            try:
+                # Imports the language if it was not yet
+                languages.get(language.lower())
+            except ValueError:
+                pass
+        if language != cls.__name__:
+            subclasses = {sub.__name__: sub for sub in cls.__subclasses__()}
+            if language not in subclasses:
+                raise ValueError(f"Snapshot of {language}, not {cls.__name__}")
+            cls = subclasses[language]
+        board = [[" "] * state["width"] for _ in range(state["height"])]
+        program = cls(
+            board,
+            engine=engine or state["engine"],
+            limits=saved,
+            compact=state.get("compact", False),
+        )
+        program._load(state)
+        return program
+
+    @staticmethod
+    def _decode(data: bytes) -> dict:
+        if not data.startswith(SNAPSHOT_MAGIC):
+            raise ValueError("Not a snapshot, or of an unsupported version")
+        import marshal
+        import zlib
+
+        return marshal.loads(zlib.decompress(data[len(SNAPSHOT_MAGIC) :]))
+
+    def _load(self, state: dict):
+        """Take on the state of a decoded snapshot of the same size"""
+        self.x, self.y, self.dx, self.dy = state["position"]
+        self.halted = state["halted"]
+        self.steps = state["steps"]
+        self.stack = self._new_stack(state["stack"])
+        self.board_hash = None
+        self.shared = False
+        self._set_state(state)
+
+    @abstractmethod
+    def _state(self) -> dict:
+        """State particular to the language, with only what marshal supports"""
+
+    @abstractmethod
+    def _set_state(self, state: dict):
+        """Counterpart of _state"""
+
+    def depth(self) -> int:
+        """Number of values on the stack"""
+        return len(self.stack)
+
+    @abstractmethod
+    def fingerprint(self) -> int:
+        """Hash of the state that determines what the program does next"""
+
+    @abstractmethod
+    def machine_state(self):
+        """Copy of the state that fingerprint() hashes, to compare states exactly"""
+
+    def check(self):
+        """Raise LimitExceeded if a limit is exceeded, and set the next checkpoint"""
+        limits = self.limits
+        if limits.steps is not None and self.steps >= limits.steps:
+            raise LimitExceeded("steps", limits.steps)
+        if limits.time is not None:
+            # Only the time between checks is spent past the deadline
+            now = monotonic()
+            if self.deadline is None:
+                self.deadline = now + limits.time
+            elif now >= self.deadline:
+                raise LimitExceeded("time", limits.time)
+        if limits.stack is not None and self.depth() > limits.stack:
+            raise LimitExceeded("stack", limits.stack)
+        if limits.loops is not None:
+            if self.loop_detector is None:
+                self.loop_detector = LoopDetector()
+            self.loop_detector.sample(self)
+        if limits.time is None and limits.stack is None and limits.loops is None:
+            self.checkpoint = inf if limits.steps is None else limits.steps
+        else:
+            # Loops are detected in states sampled at a fixed interval
+            interval = CHECK_INTERVAL
+            if limits.loops is not None:
+                interval = min(interval, limits.loops)
+            self.checkpoint = self.steps + interval
+            if limits.steps is not None:
+                self.checkpoint = min(self.checkpoint, limits.steps)
+
+    def _stop(self, err: Exception) -> StepResult:
+        """Result of a step that raised err"""
+        if isinstance(err, LimitExceeded):
+            # Not an error in the program, it is just stopped
+            self.halted = True
+            return (self.pos, Actions.LIMIT, err)
+        return (self.pos, Actions.ERROR, self.describe_error(err))
+
+    def describe_error(self, err: Exception) -> tuple[str, Exception]:
+        return (f"{err}", err)
 
     @abstractmethod
     def recv(self, value: Union[int, str]):
@@ -74,32 +561,47 @@ class Interpreter(ABC):
         while not self.halted:
             yield self.step()
 
-    def run(self):
+    def _drive(self, output: Output, source: Input):
+        execute = self._step_until if self.engine == "classic" else self._execute
         while not self.halted:
-            _, action, value = self.step()
+            if self.steps >= self.checkpoint:
+                self.check()
+            _, action, value = execute(self.checkpoint)
             if action == Actions.STRING_INPUT:
-                self.recv(stdin.read(1))
+                # Make sure any prompt is seen before blocking on input
+                output.flush()
+                self.recv(source.read_char())
             elif action == Actions.INT_INPUT:
-                self.recv(int(stdin.read(1)))
+                output.flush()
+                self.recv(source.read_int())
             elif action == Actions.OUTPUT:
-                print(str(value), end="")
+                output.write(value)
             elif action == Actions.HALT:
                 self.halted = True
+            elif action == Actions.LIMIT:
+                raise value
             elif action == Actions.ERROR:
                 raise Exception(value)
 
-    def eval(self):
-        output = []
-        while not self.halted:
-            _, action, value = self.step()
-            if action == Actions.STRING_INPUT:
-                self.recv(stdin.read(1))
-            elif action == Actions.INT_INPUT:
-                self.recv(int(stdin.read(1)))
-            elif action == Actions.OUTPUT:
-                output.append(str(value))
-            elif action == Actions.HALT:
-                self.halted = True
-            elif action == Actions.ERROR:
-                raise Exception(value)
-        return "".join(output)
+    def run(self, source=None, target=None, flush: str = None):
+        """Run until halted, reading input from source and writing output to target
+
+        These are stdin and stdout by default, see esoteric.streams for what
+        else they can be. Output is flushed according to the flush policy,
+        which is line by line if stdout is a terminal and in blocks otherwise.
+        """
+        if target is None:
+            target = sys.stdout
+            if flush is None and target.isatty():
+                flush = "line"
+        output = Output(target, flush or "block")
+        try:
+            self._drive(output, Input.of(sys.stdin if source is None else source))
+        finally:
+            output.flush()
+
+    def eval(self, source=None) -> str:
+        """Run until halted and return the output, reading input from source (stdin by default)"""
+        output = Output()
+        self._drive(output, Input.of(sys.stdin if source is None else source))
+        return output.getvalue()
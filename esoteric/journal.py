@@ -0,0 +1,290 @@
+"""
+Undo journal, to step back through a program
+
+Journal.wrap() records how to undo every step before it is run: the position,
+delta and string mode, the top of the stack and its depth, the old value of a
+cell that p writes to, and the register of Fish before &, [ and ], the only
+instructions that change it. No instruction pops more than three values, so
+restoring the top three values and the depth undoes whatever a step did to
+the stack. r, {, }, [ and ] of Fish, which rearrange the whole stack instead,
+are undone with their inverse.
+
+Records go into a ring buffer of a fixed number of steps, packed into a few
+machine integers each. A snapshot of the whole state is also kept every so
+many steps, so that going back far restores the nearest snapshot and only
+undoes the steps between that and the target. Output that was written is not
+taken back.
+"""
+
+from array import array
+from collections import deque
+
+from esoteric.stacks import Stacks
+
+# Steps that can be undone by default
+CAPACITY = 1 << 20
+# Steps between snapshots by default
+INTERVAL = 1 << 14
+
+P = ord("p")
+# Opcodes of Fish that rearrange the stack
+REARRANGE = frozenset(map(ord, "r{}[]"))
+# Opcodes of Fish that change the register
+REGISTER = frozenset(map(ord, "&[]"))
+# Register of a record of a step that leaves it as it is
+KEPT = object()
+
+# Marks a record that is kept as a tuple instead of in the arrays
+BOXED = -(2**63)
+MIN = BOXED + 1
+MAX = 2**63 - 1
+# Positions within this of (0, 0) are packed into a single integer
+OFFSET = 1 << 23
+
+
+def _top(stack, depth: int) -> tuple:
+    """Top three values of the stack, or all of them if there are fewer"""
+    if depth >= 3:
+        return (stack[-3], stack[-2], stack[-1])
+    return tuple(stack[i] for i in range(depth))
+
+
+def _pack(x, y, dx, dy, stringmode) -> int:
+    """Position, delta and string mode in 53 bits, or BOXED if they do not fit"""
+    if (
+        type(x) is int
+        and type(y) is int
+        and -OFFSET <= x < OFFSET
+        and -OFFSET <= y < OFFSET
+        and -1 <= dx <= 1
+        and -1 <= dy <= 1
+    ):
+        return (
+            (((x + OFFSET) << 24 | (y + OFFSET)) << 2 | dx + 1) << 2 | dy + 1
+        ) << 1 | stringmode
+    return BOXED
+
+
+def _unpack(packed: int) -> tuple:
+    stringmode = bool(packed & 1)
+    packed >>= 1
+    dy = (packed & 3) - 1
+    packed >>= 2
+    dx = (packed & 3) - 1
+    packed >>= 2
+    y = (packed & (1 << 24) - 1) - OFFSET
+    x = (packed >> 24) - OFFSET
+    return x, y, dx, dy, stringmode
+
+
+class Journal:
+    """Ring buffer of undo records, with snapshots
+
+    A record takes five machine integers: the packed position, delta and
+    string mode, the depth of the stack and its top three values. Records
+    that do not fit (floats, big numbers) are kept as tuples, and so are the
+    rare records of p, of rearranging the stack and of the register.
+    """
+
+    def __init__(self, interpreter, capacity: int = None, interval: int = None):
+        self.interpreter = interpreter
+        self.capacity = capacity or CAPACITY
+        self.interval = interval or INTERVAL
+        # Columns of the records, filled up to capacity and then reused
+        self.moves = array("q")
+        self.depths = array("q")
+        self.tops = (array("q"), array("q"), array("q"))
+        # Records that are not in the columns, by index
+        self.boxed = {}
+        # Index of the next record, and number of records
+        self.end = 0
+        self.size = 0
+        # (steps, snapshot) every interval steps, for the steps in the records
+        self.snapshots = deque(maxlen=self.capacity // self.interval + 1)
+        self.fish = hasattr(interpreter, "stacks")
+
+    def __len__(self) -> int:
+        """Number of steps that can be undone"""
+        return self.size
+
+    def wrap(self, step):
+        """Step function that records how to undo what step does"""
+        vm = self.interpreter
+        record = self._record
+        push = self._push
+
+        def journaled():
+            entry = record()
+            try:
+                return step()
+            except Exception:
+                if entry[-1] is not None and entry[-1][0] != P:
+                    # Rearranging fails before it changes anything
+                    entry = entry[:-1] + (None,)
+                raise
+            finally:
+                push(entry)
+                if vm.steps % self.interval == 0:
+                    self.snapshots.append((vm.steps, vm.snapshot()))
+
+        return journaled
+
+    def _push(self, entry: tuple):
+        x, y, dx, dy, stringmode, register, depth, top, extra = entry
+        i = self.end
+        packed = BOXED
+        if extra is None and register is KEPT:
+            packed = _pack(x, y, dx, dy, stringmode)
+            for value in top:
+                if type(value) is not int or not MIN <= value <= MAX:
+                    packed = BOXED
+        if i == len(self.moves):
+            self.moves.append(packed)
+            self.depths.append(depth)
+            for column in self.tops:
+                column.append(0)
+        else:
+            self.moves[i] = packed
+            self.depths[i] = depth
+            self.boxed.pop(i, None)
+        if packed == BOXED:
+            self.boxed[i] = entry
+        else:
+            for column, value in zip(self.tops, top):
+                column[i] = value
+        self.end = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _pop(self) -> tuple:
+        i = self.end = (self.end - 1) % self.capacity
+        self.size -= 1
+        packed = self.moves[i]
+        if packed == BOXED:
+            return self.boxed.pop(i)
+        depth = self.depths[i]
+        top = tuple(column[i] for column in self.tops[: min(depth, 3)])
+        return (*_unpack(packed), KEPT, depth, top, None)
+
+    def _record(self) -> tuple:
+        vm = self.interpreter
+        stack = vm.stack
+        depth = len(stack)
+        extra = None
+        register = KEPT
+        if not vm.stringmode:
+            op = vm._fetch()
+            if self.fish and op in REGISTER:
+                register = vm.register
+            if op == P and depth >= 2:
+                x, y = stack[-2], stack[-1]
+                try:
+                    old = vm.get(x, y)
+                except (IndexError, TypeError):
+                    # Not on the board, nothing is written
+                    old = None
+                if not self.fish and not (0 <= x < vm.width and 0 <= y < vm.height):
+                    # Befunge fails instead of writing off the board
+                    old = None
+                extents = (vm.minx, vm.miny, vm.maxx, vm.maxy) if self.fish else None
+                extra = (P, x, y, old, extents)
+            elif self.fish and op in REARRANGE:
+                extra = self._rearrange(op, depth)
+        return (
+            vm.x,
+            vm.y,
+            vm.dx,
+            vm.dy,
+            vm.stringmode,
+            register,
+            depth,
+            _top(stack, depth),
+            extra,
+        )
+
+    def _rearrange(self, op: int, depth: int):
+        vm = self.interpreter
+        c = chr(op)
+        if c == "[" and depth:
+            return (op, vm.stack[-1])
+        if c == "]":
+            vm.stack = vm.stacks.adopt(vm.stack)
+            if vm.stacks.frames:
+                return (op, depth)
+            # Emptied without a stack below, only a copy brings it back
+            values, base, flipped, _ = vm.stacks.dump()
+            return (op, (values, base, flipped, []))
+        return (op,)
+
+    def _undo(self, entry: tuple):
+        vm = self.interpreter
+        x, y, dx, dy, stringmode, register, depth, top, extra = entry
+        if extra is not None and extra[0] != P:
+            self._unrearrange(extra)
+        else:
+            stack = vm.stack
+            for _ in range(len(stack) - depth + len(top)):
+                stack.pop()
+            stack.extend(top)
+            if extra is not None and extra[3] is not None:
+                self._unput(*extra[1:])
+        vm.x, vm.y, vm.dx, vm.dy = x, y, dx, dy
+        vm.stringmode = stringmode
+        if register is not KEPT:
+            vm.register = register
+        vm.steps -= 1
+        vm.halted = False
+
+    def _unput(self, x, y, old, extents):
+        vm = self.interpreter
+        vm.put(x, y, old)
+        if extents is not None:
+            vm.minx, vm.miny, vm.maxx, vm.maxy = extents
+            if old == 0 and 0 <= y < len(vm.board) and 0 <= x < len(vm.board[y]):
+                # put() leaves unprintable values off the displayed board
+                vm.board[y][x] = " "
+
+    def _unrearrange(self, extra: tuple):
+        vm = self.interpreter
+        stacks = vm.stacks
+        c = chr(extra[0])
+        if c == "r":
+            vm.stack = stacks.reverse(vm.stack)
+        elif c == "{":
+            vm.stack = stacks.shift_right(vm.stack)
+        elif c == "}":
+            vm.stack = stacks.shift_left(vm.stack)
+        elif c == "[":
+            vm.stack, _ = stacks.pop_stack(vm.stack)
+            vm.stack.append(extra[1])
+        elif isinstance(extra[1], int):
+            # ] put the stack back on the one below, with the register of that
+            vm.stack = stacks.push_stack(vm.stack, extra[1], vm.register)
+        else:
+            vm.stacks = Stacks.load(extra[1], vm.compact)
+            vm.stack = vm.stacks.current
+
+    def back(self, steps: int = 1) -> int:
+        """Undo up to steps steps, and return how many were undone"""
+        vm = self.interpreter
+        target = vm.steps - min(steps, self.size)
+        # Restore the earliest snapshot that is still ahead of the target
+        snapshots = self.snapshots
+        while snapshots and snapshots[-1][0] > vm.steps:
+            snapshots.pop()
+        ahead = [s for s in snapshots if target <= s[0] < vm.steps]
+        start = vm.steps
+        if ahead:
+            at, data = ahead[0]
+            for _ in range(vm.steps - at):
+                self._pop()
+            vm._load(vm._decode(data))
+            if vm.changed is not None:
+                # Redraw everything, the board was replaced
+                vm.changed.update(
+                    (x, y) for y, row in enumerate(vm.board) for x in range(len(row))
+                )
+        while vm.steps > target:
+            self._undo(self._pop())
+        while snapshots and snapshots[-1][0] > vm.steps:
+            snapshots.pop()
+        return start - vm.steps
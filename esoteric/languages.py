@@ -0,0 +1,83 @@
+"""
+Registry of the languages, by name
+
+A language is named like the extension of its programs, and its interpreter
+is only imported once a program in it is loaded, so that running a ><>
+program never imports Befunge and the other way around. Other packages add
+languages through entry points in the group "esoteric.languages", like
+
+    [project.entry-points."esoteric.languages"]
+    brainfuck = "mypackage.brainfuck:Brainfuck"
+
+for an Interpreter subclass. Entry points are only looked up for names that
+are not built in, and only the one with that name, so they cost nothing when
+running ><> or Befunge and a program with an extension that is no language
+reads no more of them than it has to. Only names() reads them all.
+"""
+
+from importlib import import_module
+
+ENTRY_POINTS = "esoteric.languages"
+# Language of programs with an extension that is not a language
+DEFAULT = "befunge"
+
+# Interpreter of every language, as "module:class" until it is imported
+_registry = {
+    "befunge": "esoteric.befunge:Befunge",
+    "fish": "esoteric.fish:Fish",
+}
+_entry_points_loaded = False
+# Names that were looked up among the entry points, found or not
+_looked_up = set()
+
+
+def register(name: str, interpreter):
+    """Add a language, given as an Interpreter subclass or "module:class" """
+    _registry[name] = interpreter
+
+
+def names() -> list[str]:
+    """Names of every language, including those of entry points"""
+    _load_entry_points()
+    return sorted(_registry)
+
+
+def get(name: str):
+    """Interpreter of a language, imported if it was not yet"""
+    if name not in _registry and not _find_entry_point(name):
+        raise ValueError(f"Unknown language {name}, not one of {names()}")
+    interpreter = _registry[name]
+    if isinstance(interpreter, str):
+        module, _, attribute = interpreter.partition(":")
+        interpreter = _registry[name] = getattr(import_module(module), attribute)
+    return interpreter
+
+
+def of_path(path: str) -> str:
+    """Language of a program by the extension of its path"""
+    extension = path.split(".")[-1]
+    if extension in _registry or _find_entry_point(extension):
+        return extension
+    return DEFAULT
+
+
+def _find_entry_point(name: str) -> bool:
+    """Whether an entry point adds the language name, looking up only that one"""
+    if not _entry_points_loaded and name not in _looked_up:
+        _looked_up.add(name)
+        from importlib.metadata import entry_points
+
+        for entry in entry_points(group=ENTRY_POINTS, name=name):
+            _registry.setdefault(entry.name, entry.value)
+    return name in _registry
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    from importlib.metadata import entry_points
+
+    for entry in entry_points(group=ENTRY_POINTS):
+        _registry.setdefault(entry.name, entry.value)
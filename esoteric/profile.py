@@ -0,0 +1,90 @@
+"""
+Execution profile of a program
+
+Counts how often every cell and every instruction is executed and how deep
+the stack gets. Profiling is opt-in with Interpreter.start_profile(), which
+wraps the step function of that one interpreter, so that the engines are left
+alone without it.
+"""
+
+from collections import Counter
+from math import log
+import csv
+import json
+
+
+class Profile:
+    def __init__(self):
+        # Executions per (x, y) position, including cells pushed in string mode
+        self.cells = Counter()
+        # Executions per instruction (the character of the cell)
+        self.opcodes = Counter()
+        # Stack depth high-water mark, after any step
+        self.max_depth = 0
+
+    def wrap(self, interpreter, step):
+        """Step function that runs step and counts what it executes"""
+        cells, opcodes = self.cells, self.opcodes
+
+        def profiled():
+            cells[interpreter.x, interpreter.y] += 1
+            opcodes[interpreter.cell] += 1
+            try:
+                return step()
+            finally:
+                depth = interpreter.depth()
+                if depth > self.max_depth:
+                    self.max_depth = depth
+
+        return profiled
+
+    @property
+    def steps(self) -> int:
+        return sum(self.opcodes.values())
+
+    def heat(self, levels: int) -> dict:
+        """Level of the executions of every executed cell, from 1 to levels - 1
+
+        Cells that were not executed are left out, they are at level 0.
+        """
+        if not self.cells:
+            return {}
+        # Logarithmic, a few hot loops would leave everything else cold otherwise
+        scale = (levels - 2) / max(log(max(self.cells.values())), 1)
+        return {
+            position: 1 + min(int(log(count) * scale), levels - 2)
+            for position, count in self.cells.items()
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "steps": self.steps,
+            "max_depth": self.max_depth,
+            "opcodes": dict(self.opcodes.most_common()),
+            "cells": [
+                {"x": x, "y": y, "count": count}
+                for (x, y), count in self.cells.most_common()
+            ],
+        }
+
+    def write_json(self, file):
+        json.dump(self.to_dict(), file, indent=2)
+        file.write("\n")
+
+    def write_csv(self, file):
+        """One row per cell and per opcode, and one for the stack depth"""
+        writer = csv.writer(file)
+        writer.writerow(["kind", "x", "y", "opcode", "count"])
+        for (x, y), count in self.cells.most_common():
+            writer.writerow(["cell", x, y, "", count])
+        for opcode, count in self.opcodes.most_common():
+            writer.writerow(["opcode", "", "", opcode, count])
+        writer.writerow(["max_depth", "", "", "", self.max_depth])
+
+    def save(self, path: str):
+        """Write to path, as CSV if it ends in .csv and as JSON otherwise"""
+        with open(path, "w", newline="") as file:
+            if path.endswith(".csv"):
+                self.write_csv(file)
+            else:
+                self.write_json(file)
@@ -0,0 +1,393 @@
+"""
+Stack of stacks of Fish, each stack in a deque of its own
+
+The current stack is a deque, so that values are pushed and popped at either
+end in constant time. r flips a flag instead of reversing, after which the
+top of the current stack is at the left end of its deque, and { and } rotate
+the deque by one. The stacks below are kept as frames, each with its values
+and the register of that stack. [ moves whichever part of the current stack
+is smaller into a new frame or a new deque, and ] moves the smaller of the
+two stacks onto the other. Neither takes constant time: both copy the values
+they move, O(min(n, len - n)) for [ of n values off a stack of len, and
+O(min(len, len below)) for ]. Compact stacks move the top n values for [ and
+the whole current stack for ]. Constant time would take keeping all stacks
+as offsets into one shared store instead.
+
+The stack that instructions push to and pop from is the deque itself as long
+as it is not reversed, which is the common case. Otherwise it is a View of
+the deque from its other end.
+
+CompactStack keeps values in an array of machine integers instead, 8 bytes
+each rather than a pointer and an int object, for programs that push
+millions of values. It becomes a list once a value that does not fit is
+pushed. Interpreters made with compact=True use it for their stack, and for
+the stacks of Stacks, which then reverses the current stack in place instead
+of flipping it, since an array is cheap to reverse but not to push to at the
+front.
+"""
+
+from array import array
+from collections import deque
+
+# Machine integers of 64 bits
+TYPECODE = "q"
+
+
+def _split(length: int, n) -> int:
+    """Where [ splits a stack, as the slices stack[:-n] and stack[-n:] would"""
+    return slice(None, -n).indices(length)[1]
+
+
+class View:
+    """The current stack when it is reversed, with its top at the left
+
+    Supports what Fish does with its stack: append, pop, extend, len, indexing
+    and iteration. append, pop and extend are bound methods of the deque.
+    """
+
+    __slots__ = ("store", "append", "pop", "extend")
+
+    def __init__(self, store):
+        self.store = store
+        self.append = store.appendleft
+        self.pop = store.popleft
+        self.extend = store.extendleft
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, i: int):
+        # Index i from the bottom is index -1 - i from the right of the deque
+        return self.store[~i]
+
+    def __setitem__(self, i: int, value):
+        self.store[~i] = value
+
+    def __iter__(self):
+        """Values from bottom to top"""
+        return reversed(self.store)
+
+    def __reversed__(self):
+        return iter(self.store)
+
+    def __eq__(self, other) -> bool:
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"View({list(self)!r})"
+
+
+class CompactStack:
+    """Values in an array of machine integers, or in a list once one does not fit
+
+    Supports what the interpreters do with their stack and Stacks with its
+    deque, with the same results and errors as a list.
+    """
+
+    __slots__ = ("values",)
+
+    EMPTY = "pop from empty list"
+    OUT_OF_RANGE = "list index out of range"
+
+    def __init__(self, values=()):
+        if isinstance(values, CompactStack):
+            self.values = values.values[:]
+        else:
+            self.values = array(TYPECODE)
+            self.extend(values)
+
+    @property
+    def promoted(self) -> bool:
+        """Whether a value did not fit, and the values are in a list"""
+        return type(self.values) is list
+
+    def _promote(self):
+        self.values = list(self.values)
+
+    def append(self, value):
+        try:
+            self.values.append(value)
+        except (OverflowError, TypeError):
+            self._promote()
+            self.values.append(value)
+
+    def extend(self, values):
+        if not isinstance(values, (list, tuple)):
+            # Read only once, in case the values do not fit
+            values = list(values)
+        start = len(self.values)
+        try:
+            self.values.extend(values)
+        except (OverflowError, TypeError):
+            # Not an array, so the values that did fit were added one by one
+            del self.values[start:]
+            self._promote()
+            self.values.extend(values)
+
+    def insert(self, i: int, value):
+        try:
+            self.values.insert(i, value)
+        except (OverflowError, TypeError):
+            self._promote()
+            self.values.insert(i, value)
+
+    def pop(self, i: int = -1):
+        try:
+            return self.values.pop(i)
+        except IndexError:
+            message = self.EMPTY if not self.values else "pop index out of range"
+            raise IndexError(message) from None
+
+    def appendleft(self, value):
+        self.insert(0, value)
+
+    def extendleft(self, values):
+        for value in values:
+            self.insert(0, value)
+
+    def popleft(self):
+        return self.pop(0)
+
+    def rotate(self, n: int = 1):
+        values = self.values
+        if not len(values):
+            return
+        if n == 1:
+            # { and } move a single value, without making new arrays
+            values.insert(0, values.pop())
+        elif n == -1:
+            values.append(values.pop(0))
+        elif n % len(values):
+            n %= len(values)
+            values[:] = values[-n:] + values[:-n]
+
+    def reverse(self):
+        self.values.reverse()
+
+    def cut(self, at: int):
+        """Remove the values from index at on, and return them as a new stack"""
+        stack = type(self).__new__(type(self))
+        stack.values = self.values[at:]
+        del self.values[at:]
+        return stack
+
+    def clear(self):
+        del self.values[:]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, i: int):
+        try:
+            return self.values[i]
+        except IndexError:
+            raise IndexError(self.OUT_OF_RANGE) from None
+
+    def __setitem__(self, i: int, value):
+        try:
+            self.values[i] = value
+        except IndexError:
+            raise IndexError(self.OUT_OF_RANGE) from None
+        except (OverflowError, TypeError):
+            self._promote()
+            self.values[i] = value
+
+    def __delitem__(self, i: int):
+        del self.values[i]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __reversed__(self):
+        return reversed(self.values)
+
+    def __eq__(self, other) -> bool:
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({list(self)!r})"
+
+
+class CompactDeque(CompactStack):
+    """CompactStack in place of the deque of Stacks, with the errors of a deque"""
+
+    __slots__ = ()
+
+    EMPTY = "pop from an empty deque"
+    OUT_OF_RANGE = "deque index out of range"
+
+
+class Stacks:
+    """All stacks of a Fish program
+
+    The methods for the instructions take the stack that the program used so
+    far and return the one to use from then on. A stack that is not current
+    (as when a list is assigned to Fish.stack) replaces the current one first.
+    """
+
+    __slots__ = ("store", "base", "flipped", "frames", "current", "compact")
+
+    def __init__(self, values=(), compact: bool = False):
+        self.compact = compact
+        # Values of the current stack
+        self.store = self._new(values)
+        # Number of values on the stacks below the current one
+        self.base = 0
+        # Whether the current stack is reversed, with its top at the left
+        self.flipped = False
+        # Values, whether they are reversed, and register of the stacks below
+        # the current one, bottom first. The values are in a deque (or
+        # CompactDeque) that was a current stack, or in a tuple.
+        self.frames = []
+        self.current = self.store
+
+    def _new(self, values=()):
+        return CompactDeque(values) if self.compact else deque(values)
+
+    def _update(self):
+        self.current = View(self.store) if self.flipped else self.store
+
+    def adopt(self, stack):
+        """Make stack the current stack, if it is not already"""
+        if stack is self.current:
+            return stack
+        self.store = self._new(list(stack))
+        self.flipped = False
+        self._update()
+        return self.current
+
+    def depth(self, stack) -> int:
+        """Number of values on all stacks, with stack as the current one"""
+        return self.base + len(stack)
+
+    def reverse(self, stack):
+        stack = self.adopt(stack)
+        if self.compact:
+            self.store.reverse()
+            return stack
+        self.flipped = not self.flipped
+        self._update()
+        return self.current
+
+    def shift_left(self, stack):
+        """Move the bottom value to the top"""
+        stack = self.adopt(stack)
+        if not len(stack):
+            raise IndexError("deque index out of range")
+        self.store.rotate(1 if self.flipped else -1)
+        return stack
+
+    def shift_right(self, stack):
+        """Move the top value to the bottom"""
+        stack = self.adopt(stack)
+        if not len(stack):
+            raise IndexError("deque index out of range")
+        self.store.rotate(-1 if self.flipped else 1)
+        return stack
+
+    def push_stack(self, stack, n, register):
+        """Move the top n values to a new stack, and remember the register
+
+        Copies the top n values or the rest, whichever is fewer.
+        """
+        stack = self.adopt(stack)
+        store = self.store
+        at = _split(len(store), n)
+        if self.compact:
+            # Compact stacks are never flipped, and cheap to cut at the end
+            self.store = store.cut(at)
+            frame = (store, False, register)
+        elif at <= len(store) - at:
+            # The values that stay below go to a tuple
+            pop = store.pop if self.flipped else store.popleft
+            frame = (tuple([pop() for _ in range(at)]), False, register)
+        else:
+            # The top values go to a new deque, the rest stays in this one
+            pop = store.popleft if self.flipped else store.pop
+            self.store = deque()
+            self.store.extendleft(pop() for _ in range(len(store) - at))
+            frame = (store, self.flipped, register)
+            self.flipped = False
+        self.frames.append(frame)
+        self.base += at
+        self._update()
+        return self.current
+
+    def pop_stack(self, stack) -> tuple:
+        """Put the values back on the stack below, with the register of that
+
+        Without a stack below, the stack is emptied instead. Copies the values
+        of this stack or the one below, whichever has fewer.
+        """
+        self.adopt(stack)
+        if not self.frames:
+            self.store.clear()
+            self.flipped = False
+            self._update()
+            return self.current, None
+        values, flipped, register = self.frames.pop()
+        self.base -= len(values)
+        store = self.store
+        if self.compact:
+            values.extend(store)
+            self.store = values
+        elif type(values) is deque and len(values) > len(store):
+            # Onto the top of the stack below
+            above = reversed(store) if self.flipped else store
+            if flipped:
+                values.extendleft(above)
+            else:
+                values.extend(above)
+            self.store, self.flipped = values, flipped
+        else:
+            # Under the bottom of this stack, top first
+            below = iter(values) if flipped else reversed(values)
+            if self.flipped:
+                store.extend(below)
+            else:
+                store.extendleft(below)
+        self._update()
+        return self.current, register
+
+    def copy(self):
+        return Stacks.load(self.dump(), self.compact)
+
+    def dump(self) -> tuple:
+        """State of the stacks, with only what marshal supports
+
+        The values of all stacks bottom to top, but those of the current stack
+        as they are stored, whether it is flipped, and where each stack below
+        starts with its register.
+        """
+        values = []
+        frames = []
+        for stored, flipped, register in self.frames:
+            frames.append((len(values), register))
+            values.extend(reversed(stored) if flipped else stored)
+        values.extend(self.store)
+        return (values, self.base, self.flipped, frames)
+
+    @classmethod
+    def load(cls, state: tuple, compact: bool = False):
+        """Counterpart of dump"""
+        values, base, flipped, frames = state
+        stacks = cls(values[base:], compact)
+        ends = [start for start, _ in frames[1:]] + [base]
+        stacks.frames = [
+            (stacks._new(values[start:end]), False, register)
+            for (start, register), end in zip(frames, ends)
+        ]
+        stacks.base = base
+        if compact and flipped:
+            # Compact stacks are never flipped
+            stacks.store.reverse()
+        else:
+            stacks.flipped = flipped
+        stacks._update()
+        return stacks
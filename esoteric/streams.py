@@ -0,0 +1,149 @@
+"""
+Buffered input and output for headless runs
+
+Input is read ahead a line (or block) at a time instead of a character at a
+time, and output is collected and written in blocks according to a flush
+policy instead of with one write per instruction.
+"""
+
+from codecs import getincrementaldecoder
+from typing import Callable, Union
+
+# Flush policies:
+# block - write whenever block_size characters are buffered (and at the end)
+# line - also write on every newline
+# always - write on every output instruction
+FLUSH_POLICIES = ("block", "line", "always")
+
+BLOCK_SIZE = 8192
+
+EOF = -1
+
+# Only ASCII digits, str.isdigit() also accepts others like "²" that int() rejects
+DIGITS = "0123456789"
+
+
+class Input:
+    """Input read ahead from a string, bytes or a (text or binary) file"""
+
+    def __init__(self, source=""):
+        self.file = None
+        self.buffer = ""
+        self.at = 0
+        self.decoder = None
+        if isinstance(source, str):
+            self.buffer = source
+        elif isinstance(source, (bytes, bytearray)):
+            self.buffer = bytes(source).decode()
+        else:
+            self.file = source
+
+    @classmethod
+    def of(cls, source):
+        return source if isinstance(source, cls) else cls(source)
+
+    def _fill(self) -> bool:
+        """Read more input into the buffer, False at the end of it"""
+        if self.file is None:
+            return False
+        # A line at most, so that input from a terminal is seen as it is entered
+        chunk = self.file.readline(BLOCK_SIZE)
+        if not chunk:
+            self.file = None
+            return False
+        self._append(chunk)
+        return True
+
+    def _append(self, chunk):
+        """Add what was read to the buffer, decoding it if it is bytes"""
+        if not isinstance(chunk, str):
+            if self.decoder is None:
+                self.decoder = getincrementaldecoder("utf-8")()
+            chunk = self.decoder.decode(chunk)
+        self.buffer = self.buffer[self.at :] + chunk
+        self.at = 0
+
+    def peek(self) -> str:
+        """Next character without consuming it, empty at the end of input"""
+        while self.at >= len(self.buffer):
+            if not self._fill():
+                return ""
+        return self.buffer[self.at]
+
+    def read_char(self) -> int:
+        """Code point of the next character, or -1 at the end of input"""
+        c = self.peek()
+        if not c:
+            return EOF
+        self.at += 1
+        return ord(c)
+
+    def read_int(self) -> int:
+        """Next (possibly negative) decimal integer, or -1 at the end of input
+
+        Anything before the number is skipped, and the character after it is
+        left for the next read.
+        """
+        negative = False
+        while True:
+            c = self.peek()
+            if not c:
+                return EOF
+            self.at += 1
+            if c in DIGITS:
+                break
+            negative = c == "-"
+        digits = [c]
+        while (c := self.peek()) and c in DIGITS:
+            digits.append(c)
+            self.at += 1
+        value = int("".join(digits))
+        return -value if negative else value
+
+
+class Output:
+    """Output collected in blocks and written to a file or function
+
+    Without a target, everything is kept and can be had from getvalue().
+    """
+
+    def __init__(
+        self,
+        target: Union[Callable[[str], object], object] = None,
+        flush: str = "block",
+        block_size: int = BLOCK_SIZE,
+    ):
+        if flush not in FLUSH_POLICIES:
+            raise ValueError(f"No such flush policy: {flush}")
+        self.target = target
+        self.policy = flush
+        self.block_size = block_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, text: str):
+        self.parts.append(text)
+        if self.target is None:
+            return
+        self.size += len(text)
+        if (
+            self.policy == "always"
+            or self.size >= self.block_size
+            or (self.policy == "line" and "\n" in text)
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.target is None or not self.parts:
+            return
+        text = "".join(self.parts)
+        self.parts.clear()
+        self.size = 0
+        if callable(self.target):
+            self.target(text)
+        else:
+            self.target.write(text)
+            self.target.flush()
+
+    def getvalue(self) -> str:
+        return "".join(self.parts)
@@ -0,0 +1,560 @@
+"""
+Lockstep runs of one program over many initial values, with NumPy
+
+sweep() runs an instance of a program for every value, each starting with
+only that value on the stack, like --value does. The instances are run a step
+at a time together: their positions, deltas and stacks are NumPy arrays with
+a row per instance, and all instances that are at the same instruction run
+it as one array operation, wherever they are on the board.
+
+Anything that could make an instance do something else than its own run
+would (p, input, randomness, values that might overflow 64 bits, errors,
+teleports and more stacks in Fish) instead continues that instance on its
+own from where it is, with the engine of the program. So do the last few
+instances, once most of them are done. The results are those of eval() of
+every instance, with the same output, number of steps, and error or limit.
+
+Only the step and stack limits are applied in lockstep. Programs with a time
+limit or loop detection, or that have already been run, run every instance
+on its own.
+"""
+
+from math import inf
+
+try:
+    import numpy as np
+except ImportError as err:
+    raise ImportError(
+        "Sweeps need NumPy, install it with pip install -r requirements-sweep.txt"
+    ) from err
+
+from esoteric import batch
+from esoteric.fish import Fish
+from esoteric.interpreter import CHECK_INTERVAL
+from esoteric.stacks import Stacks
+from esoteric.streams import Input, Output
+
+# Values in lockstep are kept below this, so that + and - of them cannot
+# overflow 64 bits
+SMALL = 1 << 61
+# and * is only run in lockstep for values below this
+FACTOR = 1 << 30
+# Largest size of the stacks of all instances together, in bytes
+MAX_STACKS = 1 << 26
+# Fewer instances than this are run on their own instead
+MIN_LOCKSTEP = 4
+
+# Highest code point that chr() takes
+MAX_CHAR = 0x10FFFF
+
+QUOTE = ord('"')
+FISH_QUOTES = (ord("'"), ord('"'))
+# Opcode of Fish for cells that are not characters
+INVALID = 257
+
+
+def sweep(program, values, source="") -> list[dict]:
+    """Results of running program with each of values on the stack
+
+    Every instance reads the same input from source, a string. A result is a
+    dict with the "value", its "exit" code, "output" and "steps", and the
+    "error" and "limit" if any, like the results of esoteric.batch.
+    """
+    values = [v.item() if isinstance(v, np.integer) else v for v in values]
+    return Lockstep(program, values, source).run()
+
+
+def _checkpoint(limits, steps: int):
+    """Next step at which a run from the start would have checked its limits"""
+    if limits.stack is None:
+        return inf if limits.steps is None else limits.steps
+    checkpoint = -(-steps // CHECK_INTERVAL) * CHECK_INTERVAL
+    return checkpoint if limits.steps is None else min(checkpoint, limits.steps)
+
+
+# Every row of the arrays
+ALL = slice(None)
+
+
+class Lockstep:
+    """Instances of a program, and the rows of their state in arrays
+
+    Rows of instances that are done are dropped at the end of every step, so
+    that the steps where every row runs the same instruction work on whole
+    arrays. ids gives the instance of every row.
+    """
+
+    def __init__(self, program, values: list, source: str):
+        self.program = program
+        self.values = values
+        self.source = source
+        self.fish = isinstance(program, Fish)
+        n = len(values)
+        self.results = [None] * n
+        self.outputs = [[] for _ in range(n)]
+        self.steps = program.steps
+        width, height = self.width, self.height = program.width, program.height
+        # Opcodes of the cells, and the values that g and strings push
+        self.ops = np.array(program.code, np.int64)
+        if self.fish:
+            self.cells = np.array(
+                [program.grid.get(x, y) for y in range(height) for x in range(width)],
+                np.int64,
+            )
+        else:
+            self.cells = self.ops
+        self.handlers = self._fish_handlers() if self.fish else self._handlers()
+
+        limits = program.limits
+        if limits.time is not None or limits.loops is not None or program.steps:
+            small = np.zeros(n, bool)
+        else:
+            small = np.array(
+                [type(v) is int and -SMALL < v < SMALL for v in values], bool
+            )
+        self.ids = ids = np.flatnonzero(small)
+        rows = len(ids)
+        self.x = np.full(rows, program.x, np.int64)
+        self.y = np.full(rows, program.y, np.int64)
+        self.dx = np.full(rows, program.dx, np.int64)
+        self.dy = np.full(rows, program.dy, np.int64)
+        self.stringmode = np.full(rows, program.stringmode, bool)
+        # Values of the stack of every row, bottom first, and their number
+        self.stacks = np.zeros((rows, 8), np.int64)
+        self.stacks[:, 0] = [values[i] for i in ids.tolist()]
+        self.depths = np.ones(rows, np.int64)
+        # Whether r, { or } made the stack of Fish one of its Stacks, instead of
+        # the list it started as
+        self.adopted = np.zeros(rows, bool)
+        self._reshape()
+        for i in np.flatnonzero(~small).tolist():
+            self._finish(i, self._fork([values[i]]))
+
+    def _reshape(self):
+        """Set up what depends on the number of rows and size of the stacks"""
+        rows, capacity = self.stacks.shape
+        self.index = np.arange(rows)
+        # Where the stack of every row starts in the flat stacks
+        self.base = self.index * capacity
+        self.flat = self.stacks.reshape(-1)
+        self.finished = np.zeros(rows, bool)
+
+    def _compact(self):
+        """Drop the rows of instances that are done"""
+        if not self.finished.any():
+            return
+        keep = ~self.finished
+        for name in ("ids", "x", "y", "dx", "dy", "stringmode", "depths", "adopted"):
+            setattr(self, name, getattr(self, name)[keep])
+        self.stacks = self.stacks[keep]
+        self._reshape()
+
+    def run(self) -> list[dict]:
+        limits = self.program.limits
+        while len(self.ids):
+            if len(self.ids) < MIN_LOCKSTEP:
+                self.eject(ALL)
+                break
+            if limits.steps is not None and self.steps >= limits.steps:
+                # Stopped on their own, like they would be
+                self.eject(ALL)
+                break
+            if limits.stack is not None and self.steps % CHECK_INTERVAL == 0:
+                self.eject(np.flatnonzero(self.depths > limits.stack))
+                self._compact()
+                if not len(self.ids):
+                    break
+            self.step()
+        return self.results
+
+    def step(self):
+        cells = self.y * self.width + self.x
+        ops = self.ops[cells]
+        if self.stringmode.any():
+            strings = np.flatnonzero(self.stringmode)
+            rows = np.flatnonzero(~self.stringmode)
+            self._strings(strings, self.cells[cells[strings]])
+            ops = ops[rows]
+        else:
+            rows = ALL
+        if len(ops) and ops.min() == ops.max():
+            self._run(int(ops[0]), rows)
+        else:
+            rows = self.index[rows]
+            while len(ops):
+                op = ops[0]
+                same = ops == op
+                self._run(int(op), rows[same])
+                rows, ops = rows[~same], ops[~same]
+        self.steps += 1
+        self._compact()
+        self._move(self.x, self.dx, self.width)
+        self._move(self.y, self.dy, self.height)
+
+    def _run(self, op: int, idx):
+        handler = self.handlers.get(op)
+        if handler is not None:
+            handler(idx)
+
+    @staticmethod
+    def _move(x, dx, size: int):
+        # The extents of the board of Fish are those of its code until p
+        x += dx
+        if size < 3:
+            # A trampoline can skip past more than the whole board
+            np.mod(x, size, out=x)
+        else:
+            x -= size * (x >= size)
+            x += size * (x < 0)
+
+    def _strings(self, idx, values):
+        if self.fish:
+            quotes = np.isin(values, FISH_QUOTES)
+        else:
+            quotes = values == QUOTE
+        self.stringmode[idx[quotes]] = False
+        idx, values = idx[~quotes], values[~quotes]
+        needed = self.depths[idx] + 1
+        if len(needed) and needed.max() > self.stacks.shape[1]:
+            kept = np.isin(idx, self.room(idx, 1))
+            idx, values = idx[kept], values[kept]
+        self.push(idx, values)
+
+    def pick(self, idx, mask):
+        """Rows of idx for which mask is true"""
+        return self.index[idx][mask]
+
+    # Running instances on their own
+
+    def _fork(self, values: list):
+        vm = self.program.fork()
+        # Onto the stack the program has, which may be compact
+        vm.stack.extend(values)
+        return vm
+
+    def _finish(self, i: int, vm):
+        output = Output()
+        status = batch.outcome(lambda: vm._drive(output, Input(self.source)))
+        self.results[i] = {
+            "value": self.values[i],
+            "exit": status.pop("exit"),
+            "output": "".join(self.outputs[i]) + output.getvalue(),
+            "steps": vm.steps,
+            **status,
+        }
+
+    def eject(self, idx):
+        """Continue these rows on their own, from before the current step"""
+        for row in self.index[idx].tolist():
+            vm = self._fork(self.stacks[row, : self.depths[row]].tolist())
+            if self.adopted[row]:
+                vm.stacks = Stacks(vm.stack, compact=vm.stacks.compact)
+                vm.stack = vm.stacks.current
+            vm.x, vm.y = int(self.x[row]), int(self.y[row])
+            vm.dx, vm.dy = int(self.dx[row]), int(self.dy[row])
+            vm.stringmode = bool(self.stringmode[row])
+            vm.steps = self.steps
+            vm.checkpoint = _checkpoint(vm.limits, self.steps)
+            self._finish(int(self.ids[row]), vm)
+            self.finished[row] = True
+
+    def require(self, idx, ok):
+        """Rows of idx for which ok is true, ejecting the others"""
+        if ok.all():
+            return idx
+        self.eject(self.pick(idx, ~ok))
+        return self.pick(idx, ok)
+
+    def halt(self, idx):
+        for i in self.ids[idx].tolist():
+            self.results[i] = {
+                "value": self.values[i],
+                "exit": 0,
+                "output": "".join(self.outputs[i]),
+                "steps": self.steps + 1,
+            }
+        self.finished[idx] = True
+
+    def _write(self, idx, values):
+        """Add values to the output of the instances of idx"""
+        for i, value in zip(self.ids[idx].tolist(), values):
+            self.outputs[i].append(value)
+
+    # Stacks
+
+    def room(self, idx, n: int):
+        """Rows of idx with room for n more values, after growing the stacks"""
+        needed = self.depths[idx] + n
+        capacity = self.stacks.shape[1]
+        if not len(needed) or needed.max() <= capacity:
+            return idx
+        grown = max(capacity * 2, int(needed.max()))
+        if self.stacks.shape[0] * grown * 8 <= MAX_STACKS:
+            stacks = np.zeros((self.stacks.shape[0], grown), np.int64)
+            stacks[:, :capacity] = self.stacks
+            finished = self.finished
+            self.stacks = stacks
+            self._reshape()
+            self.finished = finished
+        return self.require(idx, needed <= self.stacks.shape[1])
+
+    def top(self, idx, n: int = 1):
+        """Value n from the top of the stacks of idx"""
+        return self.flat[self.base[idx] + self.depths[idx] - n]
+
+    def pop(self, idx, n: int = 1):
+        self.depths[idx] -= n
+
+    def push(self, idx, values):
+        self.flat[self.base[idx] + self.depths[idx]] = values
+        self.depths[idx] += 1
+
+    def replace(self, idx, n: int, values):
+        """Pop n values of idx, and push values instead"""
+        self.flat[self.base[idx] + self.depths[idx] - n] = values
+        self.depths[idx] -= n - 1
+
+    def depth(self, idx, n: int):
+        """Rows of idx with at least n values, ejecting the others to fail"""
+        return self.require(idx, self.depths[idx] >= n)
+
+    # Instructions of both languages
+
+    def _number(self, n: int):
+        def handler(idx):
+            self.push(self.room(idx, 1), n)
+
+        return handler
+
+    def _direction(self, dx: int, dy: int):
+        def handler(idx):
+            self.dx[idx] = dx
+            self.dy[idx] = dy
+
+        return handler
+
+    def _binary(self, op, limit: int = SMALL, nonzero: bool = False):
+        def handler(idx):
+            idx = self.depth(idx, 2)
+            a, b = self.top(idx, 1), self.top(idx, 2)
+            ok = (np.abs(a) < limit) & (np.abs(b) < limit)
+            if nonzero:
+                ok &= a != 0
+            if not ok.all():
+                idx = self.require(idx, ok)
+                a, b = a[ok], b[ok]
+            self.replace(idx, 2, op(a, b))
+
+        return handler
+
+    def _stringmode(self, idx):
+        self.stringmode[idx] = True
+
+    def _output_int(self, idx):
+        idx = self.depth(idx, 1)
+        values = self.top(idx)
+        self.pop(idx)
+        self._write(idx, map(str, values.tolist()))
+
+    def _output_char(self, idx):
+        idx = self.depth(idx, 1)
+        values = self.top(idx)
+        ok = (values >= 0) & (values <= MAX_CHAR)
+        if not ok.all():
+            idx = self.require(idx, ok)
+            values = values[ok]
+        self.pop(idx)
+        self._write(idx, map(chr, values.tolist()))
+
+    def _trampoline(self, idx):
+        self.x[idx] += self.dx[idx]
+        self.y[idx] += self.dy[idx]
+
+    def _discard(self, idx):
+        self.pop(self.depth(idx, 1))
+
+    def _handlers(self) -> dict:
+        """Befunge"""
+        handlers = {
+            ord('"'): self._stringmode,
+            ord("@"): self.halt,
+            ord("."): self._output_int,
+            ord(","): self._output_char,
+            ord("g"): self._get,
+            ord("_"): self._if(horizontal=True),
+            ord("|"): self._if(horizontal=False),
+            ord("#"): self._trampoline,
+            ord(">"): self._direction(1, 0),
+            ord("v"): self._direction(0, 1),
+            ord("<"): self._direction(-1, 0),
+            ord("^"): self._direction(0, -1),
+            ord("+"): self._binary(lambda a, b: b + a),
+            ord("-"): self._binary(lambda a, b: b - a),
+            ord("*"): self._binary(lambda a, b: b * a, FACTOR),
+            # Like in Python, % keeps the sign of the divisor and / rounds down
+            ord("%"): self._binary(lambda a, b: np.mod(b, a), nonzero=True),
+            ord("/"): self._binary(lambda a, b: b // a, nonzero=True),
+            ord("`"): self._binary(lambda a, b: (b > a).astype(np.int64)),
+            ord("!"): self._not,
+            ord(":"): self._duplicate,
+            ord("\\"): self._swap,
+            ord("$"): self._discard,
+        }
+        for n in range(10):
+            handlers[ord(str(n))] = self._number(n)
+        for c in "&~p?":
+            handlers[ord(c)] = self.eject
+        return handlers
+
+    def _get(self, idx):
+        idx = self.depth(idx, 2)
+        y, x = self.top(idx, 1), self.top(idx, 2)
+        # Cells outside of the board (or codebox, as nothing was written) are 0
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        values = np.zeros(len(x), np.int64)
+        values[inside] = self.cells[y[inside] * self.width + x[inside]]
+        self.replace(idx, 2, values)
+
+    def _if(self, horizontal: bool):
+        def handler(idx):
+            # True if there is nothing to pop
+            true = self.depths[idx] == 0
+            values = self.pick(idx, ~true)
+            true[~true] = self.top(values) != 0
+            self.pop(values)
+            direction = np.where(true, -1, 1)
+            if horizontal:
+                self.dx[idx], self.dy[idx] = direction, 0
+            else:
+                self.dx[idx], self.dy[idx] = 0, direction
+
+        return handler
+
+    def _not(self, idx):
+        idx = self.depth(idx, 1)
+        self.replace(idx, 1, self.top(idx) == 0)
+
+    def _duplicate(self, idx):
+        idx = self.room(idx, 1)
+        empty = self.depths[idx] == 0
+        if empty.any():
+            self.push(self.pick(idx, empty), 0)
+            idx = self.pick(idx, ~empty)
+        self.push(idx, self.top(idx))
+
+    def _swap(self, idx):
+        idx = self.room(self.depth(idx, 1), 1)
+        # A single value is swapped with a 0
+        single = self.depths[idx] == 1
+        if single.any():
+            self.push(self.pick(idx, single), 0)
+            idx = self.pick(idx, ~single)
+        self._swap_top(idx, 2)
+
+    def _swap_top(self, idx, n: int):
+        """Reverse the top n values"""
+        ends = self.base[idx] + self.depths[idx]
+        tops = [self.flat[ends - k] for k in range(1, n + 1)]
+        for k, values in enumerate(tops):
+            self.flat[ends - n + k] = values
+
+    # Instructions of Fish
+
+    def _fish_handlers(self) -> dict:
+        handlers = {
+            ord("'"): self._stringmode,
+            ord('"'): self._stringmode,
+            ord(";"): self.halt,
+            ord("n"): self._output_int,
+            ord("o"): self._output_char,
+            ord("g"): self._get,
+            ord(">"): self._direction(1, 0),
+            ord("v"): self._direction(0, 1),
+            ord("<"): self._direction(-1, 0),
+            ord("^"): self._direction(0, -1),
+            ord("|"): self._mirror(lambda dx, dy: (-dx, dy)),
+            ord("_"): self._mirror(lambda dx, dy: (dx, -dy)),
+            ord("/"): self._mirror(lambda dx, dy: (-dy, -dx)),
+            ord("\\"): self._mirror(lambda dx, dy: (dy, dx)),
+            ord("!"): self._trampoline,
+            ord("?"): self._conditional_trampoline,
+            ord("+"): self._binary(lambda a, b: b + a),
+            ord("-"): self._binary(lambda a, b: b - a),
+            ord("*"): self._binary(lambda a, b: b * a, FACTOR),
+            ord("%"): self._binary(lambda a, b: np.mod(b, a), nonzero=True),
+            ord("="): self._binary(lambda a, b: (b == a).astype(np.int64)),
+            ord(")"): self._binary(lambda a, b: (b > a).astype(np.int64)),
+            ord("("): self._binary(lambda a, b: (b < a).astype(np.int64)),
+            ord(":"): self._fish_duplicate,
+            ord("@"): self._rotate,
+            ord("$"): self._fish_swap,
+            ord("~"): self._discard,
+            ord("l"): self._length,
+            ord("r"): self._reverse,
+            ord("{"): self._shift(left=True),
+            ord("}"): self._shift(left=False),
+            INVALID: self.eject,
+        }
+        for n in range(16):
+            handlers[ord(f"{n:x}")] = self._number(n)
+        for c in "ipx#.,[]&":
+            handlers[ord(c)] = self.eject
+        return handlers
+
+    def _mirror(self, turn):
+        def handler(idx):
+            # Copies, as the deltas of all rows are views that are written to
+            dx, dy = self.dx[idx].copy(), self.dy[idx].copy()
+            self.dx[idx], self.dy[idx] = turn(dx, dy)
+
+        return handler
+
+    def _conditional_trampoline(self, idx):
+        values = self.pick(idx, self.depths[idx] > 0)
+        skip = values[self.top(values) == 0]
+        self.pop(values)
+        self._trampoline(skip)
+
+    def _fish_duplicate(self, idx):
+        idx = self.room(self.depth(idx, 1), 1)
+        self.push(idx, self.top(idx))
+
+    def _rotate(self, idx):
+        # The top three values come back in reverse
+        self._swap_top(self.depth(idx, 3), 3)
+
+    def _fish_swap(self, idx):
+        self._swap_top(self.depth(idx, 2), 2)
+
+    def _length(self, idx):
+        idx = self.room(idx, 1)
+        self.push(idx, self.depths[idx].copy())
+
+    def _permute(self, idx, source):
+        """Rearrange the stacks of idx, with source giving the old index of each"""
+        self.adopted[idx] = True
+        rows = self.stacks[idx]
+        self.stacks[idx] = np.take_along_axis(rows, source, axis=1)
+
+    def _reverse(self, idx):
+        depths = self.depths[idx][:, None]
+        j = np.arange(self.stacks.shape[1])
+        self._permute(idx, np.where(j < depths, depths - 1 - j, j))
+
+    def _shift(self, left: bool):
+        def handler(idx):
+            idx = self.depth(idx, 1)
+            depths = self.depths[idx][:, None]
+            j = np.arange(self.stacks.shape[1])
+            if left:
+                # The bottom value goes to the top
+                source = np.where(
+                    j < depths - 1, j + 1, np.where(j == depths - 1, 0, j)
+                )
+            else:
+                source = np.where(
+                    (j > 0) & (j < depths), j - 1, np.where(j == 0, depths - 1, j)
+                )
+            self._permute(idx, source)
+
+        return handler
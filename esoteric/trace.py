@@ -0,0 +1,177 @@
+"""
+Trace compiler for Befunge
+
+Straight-line runs of cells between branches (_, |, ?), I/O, division and p
+are compiled into Python functions that apply the stack effect and the
+position update of the whole run in one call. Cells that end a trace are left
+to the table engine.
+"""
+
+from itertools import count
+
+QUOTE = ord('"')
+DIGITS = "0123456789"
+
+# Opcodes that end a trace
+EXITS = frozenset(map(ord, '@.,&~p?_|/'))
+
+# Number of times a trace head must be reached before it is compiled
+HOT = 2
+MAX_LENGTH = 256
+
+BINARY_OPS = {
+    "+": "{b} + {a}",
+    "-": "{b} - {a}",
+    "*": "{b} * {a}",
+    "%": "{b} % {a}",
+    "`": "int({b} > {a})",
+}
+
+DELTA_CHANGERS = {
+    ">": (1, 0),
+    "v": (0, 1),
+    "<": (-1, 0),
+    "^": (0, -1),
+}
+
+
+class Trace:
+    """A compiled run of cells.
+
+    run(vm, stack) expects at least depth values on the stack. It returns
+    False without any effect if an instruction fails, so that the run can be
+    repeated step by step to report the error at the right cell.
+    """
+
+    __slots__ = ("run", "depth", "cells", "length", "closed", "source")
+
+    def __init__(
+        self,
+        run,
+        depth: int,
+        cells: set[int],
+        length: int,
+        closed: bool,
+        source: str,
+    ):
+        self.run = run
+        self.depth = depth
+        self.cells = cells
+        # Number of steps the trace stands in for
+        self.length = length
+        # Whether the trace ends at an exit rather than at its length limit
+        self.closed = closed
+        self.source = source
+
+
+def _literal(expr: str):
+    try:
+        return int(expr)
+    except ValueError:
+        return None
+
+
+def compile_trace(code, width: int, height: int, x, y, dx, dy):
+    """Compile the run starting at (x, y) moving by (dx, dy), or None if it is empty"""
+    lines = []
+    stack = []  # Expressions on the symbolic stack
+    cells = set()
+    length = 0
+    seen = set()
+    pops = 0
+    names = count()
+    stringmode = False
+    closed = False
+
+    def pop() -> str:
+        nonlocal pops
+        if stack:
+            return stack.pop()
+        pops += 1
+        return f"t{pops - 1}"
+
+    def push(expr: str):
+        # Assign every computed value right away to keep the order of evaluation
+        name = f"v{next(names)}"
+        lines.append(f"{name} = {expr}")
+        stack.append(name)
+
+    while len(seen) < MAX_LENGTH:
+        state = (x, y, dx, dy, stringmode)
+        if state in seen:
+            break
+        seen.add(state)
+        i = y * width + x
+        op = code[i]
+        if stringmode:
+            if op == QUOTE:
+                stringmode = False
+            else:
+                stack.append(str(op))
+        elif op in EXITS:
+            closed = True
+            break
+        else:
+            c = chr(op)
+            if c in DIGITS:
+                stack.append(c)
+            elif c in BINARY_OPS:
+                a, b = pop(), pop()
+                expr = BINARY_OPS[c].format(a=a, b=b)
+                if _literal(a) is not None and _literal(b) is not None:
+                    try:
+                        stack.append(str(eval(expr)))
+                        expr = None
+                    except ArithmeticError:
+                        pass
+                if expr is not None:
+                    push(expr)
+            elif c == "!":
+                push(f"int(not {pop()})")
+            elif c == ":":
+                a = pop()
+                stack.extend([a, a])
+            elif c == "\\":
+                a, b = pop(), pop()
+                stack.extend([a, b])
+            elif c == "$":
+                pop()
+            elif c == "g":
+                a, b = pop(), pop()
+                push(f"vm.get({b}, {a})")
+            elif c in DELTA_CHANGERS:
+                dx, dy = DELTA_CHANGERS[c]
+            elif c == '"':
+                stringmode = True
+            elif c == "#":
+                x, y = (x + dx) % width, (y + dy) % height
+        cells.add(i)
+        length += 1
+        x, y = (x + dx) % width, (y + dy) % height
+
+    if not cells:
+        return None
+
+    source = ["def trace(vm, stack):"]
+    source += [f"    t{i} = stack.pop()" for i in range(pops)]
+    if lines:
+        source.append("    try:")
+        source += [f"        {line}" for line in lines]
+        source.append("    except Exception:")
+        if pops:
+            restore = ", ".join(f"t{i}" for i in reversed(range(pops)))
+            source.append(f"        stack.extend(({restore},))")
+        source.append("        return False")
+    if len(stack) == 1:
+        source.append(f"    stack.append({stack[0]})")
+    elif stack:
+        source.append(f"    stack.extend(({', '.join(stack)},))")
+    source.append(f"    vm.x, vm.y, vm.dx, vm.dy = {x}, {y}, {dx}, {dy}")
+    if stringmode:
+        source.append("    vm.stringmode = True")
+    source.append("    return True")
+    source = "\n".join(source)
+
+    namespace = {}
+    exec(source, namespace)
+    return Trace(namespace["trace"], pops, cells, length, closed, source)
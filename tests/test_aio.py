@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from esoteric import aio
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+from esoteric.interpreter import LimitExceeded, Limits
+
+HELLO = '"!olleh",,,,,,@'
+
+
+def test_eval():
+    program = Befunge.from_string(HELLO)
+    assert asyncio.run(aio.eval(program)) == "hello!"
+
+
+def test_input_from_a_stream_reader():
+    async def main():
+        reader = asyncio.StreamReader()
+        program = Befunge.from_string("&&+.@")
+        task = asyncio.create_task(aio.eval(program, reader))
+        # The program waits for input without blocking the loop
+        await asyncio.sleep(0.01)
+        assert not task.done()
+        reader.feed_data(b"12 3")
+        await asyncio.sleep(0.01)
+        # 3 could be the start of a longer number
+        assert not task.done()
+        reader.feed_eof()
+        return await task
+
+    assert asyncio.run(main()) == "15"
+
+
+def test_input_from_a_string():
+    program = Fish.from_string("ii+n;")
+    assert asyncio.run(aio.eval(program, "\x01\x02")) == "3"
+
+
+def test_async_target():
+    written = []
+
+    async def target(text):
+        written.append(text)
+
+    asyncio.run(aio.run(Befunge.from_string(HELLO), target=target))
+    assert "".join(written) == "hello!"
+
+
+def test_fairness_and_cancellation():
+    async def main():
+        outputs = [[] for _ in range(100)]
+        programs = [Fish.from_string("1n") for _ in outputs]
+        tasks = [
+            asyncio.create_task(aio.run(program, target=output.append, steps=100))
+            for program, output in zip(programs, outputs)
+        ]
+        await asyncio.sleep(0.2)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return programs, outputs
+
+    programs, outputs = asyncio.run(main())
+    # Every program got its turns, and slices were written out as they ended
+    steps = [program.steps for program in programs]
+    assert min(steps) > 0
+    assert max(steps) - min(steps) <= 200
+    assert all(output for output in outputs)
+
+
+def test_resume_after_cancelling_while_waiting_for_input():
+    async def main():
+        program = Befunge.from_string("~,@")
+        task = asyncio.create_task(aio.eval(program, asyncio.StreamReader()))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await aio.eval(program, "x")
+
+    assert asyncio.run(main()) == "x"
+
+
+def test_limits():
+    program = Befunge.from_string(">", limits=Limits(steps=10_000))
+    with pytest.raises(LimitExceeded):
+        asyncio.run(aio.eval(program))
+    assert program.steps == 10_000
+
+
+def test_resume_keeps_input_that_was_read_ahead():
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"abc")
+        reader.feed_eof()
+        program = Befunge.from_string("~,~,~,@")
+        task = asyncio.create_task(aio.eval(program, reader, steps=1))
+        # Runs the first ~, which reads all of the input, then yields
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert program.steps == 1
+        return await aio.eval(program, reader)
+
+    assert asyncio.run(main()) == "abc"
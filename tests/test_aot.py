@@ -0,0 +1,75 @@
+import random
+
+import pytest
+
+from esoteric import aot
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+
+
+def compiled(code: str) -> dict:
+    module = {}
+    exec(aot.translate(Fish.from_string(code)), module)
+    return module
+
+
+def interpreted(code: str, source: str = "", stack=()) -> str:
+    program = Fish.from_string(code)
+    program.stack = list(stack)
+    return program.eval(source)
+
+
+@pytest.mark.parametrize(
+    "path, stack",
+    [("examples/hello_world.fish", []), ("examples/factorial.fish", [10])],
+)
+def test_examples(path, stack):
+    with open(path) as file:
+        code = file.read()
+    assert compiled(code)["eval"]("", stack) == interpreted(code, "", stack)
+
+
+@pytest.mark.parametrize(
+    "code, source",
+    [
+        ("i:0(?;o", "echo"),
+        ("12345 3[r]n n n n n;", ""),
+        ("5[1]ln;", ""),
+        ("1&2&n n;", ""),
+        ("123{n}nn;", ""),
+        ("123@nnn;", ""),
+        ("1 2$nn;", ""),
+        ("ab,n;", ""),
+        ("0?n1n;", ""),
+        ('"abc"rooo;', ""),
+        ("10g 01g nn;a", ""),
+        ("i0g n;", "\x01"),
+    ],
+)
+def test_same_output_as_interpreter(code, source):
+    assert compiled(code)["eval"](source) == interpreted(code, source)
+
+
+def test_random_directions():
+    run = compiled("x1n;\n2\nn\n;")["eval"]
+    random.seed(1)
+    outputs = {run() for _ in range(50)}
+    # Left and up wrap around to a ;
+    assert outputs == {"", "1", "2"}
+
+
+def test_errors_are_raised():
+    with pytest.raises(Exception, match="Division by zero"):
+        compiled("10,n;")["eval"]()
+    with pytest.raises(IndexError):
+        compiled("n;")["eval"]()
+
+
+def test_programs_that_cannot_be_compiled():
+    assert aot.check(Fish.from_string("12p;")) == ["p at (2, 0) writes to the codebox"]
+    assert aot.check(Fish.from_string("00.;")) == [
+        ". at (2, 0) teleports to a computed cell"
+    ]
+    assert aot.check(Befunge.from_string("@")) == ["only Fish programs are compiled"]
+    with pytest.raises(ValueError, match="writes to the codebox"):
+        aot.translate(Fish.from_string("12p;"))
@@ -0,0 +1,32 @@
+"""Jobs and results of the batch runner"""
+
+import json
+
+from esoteric import batch
+from esoteric.stacks import CompactDeque, CompactStack
+
+
+def test_repeated_programs_are_told_apart(tmp_path):
+    (tmp_path / "double.befunge").write_text("&2*.@")
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text(
+        "\n".join(
+            json.dumps({"path": "double.befunge", "stdin": stdin})
+            for stdin in ("1", "2", "3")
+        )
+    )
+    jobs = batch.collect(str(manifest), engine="table")
+    assert [job["index"] for job in jobs] == [0, 1, 2]
+    results = sorted(batch.run(jobs, 2), key=lambda result: result["index"])
+    assert [result["output"] for result in results] == ["2", "4", "6"]
+
+
+def test_compact_stack_keeps_the_value(tmp_path):
+    program = batch.load("n;", "fish", value=5, compact=True)
+    assert isinstance(program.stack, CompactDeque)
+    assert list(program.stack) == [5]
+    program = batch.load("@", "befunge", value=5, compact=True)
+    assert isinstance(program.stack, CompactStack)
+    (tmp_path / "print.fish").write_text("n;")
+    job = {"path": str(tmp_path / "print.fish"), "value": 7, "compact_stack": True}
+    assert batch.run_job(job)["output"] == "7"
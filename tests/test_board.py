@@ -0,0 +1,57 @@
+import pytest
+
+from esoteric.befunge import Befunge
+from esoteric.board import Board
+from esoteric.fish import Fish
+
+PROGRAMS = [
+    (Befunge, '"!olleh",,,,,,@'),
+    # Reads and writes rows of different lengths, with Windows line breaks
+    (Befunge, '12g,"z"11p11g,@\r\nab\r\n\r\ncdef'),
+    (Fish, "'a'o01go;\nx"),
+    (Fish, "'*'22p22go;\n\n\n"),
+    # Not ASCII, read as text instead
+    (Befunge, '"é",@'),
+]
+
+
+@pytest.mark.parametrize("language, code", PROGRAMS)
+@pytest.mark.parametrize("engine", ["classic", "table"])
+def test_same_as_from_string(tmp_path, language, code, engine):
+    path = tmp_path / "program"
+    path.write_bytes(code.encode())
+    loaded = language.from_file(str(path), engine=engine)
+    expected = language.from_string(code, engine=engine)
+    assert (loaded.width, loaded.height) == (expected.width, expected.height)
+    assert loaded.code == expected.code
+    if language is Fish:
+        assert sorted(loaded.grid.items()) == sorted(expected.grid.items())
+    assert loaded.eval("") == expected.eval("")
+    assert [list(row) for row in loaded.board] == [list(row) for row in expected.board]
+
+
+def test_rows_are_made_when_used(tmp_path):
+    path = tmp_path / "program.fish"
+    path.write_text("02go;\n" + "\n".join("x" * n for n in range(1, 100)))
+    program = Fish.from_file(str(path), engine="table")
+    assert isinstance(program.board, Board)
+    assert program.eval("") == "x"
+    # The table engine runs the decoded code, only the GUI reads the board
+    assert all(row is None for row in program.board.rows)
+    assert program.board[2] == ["x", "x"] + [" "] * 97
+
+
+def test_fork_copies_on_write(tmp_path):
+    path = tmp_path / "program.befunge"
+    path.write_text('"a"00p00g,@')
+    program = Befunge.from_file(str(path))
+    fork = program.fork()
+    assert fork.eval("") == "a"
+    assert program.board[0][0] == '"'
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "program.befunge"
+    path.write_text("")
+    with pytest.raises(ValueError):
+        Befunge.from_file(str(path))
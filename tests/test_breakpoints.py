@@ -0,0 +1,91 @@
+import pytest
+
+from esoteric.befunge import Befunge
+from esoteric.breakpoints import Breakpoints, compile_watch
+from esoteric.fish import Fish
+from esoteric.interpreter import Actions
+
+
+def run(program, breakpoints: Breakpoints, steps: int = 1000):
+    """Run like the GUI does, until a breakpoint or watch fires"""
+    for i in range(steps):
+        if i and (reason := breakpoints.before(program)) is not None:
+            return reason
+        _, action, value = program.step()
+        if (reason := breakpoints.after(program, action, value)) is not None:
+            return reason
+        if program.halted:
+            return None
+
+
+def test_cell_breakpoint():
+    program = Befunge.from_string("1>1+v\n ^  <")
+    breakpoints = Breakpoints(cells=[(4, 1)])
+    assert run(program, breakpoints) == "breakpoint at (4, 1)"
+    assert program.stack == [2]
+    assert run(program, breakpoints) == "breakpoint at (4, 1)"
+    assert program.stack == [3]
+
+
+def test_opcode_breakpoint():
+    program = Befunge.from_string('"ab",,@')
+    assert run(program, Breakpoints(opcodes=",")) == "breakpoint on ,"
+    assert program.x == 4
+
+
+def test_opcode_breakpoint_on_float_cell():
+    # Fish cells can hold any number, which is no opcode at all
+    program = Fish.from_string("!;")
+    program.grid.set(0, 0, 0.5)
+    assert Breakpoints(opcodes="!").before(program) is None
+
+
+def test_toggle():
+    breakpoints = Breakpoints()
+    assert not breakpoints
+    assert breakpoints.toggle(1, 2)
+    assert breakpoints.cells == {(1, 2)}
+    assert not breakpoints.toggle(1, 2)
+    assert not breakpoints
+
+
+@pytest.mark.parametrize(
+    "condition, steps",
+    [
+        ("depth > 2", 6),
+        ("top == 3", 42),
+        ("steps >= 7", 7),
+        ("output contains '4'", 66),
+    ],
+)
+def test_watches(condition, steps):
+    # Counts up and prints the count, in a loop of 19 steps
+    program = Fish.from_string("0>1+::?!;nv\n ^        <")
+    assert run(program, Breakpoints(watches=[condition])) == condition
+    assert program.steps == steps
+
+
+def test_register():
+    program = Fish.from_string("5&;")
+    assert run(program, Breakpoints(watches=["register == 5"])) == "register == 5"
+    assert program.steps == 2
+
+
+def test_empty_stack_is_not_a_match():
+    condition = compile_watch("top != 1")
+    program = Befunge.from_string("@")
+    assert not condition(program, None)
+    program.stack.append("a")
+    assert not compile_watch("top > 1")(program, None)
+
+
+@pytest.mark.parametrize("text", ["stack > 1", "top >", "depth > x", "top ~ 1"])
+def test_invalid_watches(text):
+    with pytest.raises(ValueError):
+        compile_watch(text)
+
+
+def test_output_is_only_kept_if_watched():
+    breakpoints = Breakpoints(watches=["depth > 100"])
+    breakpoints.after(Befunge.from_string("@"), Actions.OUTPUT, "a")
+    assert breakpoints.output is None
@@ -0,0 +1,103 @@
+import io
+import json
+
+from esoteric.befunge import Befunge
+from esoteric.cfg import ControlFlowGraph
+from esoteric.fish import Fish
+
+
+def graph(language, code: str) -> ControlFlowGraph:
+    return ControlFlowGraph(language.from_string(code))
+
+
+def test_straight_line_is_one_block():
+    cfg = graph(Befunge, '"ih",,@')
+    assert len(cfg.blocks) == 1
+    assert cfg.blocks[0].code == '"ih",,@'
+    assert cfg.edges == []
+    assert cfg.unsound() == []
+
+
+def test_branches_and_unreachable_cells():
+    cfg = graph(Befunge, "v  12\n>&_1.@\n  >2.@")
+    labels = sorted(label for _, _, label in cfg.edges if label)
+    assert labels == ["false", "true"]
+    # Going left from _ leads back to the & through the >
+    assert len(cfg.edges) == 4
+    assert (5, 1) in cfg.reachable
+    assert cfg.unreachable() == {(3, 0), (4, 0), (2, 2), (3, 2), (4, 2), (5, 2)}
+
+
+def test_loops_join_at_a_block():
+    cfg = graph(Befunge, ">1v\n^ <")
+    # The loop is entered from the start and from the end of the loop itself
+    assert [block.code for block in cfg.blocks] == [">", "1v< ^>"]
+    assert cfg.edges == [(0, 1, ""), (1, 1, "")]
+
+
+def test_random_directions():
+    cfg = graph(Befunge, "?@")
+    assert [label for block, _, label in cfg.edges if block == 0] == ["random"] * 4
+
+
+def test_constant_writes():
+    cfg = graph(Befunge, '"a"55p@\n\n\n\n\n\n')
+    assert cfg.writes == {(5, 0): {(5, 5)}}
+    assert cfg.unsound() == []
+    assert (5, 5) not in cfg.never_written()
+    assert (0, 5) in cfg.never_written()
+
+
+def test_self_modifying_code_is_unsound():
+    cfg = graph(Befunge, '"@"50p>')
+    assert cfg.writes == {(5, 0): {(5, 0)}}
+    assert cfg.unsound() == ["p at (5, 0) rewrites (5, 0), which is run"]
+    cfg = graph(Befunge, "&&&p@")
+    assert cfg.writes == {(3, 0): None}
+    assert cfg.never_written() is None
+    assert cfg.unsound() == ["p at (3, 0) writes to a computed cell"]
+
+
+def test_writes_are_computed_if_any_path_computes_them():
+    # p is reached after 1 2 going right, and after & & going up
+    cfg = graph(Befunge, "?12p@\n>&&^ ")
+    assert cfg.writes == {(3, 0): None}
+    assert cfg.never_written() is None
+    assert cfg.unsound() == ["p at (3, 0) writes to a computed cell"]
+
+
+def test_writes_of_every_path():
+    # p is reached after 1 2 going right, and after 3 2 going up
+    cfg = graph(Befunge, "?12p@\n>32^\n   @")
+    assert cfg.writes == {(3, 0): {(1, 2), (3, 2)}}
+    assert cfg.unsound() == ["p at (3, 0) rewrites (3, 2), which is run"]
+
+
+def test_fish():
+    cfg = graph(Fish, "1?\\;\n  \\01.")
+    assert sorted(label for _, _, label in cfg.edges) == ["nonzero", "zero"]
+    assert cfg.teleports == {(5, 1)}
+    assert cfg.unsound() == [". at (5, 1) teleports to a computed cell"]
+
+
+def test_fish_mirrors_and_skips():
+    cfg = graph(Fish, "!;/\n  ;")
+    assert cfg.reachable == {(0, 0), (2, 0), (2, 1)}
+    assert cfg.unreachable() == {(1, 0)}
+
+
+def test_export():
+    cfg = graph(Befunge, "v  12\n>&_1.@\n  >2.@")
+    file = io.StringIO()
+    cfg.write_json(file)
+    exported = json.loads(file.getvalue())
+    assert exported["entry"] == 0
+    assert len(exported["blocks"]) == len(cfg.blocks)
+    assert exported["unreachable"] == [[0, 3, 4], [2, 2, 5]]
+    assert exported["never_written"] == [[y, 0, 5] for y in range(3)]
+    file = io.StringIO()
+    cfg.write_dot(file)
+    dot = file.getvalue()
+    assert dot.startswith("digraph cfg {")
+    assert '[label="true"]' in dot
+    assert dot.count("->") == len(cfg.edges)
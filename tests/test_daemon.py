@@ -0,0 +1,60 @@
+import io
+import os
+import time
+from multiprocessing import Process
+
+import pytest
+
+from esoteric import daemon
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    path = str(tmp_path / "esoteric.sock")
+    server = Process(target=daemon.serve, args=(path, 2))
+    server.start()
+    for _ in range(500):
+        if os.path.exists(path):
+            break
+        time.sleep(0.01)
+    yield path
+    server.terminate()
+    server.join()
+    assert not os.path.exists(path)
+
+
+def run(path, streamed=b"", **request):
+    stdout = io.StringIO()
+    result = daemon.connect(path, request, io.BytesIO(streamed), stdout)
+    return stdout.getvalue(), result
+
+
+def test_run_and_cache(socket_path):
+    code = '"!olleh",,,,,,@'
+    output, result = run(socket_path, code=code)
+    assert output == "hello!"
+    assert result["exit"] == 0
+    assert result["steps"] == 15
+    # Of five runs on two workers, one worker runs it again from its cache
+    results = [run(socket_path, code=code)[1] for _ in range(4)]
+    assert any(result["cached"] for result in results)
+
+
+def test_streamed_and_given_input(socket_path):
+    assert run(socket_path, b"21", code="&2*.@")[0] == "42"
+    assert run(socket_path, code="ii+n;", language="fish", stdin="\x01\x02")[0] == "3"
+
+
+def test_limits_and_errors(socket_path):
+    _, result = run(socket_path, code=">", max_steps=100)
+    assert (result["exit"], result["limit"], result["steps"]) == (2, "steps", 100)
+    _, result = run(socket_path, code="1;", engine="trace", language="fish")
+    assert result["exit"] == 1
+    assert "trace" in result["error"]
+
+
+def test_not_a_socket(tmp_path):
+    path = tmp_path / "file"
+    path.write_text("")
+    with pytest.raises(FileExistsError):
+        daemon.serve(str(path))
@@ -0,0 +1,40 @@
+import pytest
+
+from esoteric.fish import Fish
+from esoteric.interpreter import Actions, coord, LimitExceeded, Limits
+
+
+def run(code: str, engine: str, steps: int = 1000, **kwargs):
+    """Positions and actions of the first steps of a program"""
+    program = Fish.from_string(code, engine=engine, **kwargs)
+    results = []
+    for _ in range(steps):
+        pos, action, value = program.step()
+        results.append((pos, action, value if action != Actions.ERROR else None))
+        if program.halted or action == Actions.ERROR:
+            break
+    return results, program.stack
+
+
+def test_teleport_to_float():
+    # , always gives a float, the position must not be truncated
+    code = "52,1.\n  n;"
+    classic = run(code, "classic")
+    table = run(code, "table")
+    assert table == classic
+    assert coord(2.5, 1) in [pos for pos, _, _ in classic[0]]
+
+
+def test_teleport_to_integral_float():
+    code = "42,1.\n  1n;"
+    assert run(code, "table") == run(code, "classic")
+    assert Fish.from_string(code, engine="table").eval("") == "1"
+
+
+def test_cell_limit_does_not_count_the_codebox():
+    # Writes 1 to the cells at x, 15 for x from 0 to 9, below 150 cells of code
+    code = "0>:1$fp1+:a=?;!" + "\n###############" * 10
+    for cells in (0, 5):
+        with pytest.raises(LimitExceeded):
+            Fish.from_string(code, limits=Limits(cells=cells)).eval()
+    Fish.from_string(code, limits=Limits(cells=10)).eval()
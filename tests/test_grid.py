@@ -0,0 +1,65 @@
+"""Memory use of the Fish grid for different write patterns"""
+
+from esoteric.grid import Grid
+
+
+def test_diagonal_stays_sparse():
+    grid = Grid(1, 1)
+    for n in range(4000):
+        grid.set(n, n, 1)
+    assert len(grid) < 10_000
+    assert all(grid.get(n, n) == 1 for n in range(4000))
+    assert grid.get(1, 2) == 0
+
+
+def test_rows_grow_dense():
+    grid = Grid(1, 1)
+    for y in range(100):
+        for x in range(100):
+            grid.set(x, y, x + y + 1)
+    assert not grid.sparse
+    assert len(grid) < 2 * 100 * 100
+    assert grid.used == 100 * 100
+    assert grid.get(99, 99) == 199
+
+
+def test_used_counts_cleared_and_boxed_cells():
+    grid = Grid(4, 4)
+    grid.set(0, 0, 1)
+    grid.set(1, 0, 2**70)
+    grid.set(2, 0, 0.5)
+    assert grid.used == 3
+    grid.set(0, 0, 0)
+    grid.set(1, 0, 0)
+    assert grid.used == 1
+    assert list(grid.sparse) == [(2, 0)]
+
+
+def test_added_counts_only_cells_that_set_filled():
+    grid = Grid.from_board([list("abc"), list("d  ")])
+    assert grid.added == 0
+    grid.set(0, 0, ord("x"))
+    grid.set(1, 1, 1)
+    grid.set(1000, 1000, 2**70)
+    assert grid.added == 2
+    grid.set(1000, 1000, 0)
+    assert grid.added == 1
+    # Clearing cells of the board does not count them out, only those that
+    # set() filled again
+    grid.set(0, 1, 0)
+    grid.set(0, 0, 0)
+    assert grid.added == 1
+    grid.set(1, 1, 0)
+    assert grid.added == 0
+    grid.set(0, 1, 1)
+    grid.set(2, 0, 0)
+    assert grid.added == 1
+    grid.set(0, 1, 0)
+    assert grid.added == 0
+    for y in range(2):
+        for x in range(3):
+            grid.set(x, y, 0)
+            assert grid.added >= 0
+    assert Grid.load(grid.dump()).codebox == grid.codebox
+    # Far away empty cells take up nothing
+    assert not grid.sparse
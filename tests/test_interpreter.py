@@ -0,0 +1,52 @@
+import pytest
+
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+from esoteric.interpreter import coord
+
+
+def test_pos_is_cached():
+    program = Befunge.from_string(">1+v\n^  <")
+    program.x, program.y = 2, 1
+    assert program.pos is program.pos
+    assert program.pos == coord(2, 1)
+
+
+def test_pos_outside_of_board():
+    program = Fish.from_string("1;")
+    program.x, program.y = -3, 7
+    assert program.pos == coord(-3, 7)
+
+
+def test_pos_of_floats():
+    program = Fish.from_string("1;\n2;")
+    program.x, program.y = 0.0, 1
+    assert program.pos == coord(0.0, 1)
+    program.x = 0.5
+    assert program.pos == coord(0.5, 1)
+
+
+@pytest.mark.parametrize("engine", Befunge.engines)
+def test_befunge_outside_of_board(engine):
+    # g reads 0 outside of the board, in a loop so that the trace engine
+    # compiles it
+    program = Befunge.from_string("3>:9-0g.1-:v\n ^         _@", engine=engine)
+    assert program.eval("") == "000"
+    # and p fails there
+    with pytest.raises(Exception, match=r"No such position \(9, 9\)"):
+        Befunge.from_string('"x"99p@', engine=engine).eval("")
+
+
+@pytest.mark.parametrize("engine", Befunge.engines)
+def test_befunge_wide_characters(engine):
+    program = Befunge.from_string('"é"00p00g.@', engine=engine)
+    assert isinstance(program.code, bytearray)
+    assert program.eval("") == "233"
+    program = Befunge.from_string("88*88**00p00g.@", engine=engine)
+    fork = program.fork()
+    assert program.eval("") == "4096"
+    assert program.board[0][0] == chr(4096)
+    # The fork still has the board as it was
+    assert fork.board[0][0] == "8"
+    with pytest.raises(Exception, match="not a character"):
+        Befunge.from_string("01-00p@", engine=engine).eval("")
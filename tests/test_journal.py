@@ -0,0 +1,101 @@
+import pytest
+
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+
+PROGRAMS = [
+    # Writes all over the board
+    (Befunge, "1>:3%2p:1+v\n ^        <\n\n"),
+    (Befunge, '0>:"a"+\\:9%3p1+:9`#v_\n ^                  <\n\n\n'),
+    # Swaps, duplicates and discards
+    (Befunge, "12>\\:$:v\n ^     <"),
+    # Rearranges the stack of stacks, and writes outside of the codebox
+    (Fish, "123[r{}]&&:2*:4%3p1+:0a-3p01.\n\n\n\n"),
+    (Fish, "1234[]]12[[r{{}}]}\n"),
+]
+
+
+def state(program):
+    """Everything a step may change, except the grid of Fish"""
+    saved = program._state()
+    saved.pop("grid", None)
+    grid = sorted(program.grid.items()) if isinstance(program, Fish) else None
+    return (
+        program.pos,
+        program.delta,
+        program.steps,
+        list(program.stack),
+        saved,
+        grid,
+    )
+
+
+@pytest.mark.parametrize("language, code", PROGRAMS)
+@pytest.mark.parametrize("engine", ["classic", "table"])
+@pytest.mark.parametrize("compact", [False, True])
+def test_back_restores_every_step(language, code, engine, compact):
+    program = language.from_string(code, engine=engine, compact=compact)
+    journal = program.start_journal(capacity=1000, interval=64)
+    states = [state(program)]
+    for _ in range(400):
+        program.step()
+        states.append(state(program))
+    for steps in [1, 2, 3, 100, 7, 150, 1]:
+        assert journal.back(steps) == steps
+        assert state(program) == states[program.steps]
+    # And forward again the same way
+    for _ in range(50):
+        program.step()
+        assert state(program) == states[program.steps]
+
+
+def test_register_in_use_is_not_boxed():
+    # Keeps a value in the register while it counts
+    program = Fish.from_string("5&0>1+:9%?v\n ^       <")
+    journal = program.start_journal()
+    for _ in range(500):
+        program.step()
+    assert program.register == 5
+    # Only the step of &
+    assert len(journal.boxed) == 1
+    journal.back(500)
+    assert program.register is None
+
+
+def test_capacity():
+    program = Befunge.from_string("1>:3%2p:1+v\n ^        <\n\n")
+    journal = program.start_journal(capacity=100, interval=32)
+    for _ in range(300):
+        program.step()
+    assert len(journal) == 100
+    assert journal.back(1000) == 100
+    assert program.steps == 200
+    assert journal.back() == 0
+
+
+def test_back_from_halt():
+    program = Befunge.from_string("12$$5@")
+    journal = program.start_journal()
+    results = list(program)
+    assert program.halted
+    assert len(results) == 6
+    journal.back(3)
+    assert not program.halted
+    assert program.stack == [1]
+    assert (program.x, program.y) == (3, 0)
+
+
+def test_back_from_put_off_the_board():
+    program = Befunge.from_string('"x"99p@')
+    journal = program.start_journal()
+    for _ in range(6):
+        program.step()
+    assert journal.back(6) == 6
+    assert program.stack == []
+    assert program.board[0] == '"x"99p@'
+
+
+def test_fork_has_no_journal():
+    program = Fish.from_string("1;")
+    program.start_journal()
+    assert program.fork().journal is None
@@ -0,0 +1,79 @@
+import subprocess
+import sys
+
+import pytest
+
+from esoteric import languages
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+
+
+def test_builtin_languages():
+    assert languages.get("fish") is Fish
+    assert languages.get("befunge") is Befunge
+    assert languages.of_path("examples/factorial.fish") == "fish"
+    # Anything else is Befunge, like .b93 or no extension at all
+    assert languages.of_path("program.b93") == "befunge"
+
+
+def test_unknown_language():
+    with pytest.raises(ValueError, match="Unknown language"):
+        languages.get("intercal")
+
+
+def test_register(monkeypatch):
+    monkeypatch.setattr(languages, "_registry", dict(languages._registry))
+    languages.register("shell", "esoteric.fish:Fish")
+    assert languages.of_path("hello.shell") == "shell"
+    assert languages.get("shell") is Fish
+    assert "shell" in languages.names()
+
+
+def test_extensions_look_up_only_their_entry_point(monkeypatch):
+    import importlib.metadata
+
+    looked_up = []
+
+    def entry_points(**selection):
+        looked_up.append(selection)
+        return []
+
+    monkeypatch.setattr(importlib.metadata, "entry_points", entry_points)
+    monkeypatch.setattr(languages, "_registry", dict(languages._registry))
+    monkeypatch.setattr(languages, "_entry_points_loaded", False)
+    monkeypatch.setattr(languages, "_looked_up", set())
+    assert languages.of_path("program.fish") == "fish"
+    assert looked_up == []
+    # A mistyped extension is looked up once, by its name alone
+    assert languages.of_path("program.fsh") == "befunge"
+    assert languages.of_path("other.fsh") == "befunge"
+    assert looked_up == [{"group": languages.ENTRY_POINTS, "name": "fsh"}]
+
+
+def test_headless_imports_no_gui():
+    code = (
+        "import sys\n"
+        "UNUSED = ('curses', 'esoteric.gui', 'esoteric.journal', 'esoteric.profile',"
+        " 'zlib')\n"
+        "from esoteric import batch, languages\n"
+        "languages.get('fish').from_string('1n;').eval()\n"
+        "languages.get('befunge').from_string('1.@').eval()\n"
+        "print(' '.join(m for m in UNUSED if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == ""
+
+
+def test_only_the_language_used_is_imported():
+    code = (
+        "import sys\n"
+        "from esoteric import languages\n"
+        "languages.get('fish')\n"
+        "print('esoteric.befunge' in sys.modules)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,93 @@
+import pytest
+
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+from esoteric.interpreter import LimitExceeded, Limits, NonTerminating
+
+
+def run(language, code, engine, steps=100_000, source=""):
+    program = language.from_string(
+        code, engine=engine, limits=Limits(steps=steps, loops=64)
+    )
+    output = []
+    with pytest.raises(LimitExceeded) as info:
+        program.run(source, output.append)
+    return info.value, program
+
+
+@pytest.mark.parametrize("engine", Befunge.engines)
+@pytest.mark.parametrize(
+    "code",
+    [
+        ">v\n^<",
+        # Outputs forever, which does not change the state
+        '"a",',
+        # Pushes and pops, and writes the same value over and over
+        "11v\n$ >:11p1+1-v\n  ^        <",
+    ],
+)
+def test_befunge_loops(engine, code):
+    err, program = run(Befunge, code, engine)
+    assert isinstance(err, NonTerminating)
+    assert err.limit == "loops"
+    assert "provably non-terminating" in str(err)
+    assert program.steps < 10_000
+
+
+@pytest.mark.parametrize("language", [Befunge, Fish])
+@pytest.mark.parametrize(
+    "code",
+    [
+        # Counts up forever
+        "1>1+v\n ^  <",
+        # Writes a counter all over the board
+        "1>1+::9%3pv\n ^        <\n\n\n",
+    ],
+)
+def test_changing_state_is_not_a_loop(language, code):
+    err, _ = run(language, code, "table", steps=20_000)
+    assert err.limit == "steps"
+
+
+@pytest.mark.parametrize("language, code", [(Befunge, "?"), (Fish, "x")])
+def test_randomness_is_not_a_loop(language, code):
+    err, _ = run(language, code, "table", steps=20_000)
+    assert err.limit == "steps"
+
+
+def test_input_is_not_a_loop():
+    err, _ = run(Befunge, "~$", "table", steps=20_000, source="")
+    assert err.limit == "steps"
+
+
+@pytest.mark.parametrize("engine", Fish.engines)
+@pytest.mark.parametrize("code", ["1~", "12[r{}]~", "'a'o", "1&&~"])
+def test_fish_loops(engine, code):
+    err, program = run(Fish, code, engine)
+    assert isinstance(err, NonTerminating)
+    assert program.steps < 10_000
+
+
+def test_halting_programs_run_as_before():
+    program = Fish.from_string("a>1-:?v;\n ^    <", limits=Limits(loops=1))
+    assert program.eval("") == ""
+    assert program.steps > 50
+    program = Befunge.from_string('"olleh",,,,,@', limits=Limits(loops=1))
+    assert program.eval("") == "hello"
+
+
+@pytest.mark.parametrize("language", [Befunge, Fish])
+def test_board_hash_is_incremental(language):
+    program = language.from_string("abc\ndef")
+    program.fingerprint()
+    program.put(1, 1, 120)
+    if language is Fish:
+        # Off the board, which Befunge does not allow
+        program.put(-1, 0, 32)
+    else:
+        program.put(0, 0, 32)
+    program.put(2, 1, ord("f"))
+    updated = program.board_hash
+    program.board_hash = None
+    program.fingerprint()
+    assert program.board_hash == updated
@@ -0,0 +1,69 @@
+"""Execution profiles of programs"""
+
+import csv
+import io
+import json
+
+import pytest
+
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+
+HELLO = '64+"!dlroW ,olleH">:#,_@'
+
+
+@pytest.mark.parametrize("engine", Befunge.engines)
+def test_profile_is_the_same_for_every_engine(engine):
+    program = Befunge.from_string(HELLO, engine=engine)
+    profile = program.start_profile()
+    assert program.eval("") == "Hello, World!\n"
+    assert profile.steps == program.steps
+    assert profile.cells[(0, 0)] == 1
+    # The loop prints 14 characters and exits on the 15th check,
+    # and string mode pushes one more ","
+    assert profile.opcodes[","] == 15
+    assert profile.opcodes["_"] == 15
+    assert profile.max_depth == 15
+
+
+def test_fish_profile():
+    program = Fish.from_string('"olleh"v\n      ;o<', engine="table")
+    profile = program.start_profile()
+    with pytest.raises(Exception):
+        program.eval("")
+    # Once in the string, five outputs and one on an empty stack
+    assert profile.opcodes["o"] == 7
+    assert profile.max_depth == 5
+
+
+def test_export():
+    program = Befunge.from_string(HELLO)
+    profile = program.start_profile()
+    program.eval("")
+    exported = json.loads(json.dumps(profile.to_dict()))
+    assert exported["steps"] == program.steps
+    assert exported["opcodes"][","] == 15
+    file = io.StringIO()
+    profile.write_csv(file)
+    rows = list(csv.DictReader(io.StringIO(file.getvalue())))
+    assert sum(int(row["count"]) for row in rows if row["kind"] == "cell") == (
+        program.steps
+    )
+    assert rows[-1]["kind"] == "max_depth"
+    assert rows[-1]["count"] == "15"
+
+
+def test_heat():
+    program = Befunge.from_string(HELLO)
+    profile = program.start_profile()
+    program.eval("")
+    heat = profile.heat(6)
+    assert heat[(0, 0)] == 1
+    assert max(heat.values()) == 5
+    assert (30, 0) not in heat
+
+
+def test_no_profile_by_default():
+    program = Befunge.from_string(HELLO, engine="trace")
+    assert program.profile is None
+    assert program._execute == program._trace
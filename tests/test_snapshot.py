@@ -0,0 +1,110 @@
+"""Snapshots and forks of interpreters"""
+
+import pytest
+
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+from esoteric.interpreter import Interpreter, LimitExceeded, Limits
+
+# Prints 9 to 1, rewriting a cell of its loop on every iteration
+BEFUNGE = '9v\n >:.:3%"1"+97+1p1-:0`!#@_'
+# Counts down from 10, keeping the count far outside the codebox and pushing
+# a stack for every iteration, and pops them all at the end
+FISH = "\n".join(
+    [
+        "a>::a*ff*p:a*ff*gn1[1-:?!\\v",
+        " ^                        <",
+        "            ;nl]]]]]]]]]]<",
+    ]
+)
+
+
+def run_in_parts(language, code: str, engine: str, steps: int) -> str:
+    """Output of a run that is snapshot and restored every steps steps"""
+    program = language.from_string(code, engine=engine, limits=Limits(steps=steps))
+    output = []
+    while True:
+        try:
+            program.run("", output.append)
+            return "".join(output)
+        except LimitExceeded:
+            pass
+        data = program.snapshot()
+        limits = Limits(steps=program.steps + steps)
+        program = Interpreter.restore(data, limits=limits)
+
+
+@pytest.mark.parametrize(
+    "language, code, engine",
+    [
+        *((Befunge, BEFUNGE, engine) for engine in Befunge.engines),
+        *((Fish, FISH, engine) for engine in Fish.engines),
+    ],
+)
+@pytest.mark.parametrize("steps", [1, 7, 50])
+def test_resume(language, code, engine, steps):
+    expected = language.from_string(code, engine=engine).eval("")
+    assert run_in_parts(language, code, engine, steps) == expected
+
+
+def test_snapshot_of_fish_state():
+    program = Fish.from_string("1234 2[&", engine="table")
+    for _ in range(8):
+        program.step()
+    program.put(10**6, -5, 2**70)
+    program.put(1, 1, 0.5)
+    restored = Fish.restore(program.snapshot())
+    assert list(restored.stack) == [3]
+    assert restored.register == 4
+    assert restored.stacks.dump() == program.stacks.dump()
+    assert restored.grid.get(10**6, -5) == 2**70
+    assert restored.grid.get(1, 1) == 0.5
+    assert (restored.minx, restored.miny, restored.maxx, restored.maxy) == (
+        program.minx,
+        program.miny,
+        program.maxx,
+        program.maxy,
+    )
+
+
+def test_restore_keeps_limits_that_are_not_given():
+    program = Befunge.from_string("@", limits=Limits(steps=10, stack=5))
+    data = program.snapshot()
+    # Like the command line does when only some limits are given
+    restored = Befunge.restore(data, limits=Limits(time=1.0))
+    assert restored.limits == Limits(steps=10, time=1.0, stack=5)
+    assert Befunge.restore(data, limits=Limits()).limits == program.limits
+    assert Befunge.restore(data).limits == program.limits
+
+
+def test_restore_checks_the_language():
+    data = Befunge.from_string("@").snapshot()
+    with pytest.raises(ValueError):
+        Fish.restore(data)
+    with pytest.raises(ValueError):
+        Befunge.restore(b"not a snapshot")
+    assert isinstance(Interpreter.restore(data), Befunge)
+
+
+@pytest.mark.parametrize("engine", Befunge.engines)
+def test_fork_copies_on_write(engine):
+    program = Befunge.from_string(BEFUNGE, engine=engine)
+    for _ in range(20):
+        program.step()
+    fork = program.fork()
+    assert fork.code is program.code
+    rest = program.eval("")
+    # The fork is unaffected by what the original wrote
+    assert fork.eval("") == rest
+    assert fork.code is not program.code
+
+
+def test_fish_fork_copies_on_write():
+    program = Fish.from_string(FISH, engine="table")
+    for _ in range(50):
+        program.step()
+    fork = program.fork()
+    assert fork.grid is program.grid
+    rest = program.eval("")
+    assert fork.eval("") == rest
+    assert fork.grid is not program.grid
@@ -0,0 +1,183 @@
+"""The stack of stacks of Fish must behave like the lists it replaces"""
+
+from collections import deque
+import random
+
+import pytest
+
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+from esoteric.interpreter import Interpreter
+from esoteric.stacks import CompactStack, Stacks
+
+
+class Reference:
+    """Stack of stacks as lists, as Fish used to keep them"""
+
+    def __init__(self):
+        self.stack = []
+        self.stackstack = []
+        self.register = None
+
+    def apply(self, op, value=None):
+        if op == "append":
+            self.stack.append(value)
+        elif op == "pop":
+            return self.stack.pop()
+        elif op == "r":
+            self.stack = list(reversed(self.stack))
+        elif op == "{":
+            self.stack = self.stack[1:] + [self.stack[0]]
+        elif op == "}":
+            self.stack = [self.stack[-1]] + self.stack[:-1]
+        elif op == "[":
+            n = value
+            self.stackstack.append((self.stack[:-n], self.register))
+            self.stack = self.stack[-n:]
+            self.register = None
+        elif op == "]":
+            if self.stackstack:
+                newstack, self.register = self.stackstack.pop()
+                self.stack = newstack + self.stack
+            else:
+                self.stack = []
+                self.register = None
+
+
+def apply(stacks: Stacks, stack, register, op, value=None):
+    popped = None
+    if op == "append":
+        stack.append(value)
+    elif op == "pop":
+        popped = stack.pop()
+    elif op == "r":
+        stack = stacks.reverse(stack)
+    elif op == "{":
+        stack = stacks.shift_left(stack)
+    elif op == "}":
+        stack = stacks.shift_right(stack)
+    elif op == "[":
+        stack = stacks.push_stack(stack, value, register)
+        register = None
+    elif op == "]":
+        stack, register = stacks.pop_stack(stack)
+    return popped, stack, register
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("seed", range(20))
+def test_same_as_lists(seed, compact):
+    rng = random.Random(seed)
+    reference = Reference()
+    stacks = Stacks(compact=compact)
+    stack = stacks.current
+    register = None
+    ops = ["append"] * 6 + ["pop"] * 3 + ["r", "{", "}", "[", "]", "&"]
+    for i in range(500):
+        op = rng.choice(ops)
+        if op == "&":
+            # Only to tell the registers of the stacks apart
+            reference.register = register = i
+            continue
+        value = rng.randrange(-3, 6) if op == "[" else i
+        if op == "append" and rng.random() < 0.01:
+            # Does not fit a compact stack
+            value = 2**64 + i
+        try:
+            expected = reference.apply(op, value)
+        except IndexError:
+            with pytest.raises(IndexError):
+                apply(stacks, stack, register, op, value)
+            continue
+        popped, stack, register = apply(stacks, stack, register, op, value)
+        assert popped == expected
+        assert stack is stacks.current
+        assert list(stack) == reference.stack
+        assert list(reversed(stack)) == reference.stack[::-1]
+        assert len(stack) == len(reference.stack)
+        assert register == reference.register
+        assert stacks.depth(stack) == len(reference.stack) + sum(
+            len(values) for values, _ in reference.stackstack
+        )
+        if reference.stack:
+            assert stack[-1] == reference.stack[-1]
+            assert stack[0] == reference.stack[0]
+        assert list(stacks.copy().current) == reference.stack
+
+
+def test_rotate_is_not_a_copy():
+    program = Fish.from_string("{", engine="table")
+    program.stack.extend(range(10**6))
+    stack = program.stack
+    program.step()
+    assert program.stack is stack
+    assert stack[-1] == 0
+
+
+def test_assigned_stack_is_adopted():
+    program = Fish.from_string("r{", engine="table")
+    program.stack = [1, 2, 3]
+    program.step()
+    program.step()
+    assert list(program.stack) == [2, 1, 3]
+    assert program.depth() == 3
+
+
+def test_internal_state():
+    program = Fish.from_string("123r&4", engine="table")
+    for _ in range(6):
+        program.step()
+    assert program.internal_state() == ["Register:", "1", "Stack:", "4", "2", "3"]
+
+
+def test_compact_stack():
+    stack = CompactStack([1, 2, 3])
+    stack.extend([4, -(2**63)])
+    assert not stack.promoted
+    assert stack == [1, 2, 3, 4, -(2**63)]
+    stack.append(0.5)
+    assert stack.promoted
+    assert stack.pop() == 0.5
+    assert stack.pop() == -(2**63)
+    stack.extend(iter([2**70, 5]))
+    assert stack == [1, 2, 3, 4, 2**70, 5]
+    with pytest.raises(IndexError, match="pop from empty list"):
+        CompactStack().pop()
+
+
+@pytest.mark.parametrize(
+    "language, code",
+    [
+        (Befunge, '"dlrow ,olleh">:#,_@'),
+        (Befunge, "19+:*:*:*:*:*:*:*.@"),
+        (Fish, "1234[r]r{}l&&2,nnnn;"),
+        (Fish, "a:*:*:*:*:*:*:*n;"),
+    ],
+)
+@pytest.mark.parametrize("engine", ["classic", "table"])
+def test_compact_programs(language, code, engine):
+    expected = language.from_string(code, engine=engine)
+    program = language.from_string(code, engine=engine, compact=True)
+    assert program.eval("") == expected.eval("")
+    assert list(program.stack) == list(expected.stack)
+    restored = Interpreter.restore(program.snapshot())
+    assert restored.compact and restored.fork().compact
+    assert list(restored.stack) == list(program.stack)
+
+
+@pytest.mark.parametrize("n", [1, -1, 3, -5, 12])
+def test_compact_rotate_same_as_deque(n):
+    values = [1, 2**63 - 1, -5, 7, 0, 2**64]
+    for end in (len(values) - 1, len(values)):
+        stack, expected = CompactStack(values[:end]), deque(values[:end])
+        stack.rotate(n)
+        expected.rotate(n)
+        assert stack == expected
+
+
+@pytest.mark.parametrize(
+    "code", ["12345{{}n{n}nnn;", "123r{}}r{nnn;", "123452[{}}n]{nnn;"]
+)
+def test_compact_shifts_same_as_deque(code):
+    expected = Fish.from_string(code).eval("")
+    assert Fish.from_string(code, compact=True).eval("") == expected
@@ -0,0 +1,18 @@
+"""Reading numbers and characters from input"""
+
+from esoteric.streams import EOF, Input
+
+
+def test_read_int_skips_non_ascii_digits():
+    source = Input("²3 -12x٣4")
+    assert source.read_int() == 3
+    assert source.read_int() == -12
+    assert source.read_int() == 4
+    assert source.read_int() == EOF
+
+
+def test_read_int_leaves_the_next_character():
+    source = Input("42\n")
+    assert source.read_int() == 42
+    assert source.read_char() == ord("\n")
+    assert source.read_char() == EOF
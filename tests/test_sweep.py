@@ -0,0 +1,98 @@
+"""Lockstep runs of a program over many initial values"""
+
+import pytest
+
+from esoteric import batch
+from esoteric.befunge import Befunge
+from esoteric.fish import Fish
+from esoteric.interpreter import Limits
+from esoteric.streams import Input, Output
+
+pytest.importorskip("numpy")
+
+from esoteric.sweep import sweep  # noqa: E402
+
+
+def single(interpreter, code, value, limits=None, source=""):
+    """Result of running the program for one value on its own"""
+    program = interpreter.from_string(code, limits=limits)
+    program.stack = [value]
+    output = Output()
+    status = batch.outcome(lambda: program._drive(output, Input(source)))
+    return {
+        "value": value,
+        "exit": status.pop("exit"),
+        "output": output.getvalue(),
+        "steps": program.steps,
+        **status,
+    }
+
+
+@pytest.mark.parametrize(
+    "interpreter, code",
+    [
+        # Counts down, printing every value
+        (Befunge, ">:.:1-:#v_@\n^      <"),
+        # Prints the value in reverse, then divides by it, failing for 0
+        (Befunge, ':"ba",,.5\\/.@'),
+        # Overflows 64 bits for the larger values
+        (Befunge, "::*:*:*:*:*.@"),
+        # Writes to the board with p
+        (Befunge, ":7g,:3%00p.@"),
+        (Fish, open("examples/factorial.fish").read()),
+        (Fish, "1234r{}@$nnnnn;"),
+        (Fish, "'hi'oo:2%?!vn;\n       >1n;"),
+        # Reads input
+        (Fish, "i:n+n;"),
+    ],
+)
+def test_same_results_as_single_runs(interpreter, code):
+    # Negative values count down forever
+    limits = Limits(steps=2000)
+    values = list(range(-8, 40))
+    expected = [single(interpreter, code, value, limits, "xy") for value in values]
+    program = interpreter.from_string(code, limits=limits)
+    assert sweep(program, values, "xy") == expected
+
+
+def test_limits_stop_runs_like_on_their_own():
+    code = ">1+:v\n^   <"
+    limits = Limits(steps=1000, stack=3)
+    values = list(range(20))
+    expected = [single(Befunge, code, value, limits) for value in values]
+    assert sweep(Befunge.from_string(code, limits=limits), values) == expected
+    assert expected[0]["limit"] == "steps"
+
+
+def test_stack_limit():
+    # Pushes forever
+    code = "1"
+    limits = Limits(steps=1 << 16, stack=1000)
+    values = list(range(10))
+    expected = [single(Fish, code, value, limits) for value in values]
+    assert sweep(Fish.from_string(code, limits=limits), values) == expected
+    assert expected[0]["limit"] == "stack"
+
+
+def test_values_that_are_not_small():
+    values = [2**70, -(2**70), 3, 4, 5, 6]
+    results = sweep(Befunge.from_string("2*.@"), values)
+    assert [result["output"] for result in results] == [str(2 * v) for v in values]
+
+
+def test_runs_on_their_own_keep_a_compact_stack(monkeypatch):
+    from esoteric.sweep import Lockstep
+
+    compact = []
+    finish = Lockstep._finish
+
+    def _finish(self, i, vm):
+        compact.append(vm.stacks.compact)
+        finish(self, i, vm)
+
+    monkeypatch.setattr(Lockstep, "_finish", _finish)
+    # Rearranges the stack in lockstep, then reads input on its own
+    code = "1234r{}i$nnnnn;"
+    program = Fish.from_string(code, compact=True)
+    assert sweep(program, range(8)) == [single(Fish, code, v) for v in range(8)]
+    assert compact == [True] * 8
@@ -0,0 +1,75 @@
+"""The trace engine must behave exactly like the classic engine"""
+
+import pytest
+
+from esoteric.befunge import Befunge
+from esoteric.interpreter import LimitExceeded, Limits
+
+
+def run(code: str, engine: str):
+    program = Befunge.from_string(code, engine=engine, limits=Limits(steps=100_000))
+    try:
+        output = program.eval("")
+        error = None
+    except LimitExceeded as err:
+        output = None
+        error = str(err)
+    except Exception as err:
+        output = None
+        error = err.args[0][0]
+    return output, error, program.steps, program.stack, program.pos
+
+
+def body(*rows: str) -> str:
+    return "\n".join(rows)
+
+
+# Counts down, rewriting the amount it counts down by (at column 16)
+# on every iteration
+SELF_MODIFYING = body("9v", ' >:.:3%"1"+97+1p1-:0`!#@_')
+
+PROGRAMS = {
+    "self-modifying": SELF_MODIFYING,
+    # Reads further and further to the right until g fails
+    "failing g": body("0v", " >1+:0g$"),
+    # Pops one value per iteration until the stack is empty
+    "underflow": body("12345v", "     >$"),
+    # Divides by a counter that reaches 0
+    "modulo by zero": body("5v", " >1-:5\\%$"),
+    # Writes the counter into the loop (at column 14) before pushing it
+    "p into trace": body("0v", ' >1+:"0"+27*1p0.:5`#@_'),
+    "hello world": '64+"!dlroW ,olleH">:#,_@',
+}
+
+
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_same_as_classic(name):
+    code = PROGRAMS[name]
+    assert run(code, "trace") == run(code, "classic")
+
+
+def test_traces_are_compiled():
+    program = Befunge.from_string(SELF_MODIFYING, engine="trace")
+    program.eval("")
+    assert any(program.traces.values())
+
+
+def test_put_invalidates_traces():
+    program = Befunge.from_string(SELF_MODIFYING, engine="trace")
+    program.eval("")
+    key, trace = next((k, t) for k, t in program.traces.items() if t)
+    x, y = divmod(next(iter(trace.cells)), program.width)[::-1]
+    program.put(x, y, ord(" "))
+    assert key not in program.traces
+
+
+def test_put_invalidates_empty_traces():
+    # Nothing to compile from an exit, until it is replaced
+    program = Befunge.from_string("_1+", engine="trace")
+    key = (0, 0, 1, 0)
+    program.traces[key] = program._compile(key)
+    assert program.traces[key] is False
+    program.put(0, 0, ord(">"))
+    assert key not in program.traces
+    program.traces[key] = program._compile(key)
+    assert program.traces[key]